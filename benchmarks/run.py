@@ -0,0 +1,395 @@
+"""Benchmark every route of the app against a seeded SQLite database.
+
+    python -m benchmarks.run --reservations 1000000 --threads 8 --output bench.json
+    python -m benchmarks.run --baseline bench.json      # diff against an earlier run
+    python -m benchmarks.run --scenario history_paging  # one of the focused scenarios in benchmarks/scenarios.py
+    python -m benchmarks.run --scenario export_memory --memory-cap-mb 16  # exits 1 when an export's peak is above 16 MB
+
+Each endpoint is hit `--requests` times, split over `--threads` worker threads that each drive
+their own Flask test client, and reported with p50/p95/p99 latency, throughput and the mean
+number of SQL statements per request.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from vehicle import create_app, db
+from vehicle.config import TestingConfig
+from vehicle.models import User, ParkingLot, ParkingSpot, Reservation, AdvanceBooking
+from benchmarks.seed import seed, BENCH_PASSWORD
+from benchmarks.scenarios import SCENARIOS as FOCUSED, Bench
+
+ADMIN_PASSWORD = 'admin-vp101'
+GATE_TOKEN = 'bench-gate-token'
+
+
+class QueryCounter:
+    # counts statements per thread; each test client request runs entirely in the calling thread
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def make_app(path, profile, **settings):
+    config = type('BenchmarkConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(path)}',
+        'SQLITE_PROFILE': profile,
+        'GATE_API_TOKEN': GATE_TOKEN,
+        **settings,
+    })
+    return create_app(config)
+
+
+class Worker:
+    # one per thread: logged-in admin and user clients plus a private counter for unique values
+
+    def __init__(self, app, index):
+        self.app = app
+        self.index = index
+        self.serial = itertools.count()
+        # generated plates/usernames must not collide with the ones left behind by earlier runs
+        self.run = f'{int(time.time()) % 16**5:05x}'
+        self.random = random.Random(f'{self.run}-{index}')
+        self.gate_plates = []
+        self.booked = None
+        self.booked_ahead = None
+        self.checked_in = None
+        self.anon = app.test_client()
+        self.admin = app.test_client()
+        self.admin.post('/login', data={'username': 'admin', 'pass_1': ADMIN_PASSWORD})
+        self.user = app.test_client()
+        self.username = f'bench{index}'
+        self.user.post('/login', data={'username': self.username, 'pass_1': BENCH_PASSWORD})
+        with app.app_context():
+            self.user_id = User.query.filter_by(username=self.username).one().id
+
+    def unique(self, prefix):
+        return f'{prefix}{self.run}{self.index:02d}{next(self.serial):05d}'
+
+
+def _lot(worker, offset=0):
+    with worker.app.app_context():
+        lot_ids = db.session.scalars(db.select(ParkingLot.lot_id).order_by(ParkingLot.lot_id)).all()
+    return lot_ids[(worker.index + offset) % len(lot_ids)]
+
+
+def _location(worker):
+    with worker.app.app_context():
+        return db.session.scalar(db.select(ParkingLot.primary_location).order_by(ParkingLot.lot_id))
+
+
+def _book(worker, lot_id):
+    plate = worker.unique('BK')
+    worker.user.post('/user/book_spot', data={'lot_id': lot_id, 'cost_per_hour': 30, 'no_of_hours': 2, 'vehicle_model': 'car', 'vehicle_number': plate})
+    with worker.app.app_context():
+        return db.session.scalar(db.select(Reservation.r_id).filter_by(nameplate_num=plate, actual_checkout_time=None))
+
+
+def _book_next(worker):
+    # releases the worker's previous booking first (untimed) so repeated runs do not fill the lots up
+    if worker.booked:
+        with worker.app.app_context():
+            r_id = db.session.scalar(db.select(Reservation.r_id).filter_by(nameplate_num=worker.booked, actual_checkout_time=None))
+        if r_id:
+            worker.user.post(f'/user/release_spot/{r_id}')
+    worker.booked = worker.unique('BS')
+    return {'method': 'POST', 'path': '/user/book_spot', 'data': {
+        'lot_id': _lot(worker, next(worker.serial)), 'cost_per_hour': 30, 'no_of_hours': 2, 'vehicle_model': 'car', 'vehicle_number': worker.booked}}
+
+
+def _window(worker, start=None):
+    # a random 1-4 hour window within the next two weeks, on the hour
+    start = start or (datetime.now() + timedelta(hours=worker.random.randrange(1, 14 * 24))).replace(minute=0, second=0, microsecond=0)
+    return start, worker.random.randrange(1, 5)
+
+
+def _book_ahead(worker, start=None):
+    plate = worker.unique('AB')
+    start, hours = _window(worker, start)
+    worker.user.post('/user/book_ahead', data={'lot_id': _lot(worker, next(worker.serial)), 'start_time': start.strftime('%Y-%m-%dT%H:%M'),
+                                               'no_of_hours': hours, 'vehicle_model': 'car', 'vehicle_number': plate})
+    with worker.app.app_context():
+        return db.session.scalar(db.select(AdvanceBooking.booking_id).filter_by(nameplate_num=plate, status='B'))
+
+
+def _book_ahead_next(worker):
+    # cancels the worker's previous advance booking first (untimed) so repeated runs do not fill the windows up
+    if worker.booked_ahead:
+        with worker.app.app_context():
+            booking_id = db.session.scalar(db.select(AdvanceBooking.booking_id).filter_by(nameplate_num=worker.booked_ahead, status='B'))
+        if booking_id:
+            worker.user.post(f'/user/advance_booking/{booking_id}/cancel')
+    worker.booked_ahead = worker.unique('AB')
+    start, hours = _window(worker)
+    return {'method': 'POST', 'path': '/user/book_ahead', 'data': {
+        'lot_id': _lot(worker, next(worker.serial)), 'start_time': start.strftime('%Y-%m-%dT%H:%M'), 'no_of_hours': hours,
+        'vehicle_model': 'car', 'vehicle_number': worker.booked_ahead}}
+
+
+def _check_in_next(worker):
+    # books a window starting this minute (untimed), releasing the previous check-in's spot first
+    if worker.checked_in:
+        with worker.app.app_context():
+            r_id = db.session.scalar(db.select(AdvanceBooking.r_id).filter_by(booking_id=worker.checked_in))
+        if r_id:
+            worker.user.post(f'/user/release_spot/{r_id}')
+    worker.checked_in = _book_ahead(worker, datetime.now().replace(second=0, microsecond=0))
+    return {'method': 'POST', 'path': f'/user/advance_booking/{worker.checked_in}/check_in'}
+
+
+def _availability(worker):
+    start, hours = _window(worker)
+    return {'method': 'GET', 'path': f'/api/lots/{_lot(worker, next(worker.serial))}/availability',
+            'query_string': {'start': start.isoformat(), 'end': (start + timedelta(hours=hours)).isoformat()}}
+
+
+def _new_lot(worker):
+    with worker.app.app_context():
+        lot = ParkingLot(primary_location='BenchTmp', full_address='Temporary', pincode='500001', max_spots=10, cost_per_unit=30)
+        db.session.add(lot)
+        db.session.flush()
+        ParkingSpot.provision(lot.lot_id, range(10))
+        ParkingLot.reconcile_counts([lot.lot_id])
+        db.session.commit()
+        return lot.lot_id
+
+
+def _gate_batch(worker, size=5):
+    # checks out the vehicles of the previous batch while checking in new ones, so lots do not fill up
+    plates = [worker.unique('GT') for _ in range(size)]
+    batch = {'checkins': [{'lot_id': _lot(worker, i), 'vehicle_number': plate, 'vehicle_model': 'car', 'hours': 1} for i, plate in enumerate(plates)],
+             'checkouts': [{'vehicle_number': plate} for plate in worker.gate_plates]}
+    worker.gate_plates = plates
+    return batch
+
+
+def _lot_form(lot_id, max_spots, location='BenchEdit'):
+    return {'primary_location': location, 'full_address': f'{lot_id} Bench Road', 'pincode': '500001', 'cost_per_unit': '30', 'max_spots': str(max_spots)}
+
+
+# name -> (client, prepare); prepare runs untimed and returns the keyword arguments of the timed request
+SCENARIOS = {
+    'welcome': ('anon', lambda w: {'method': 'GET', 'path': '/'}),
+    'login_form': ('anon', lambda w: {'method': 'GET', 'path': '/login'}),
+    'login': ('anon', lambda w: {'method': 'POST', 'path': '/login', 'data': {'username': w.username, 'pass_1': BENCH_PASSWORD}}),
+    'logout': ('anon', lambda w: {'method': 'GET', 'path': '/logout'}),
+    'register': ('anon', lambda w: {'method': 'POST', 'path': '/register', 'data': {
+        'first_name': 'Load', 'last_name': 'Test', 'email_address': f"{w.unique('reg')}@example.com", 'username': w.unique('reg'),
+        'pass_1': BENCH_PASSWORD, 'pass_2': BENCH_PASSWORD, 'contact_number': f"6{w.random.randrange(10**9):09d}",
+        'address': 'Bench Street', 'pincode': '500001'}}),
+    'admin_home': ('admin', lambda w: {'method': 'GET', 'path': '/admin/home'}),
+    'admin_create_lot': ('admin', lambda w: {'method': 'POST', 'path': '/admin/home', 'data': _lot_form(0, 10, 'BenchNew')}),
+    'admin_edit_lot': ('admin', lambda w: (lambda lot_id: {'method': 'POST', 'path': f'/admin/edit_lot/{lot_id}',
+                                                          'data': _lot_form(lot_id, 39 + next(w.serial) % 2)})(_lot(w))),
+    'admin_delete_lot': ('admin', lambda w: {'method': 'POST', 'path': f'/admin/delete_lot/{_new_lot(w)}'}),
+    'admin_events': ('admin', lambda w: {'method': 'GET', 'path': '/admin/events', 'stream': True}),
+    'admin_export_reservations': ('admin', lambda w: {'method': 'GET', 'path': '/admin/export/reservations.csv', 'query_string': {
+        'lot_id': _lot(w), 'start': (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')}}),
+    'admin_export_revenue': ('admin', lambda w: {'method': 'GET', 'path': '/admin/export/revenue.csv'}),
+    'admin_users': ('admin', lambda w: {'method': 'GET', 'path': '/admin/users'}),
+    'admin_user_history': ('admin', lambda w: {'method': 'GET', 'path': f'/admin/user_history/{w.user_id}'}),
+    'admin_edit_profile_form': ('admin', lambda w: {'method': 'GET', 'path': '/admin/edit_profile'}),
+    'admin_search_user': ('admin', lambda w: {'method': 'POST', 'path': '/admin/search', 'data': {'search_choice': 'u_id', 'search_string': str(w.user_id)}}),
+    'admin_search_location': ('admin', lambda w: {'method': 'POST', 'path': '/admin/search', 'data': {'search_choice': 'loc', 'search_string': _location(w)}}),
+    'admin_summary': ('admin', lambda w: {'method': 'GET', 'path': '/admin/summary'}),
+    'user_home': ('user', lambda w: {'method': 'GET', 'path': '/user/home'}),
+    'user_search': ('user', lambda w: {'method': 'POST', 'path': '/user/home', 'data': {'location': _location(w)}}),
+    'book_spot': ('user', _book_next),
+    'release_spot': ('user', lambda w: {'method': 'POST', 'path': f'/user/release_spot/{_book(w, _lot(w, 1))}'}),
+    'book_ahead': ('user', _book_ahead_next),
+    'check_in_booking': ('user', _check_in_next),
+    'cancel_booking': ('user', lambda w: {'method': 'POST', 'path': f'/user/advance_booking/{_book_ahead(w)}/cancel'}),
+    'user_edit_profile': ('user', lambda w: {'method': 'POST', 'path': '/user/edit_profile', 'data': {
+        'first_name': 'Bench', 'last_name': f'User{w.index}', 'email_address': f'bench{w.index}@example.com',
+        'contact_number': f'{7000000000 + w.index}', 'address': 'Bench Street', 'pincode': '500001'}}),
+    'user_summary': ('user', lambda w: {'method': 'GET', 'path': '/user/summary'}),
+    'api_lots': ('anon', lambda w: {'method': 'GET', 'path': '/api/lots', 'query_string': {'location': _location(w)}}),
+    'api_lot_availability': ('anon', _availability),
+    'api_gate_batch': ('anon', lambda w: {'method': 'POST', 'path': '/api/gate/batch', 'headers': {'Authorization': f'Bearer {GATE_TOKEN}'}, 'json': _gate_batch(w)}),
+}
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_scenario(workers, counter, name, requests, warmup=3):
+    role, prepare = SCENARIOS[name]
+
+    def drive(worker, count):
+        samples, first = [], None
+        client = getattr(worker, role)
+        for i in range(warmup + count):
+            kwargs = prepare(worker)
+            stream = kwargs.pop('stream', False)
+            counter.reset()
+            started = time.perf_counter()
+            response = client.open(**kwargs, buffered=not stream)
+            if stream:
+                next(response.response)
+            elapsed = time.perf_counter() - started
+            response.close()
+            if response.status_code >= 500:
+                raise RuntimeError(f"{name}: HTTP {response.status_code}")
+            # the first requests of every worker fill the caches and are not reported
+            if i >= warmup:
+                samples.append((elapsed, counter.count))
+                first = started if first is None else first
+        return samples, first, time.perf_counter()
+
+    shares = [requests // len(workers) + (1 if i < requests % len(workers) else 0) for i in range(len(workers))]
+    with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+        parts = list(pool.map(drive, workers, shares))
+    samples = [sample for part, _, _ in parts for sample in part]
+    wall = max(end for _, _, end in parts) - min(start for _, start, _ in parts if start is not None)
+
+    latencies = sorted(elapsed for elapsed, _ in samples)
+    return {'requests': len(samples), 'p50_ms': percentile(latencies, 0.50) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000, 'throughput_rps': len(samples) / wall,
+            'queries': sum(queries for _, queries in samples) / len(samples)}
+
+
+def report(results, baseline=None, threshold=20.0):
+    regressions = []
+    header = f"{'endpoint':28} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'queries':>8}"
+    print(header + ('   p95 vs baseline' if baseline else ''))
+    print('-' * (len(header) + (18 if baseline else 0)))
+    for name, r in results.items():
+        line = f"{name:28} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} {r['throughput_rps']:9.1f} {r['queries']:8.1f}"
+        previous = (baseline or {}).get(name)
+        if previous:
+            change = (r['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+            # mean query counts wobble a little with cache hits, a real N+1 shows up as a whole extra query
+            more_queries = r['queries'] > previous['queries'] + 0.5
+            flag = ' REGRESSION' if change > threshold or more_queries else ''
+            line += f"   {change:+7.1f}%{flag}"
+            if more_queries:
+                line += f" (queries {previous['queries']:.1f} -> {r['queries']:.1f})"
+            if flag:
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def report_scenario(name, rows):
+    columns = list(dict.fromkeys(column for row in rows.values() for column in row))
+    header = f"{name:28}" + ''.join(f" {column:>16}" for column in columns)
+    print(header)
+    print('-' * len(header))
+    for label, row in rows.items():
+        print(f"{label:28}" + ''.join(f" {row[column]:16.2f}" if isinstance(row.get(column), float) else f" {str(row.get(column, '')):>16}"
+                                      for column in columns))
+    print()
+
+
+def run_focused(args):
+    bench = Bench(args, make_app, ADMIN_PASSWORD)
+    results, over_cap = {}, []
+    try:
+        for name in args.scenario:
+            print(f"{name}:")
+            results[name] = FOCUSED[name](bench)
+            report_scenario(name, results[name])
+            if args.memory_cap_mb is not None:
+                over_cap += [f"{name}: {label} ({row['peak_mb']:.1f} MB)" for label, row in results[name].items()
+                             if row.get('peak_mb', 0) > args.memory_cap_mb]
+    finally:
+        bench.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'scenarios': results}, f, indent=2)
+    for line in over_cap:
+        print(f"OVER MEMORY CAP {line}")
+    return 1 if over_cap else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='instance/benchmark.db', help='SQLite file for the synthetic dataset')
+    parser.add_argument('--reseed', action='store_true', help='drop and reseed the database even if it exists')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--lots', type=int, default=40)
+    parser.add_argument('--spots-per-lot', type=int, default=40)
+    parser.add_argument('--reservations', type=int, help='closed reservations to seed (default 100000; each --scenario has its own default)')
+    parser.add_argument('--archived-fraction', type=float, default=0.1)
+    parser.add_argument('--profile', default='default', help='SQLITE_PROFILE to run with (default or production)')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=3, help='unreported requests per worker before timing starts')
+    parser.add_argument('--only', nargs='*', choices=sorted(SCENARIOS), help='limit the run to these endpoints')
+    parser.add_argument('--output', help='write the results as JSON (use it as a later --baseline)')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to diff against')
+    parser.add_argument('--threshold', type=float, default=20.0, help='p95 slowdown (%%) reported as a regression')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(FOCUSED), help='run these focused scenarios instead of the route suite')
+    parser.add_argument('--memory-cap-mb', type=float, help='with --scenario: exit 1 when a traced peak (peak_mb) exceeds this')
+    args = parser.parse_args(argv)
+    if args.scenario:
+        return run_focused(args)
+    if args.reservations is None:
+        args.reservations = 100000
+
+    if args.reseed:
+        for path in (args.db, f'{args.db}-wal', f'{args.db}-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+    fresh = not os.path.exists(args.db)
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app = make_app(args.db, args.profile)
+    runner = app.test_cli_runner()
+    if fresh:
+        runner.invoke(args=['init-db'])
+        runner.invoke(args=['seed-admin', '--password', ADMIN_PASSWORD])
+        with app.app_context():
+            started = time.perf_counter()
+            seed(users=max(args.users, args.threads), lots=args.lots, spots_per_lot=args.spots_per_lot,
+                 reservations=args.reservations, archived_fraction=args.archived_fraction)
+            print(f"seeded {args.db} in {time.perf_counter() - started:.1f}s")
+
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        dataset = {'users': db.session.scalar(db.select(db.func.count(User.id))), 'lots': db.session.scalar(db.select(db.func.count(ParkingLot.lot_id))),
+                   'reservations': db.session.scalar(db.select(db.func.count(Reservation.r_id)))}
+    settings = {'threads': args.threads, 'profile': args.profile, 'requests': args.requests}
+    print(f"dataset {dataset}, settings {settings}")
+    workers = [Worker(app, index) for index in range(args.threads)]
+
+    results = {}
+    for name in args.only or SCENARIOS:
+        results[name] = run_scenario(workers, counter, name, args.requests, args.warmup)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'dataset': dataset, 'settings': settings, 'results': results}, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            previous = json.load(f)
+        baseline = previous['results']
+        # datasets grow a little with every run (bookings, registrations), so only the order of magnitude is compared
+        if len(str(previous['dataset']['reservations'])) != len(str(dataset['reservations'])) or previous['settings']['threads'] != args.threads \
+                or previous['settings']['profile'] != args.profile:
+            print(f"warning: baseline was recorded with {previous['dataset']}, {previous['settings']}")
+    regressions = report(results, baseline, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
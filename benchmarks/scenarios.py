@@ -0,0 +1,732 @@
+"""Focused benchmarks: each one isolates a single hot path, or compares it with the implementation it replaced.
+
+    python -m benchmarks.run --scenario history_paging --reservations 100000
+    python -m benchmarks.run --scenario history_paging --output paging.json
+
+Scenarios that only read share a dataset that is seeded once per size under instance/bench-scenarios/
+(--reseed rebuilds it); scenarios that write get a throwaway database. Each returns one row of
+numbers per variant, printed as a table and written to --output.
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from sqlalchemy import event
+from vehicle import db
+from benchmarks.seed import seed
+
+SCENARIOS = {}
+DATASET_DIR = 'instance/bench-scenarios'
+
+
+def scenario(fn):
+    SCENARIOS[fn.__name__] = fn
+    return fn
+
+
+class Bench:
+    # what a scenario gets: the parsed arguments and a way to get a database of the right shape
+
+    def __init__(self, args, make_app, admin_password):
+        self.args = args
+        self._make_app = make_app
+        self._admin_password = admin_password
+        self._scratch = tempfile.TemporaryDirectory(prefix='bench-')
+        self.random = random.Random(42)
+
+    def size(self, default):
+        return self.args.reservations if self.args.reservations is not None else default
+
+    def dataset(self, name, profile='default', settings=None, **sizes):
+        # a seeded database kept between runs; the sizes are part of the file name
+        label = '-'.join(f'{key}{value}' for key, value in sorted(sizes.items()))
+        path = os.path.join(DATASET_DIR, f'{name}-{label}.db')
+        if self.args.reseed:
+            for stale in (path, f'{path}-wal', f'{path}-shm'):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        fresh = not os.path.exists(path)
+        os.makedirs(DATASET_DIR, exist_ok=True)
+        app = self._make_app(path, profile, **(settings or {}))
+        if fresh:
+            self._seed(app, sizes)
+        return app
+
+    def scratch(self, profile='default', settings=None, **sizes):
+        # a new database for scenarios that write; seeded when sizes are given
+        path = tempfile.mktemp(suffix='.db', dir=self._scratch.name)
+        app = self._make_app(path, profile, **(settings or {}))
+        with app.app_context():
+            db.create_all()
+        if sizes:
+            self._seed(app, sizes)
+        return app
+
+    def path(self, name):
+        # a file in this run's scratch directory
+        return os.path.join(self._scratch.name, name)
+
+    def admin(self, app):
+        # a logged-in admin client, creating the account on first use
+        app.test_cli_runner().invoke(args=['seed-admin', '--password', self._admin_password])
+        return login(app.test_client(), 'admin', self._admin_password)
+
+    def _seed(self, app, sizes):
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            seed(log=lambda *args: None, **sizes)
+            print(f"  seeded {sizes} in {time.perf_counter() - started:.1f}s")
+
+    def close(self):
+        self._scratch.cleanup()
+
+
+def percentile_ms(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000 if ordered else 0.0
+
+
+def median_ms(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def timed_and_traced(fn):
+    # wall time of one untraced run, then the tracemalloc peak of a second one (tracing slows allocation down)
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+@contextmanager
+def statements(engine):
+    # counts the SQL statements executed inside the block (executemany counts once)
+    counted = []
+
+    def count(*args):
+        counted.append(1)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield counted
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def ok(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.path}: HTTP {response.status_code}")
+    return response
+
+
+def login(client, username, password):
+    client.post('/login', data={'username': username, 'pass_1': password})
+    return client
+
+
+@scenario
+def history_paging(bench):
+    # one user owning the whole history: keyset pages against OFFSET pages at growing depth,
+    # and the rendered user_home / admin history pages at the same depths
+    from vehicle.models import User, ParkingSpot, Reservation
+    from vehicle.pagination import keyset_page
+    from sqlalchemy.orm import joinedload
+    from benchmarks.seed import BENCH_PASSWORD
+    total = bench.size(100000)
+    app = bench.dataset('paging', users=1, lots=10, spots_per_lot=40, reservations=total, archived_fraction=0.0, deleted_lots=0)
+    page_size = app.config['PAGE_SIZE']
+    with app.app_context():
+        user_id = db.session.scalar(db.select(User.id).filter_by(username='bench0'))
+        # both history pages seek on (checkin_time, r_id), newest first
+        key = (Reservation.checkin_time, Reservation.r_id)
+        keys = db.session.execute(db.select(*key).filter_by(user_id=user_id).order_by(*(column.desc() for column in key))).all()
+    user = login(app.test_client(), 'bench0', BENCH_PASSWORD)
+    admin = bench.admin(app)
+
+    def history():
+        return Reservation.query.filter_by(user_id=user_id).options(joinedload(Reservation.spot).joinedload(ParkingSpot.lot))
+
+    def keyset(after):
+        with app.app_context():
+            keyset_page(history(), key, after=after, page_size=page_size, descending=True)
+
+    def offset(depth):
+        with app.app_context():
+            history().order_by(*(column.desc() for column in key)).offset(depth).limit(page_size + 1).all()
+
+    rows = {}
+    for fraction in (0.0, 0.1, 0.5, 0.9, 1.0):
+        depth = min(int(len(keys) * fraction), len(keys) - page_size)
+        after = tuple(keys[depth - 1]) if depth else None
+        query_string = {'after': after[-1]} if after else {}
+        rows[f'depth {depth}'] = {
+            'keyset_ms': median_ms(lambda: keyset(after)),
+            'offset_ms': median_ms(lambda: offset(depth)),
+            'user_home_ms': median_ms(lambda: ok(user.get('/user/home', query_string=query_string))),
+            'admin_history_ms': median_ms(lambda: ok(admin.get(f'/admin/user_history/{user_id}', query_string=query_string))),
+        }
+    return rows
+
+
+@scenario
+def spot_provisioning(bench, lots=500, spots_per_lot=40):
+    # creating lots and halving them: an ORM add/delete per spot, as admin_home and edit_lot used to do,
+    # against ParkingSpot.provision and retire_free; each lot is committed on its own, as in the routes
+    from vehicle.models import ParkingLot, ParkingSpot
+
+    def create_lots():
+        db.session.execute(db.insert(ParkingLot), [{'primary_location': 'Bench', 'full_address': f'{i} Bench Road', 'pincode': '500001',
+                                                    'max_spots': spots_per_lot, 'cost_per_unit': 30} for i in range(lots)])
+        db.session.commit()
+        return db.session.scalars(db.select(ParkingLot.lot_id)).all()
+
+    def orm_create(lot_id):
+        for index in range(spots_per_lot):
+            db.session.add(ParkingSpot(status='A', lot_id=lot_id, spot_index=index))
+
+    def orm_shrink(lot, count):
+        for spot in ParkingSpot.query.filter_by(lot_id=lot.lot_id, status='A').order_by(ParkingSpot.spot_index.desc()).all()[:count]:
+            for reservation in spot.reservations:
+                reservation.archived_spot_id = spot.spot_id
+                reservation.archived_lot_id = lot.lot_id
+                reservation.archived_primary_location = lot.primary_location
+            db.session.delete(spot)
+
+    def timed(app, step, items):
+        with app.app_context(), statements(db.engine) as counted:
+            started = time.perf_counter()
+            for item in items():
+                step(item)
+                db.session.commit()
+            elapsed = time.perf_counter() - started
+        return {'total_ms': elapsed * 1000, 'per_lot_ms': elapsed * 1000 / lots, 'statements_per_lot': len(counted) / lots}
+
+    rows = {}
+    for name, create in (('orm', orm_create), ('bulk', lambda lot_id: ParkingSpot.provision(lot_id, range(spots_per_lot)))):
+        app = bench.scratch()
+        with app.app_context():
+            lot_ids = create_lots()
+        rows[f'create {name}'] = timed(app, create, lambda: lot_ids)
+
+    # two closed reservations per spot, whose history has to be archived before the spots go
+    sizes = dict(users=10, lots=lots, spots_per_lot=spots_per_lot, reservations=lots * spots_per_lot * 2, archived_fraction=0.0,
+                 active_fraction=0.0, deleted_lots=0)
+    for name, shrink in (('orm', orm_shrink), ('bulk', ParkingSpot.retire_free)):
+        app = bench.scratch(**sizes)
+        rows[f'shrink {name}'] = timed(app, lambda lot: shrink(lot, spots_per_lot // 2), lambda: ParkingLot.query.all())
+        with app.app_context():
+            assert ParkingSpot.query.count() == lots * spots_per_lot // 2
+    return rows
+
+
+@scenario
+def concurrent_logins(bench, threads=16, logins=6, rounds=10, pools=((1, 2), (4, 32), (16, 96))):
+    # a login burst from `threads` clients against bcrypt pools of (workers, max pending); the last pool
+    # never refuses, like hashing on every request thread. A probe keeps requesting / meanwhile, to
+    # show what the burst does to everything else
+    from benchmarks.seed import BENCH_PASSWORD
+    rows = {}
+    for workers, pending in pools:
+        app = bench.scratch(settings={'BCRYPT_LOG_ROUNDS': rounds, 'BCRYPT_WORKERS': workers, 'BCRYPT_MAX_PENDING': pending},
+                            users=threads, lots=1, spots_per_lot=10, reservations=0, deleted_lots=0)
+        results, probes, done = [], [], threading.Event()
+
+        def storm(index):
+            client = app.test_client()
+            for _ in range(logins):
+                started = time.perf_counter()
+                response = client.post('/login', data={'username': f'bench{index}', 'pass_1': BENCH_PASSWORD})
+                results.append((response.status_code, time.perf_counter() - started))
+                client.get('/logout')
+
+        def probe():
+            client = app.test_client()
+            while not done.is_set():
+                started = time.perf_counter()
+                ok(client.get('/'))
+                probes.append(time.perf_counter() - started)
+                time.sleep(0.005)
+
+        prober = threading.Thread(target=probe)
+        prober.start()
+        started = time.perf_counter()
+        clients = [threading.Thread(target=storm, args=(index,)) for index in range(threads)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        wall = time.perf_counter() - started
+        done.set()
+        prober.join()
+
+        logged_in = [elapsed for status, elapsed in results if status == 302]
+        rows[f'pool {workers}+{pending}'] = {
+            'logins_per_s': len(logged_in) / wall, 'refused_503': sum(1 for status, _ in results if status == 503),
+            'login_p95_ms': percentile_ms(logged_in, 0.95), 'other_p95_ms': percentile_ms(probes, 0.95),
+        }
+    return rows
+
+
+@scenario
+def booking_contention(bench, writers=4, readers=4, duration=5.0):
+    # writers book and release spots of one lot as fast as they can while readers load user_home and
+    # /api/lots, once per SQLite profile; lost claims and lock waits are read off the retry counter
+    from vehicle.models import ParkingLot, Reservation
+    from benchmarks.seed import BENCH_PASSWORD
+    rows = {}
+    for profile in ('default', 'production'):
+        app = bench.scratch(profile, settings={'SQL_QUERY_BUDGET_STRICT': False, 'METRICS_ENABLED': True},
+                            users=writers + readers, lots=4, spots_per_lot=40, reservations=bench.size(50000))
+        with app.app_context():
+            lot_id = db.session.scalar(db.select(db.func.min(ParkingLot.lot_id)))
+        reads, writes, errors = [], [], []
+        deadline = time.perf_counter() + duration
+
+        def timed(samples, call):
+            started = time.perf_counter()
+            try:
+                response = call()
+            except Exception as exc:
+                # the test client re-raises what the view raised ("database is locked" and the like)
+                errors.append(type(exc).__name__)
+                return None
+            if response.status_code >= 500:
+                errors.append(f'HTTP {response.status_code}')
+            samples.append(time.perf_counter() - started)
+            return response
+
+        def write(index):
+            client = login(app.test_client(), f'bench{index}', BENCH_PASSWORD)
+            serial = 0
+            while time.perf_counter() < deadline:
+                plate = f'CT{index:02d}{serial:05d}'
+                serial += 1
+                timed(writes, lambda: client.post('/user/book_spot', data={'lot_id': lot_id, 'cost_per_hour': 30, 'no_of_hours': 2,
+                                                                            'vehicle_model': 'car', 'vehicle_number': plate}))
+                with app.app_context():
+                    r_id = db.session.scalar(db.select(Reservation.r_id).filter_by(nameplate_num=plate, actual_checkout_time=None))
+                if r_id:
+                    timed(writes, lambda: client.post(f'/user/release_spot/{r_id}'))
+
+        def read(index):
+            client = login(app.test_client(), f'bench{writers + index}', BENCH_PASSWORD)
+            while time.perf_counter() < deadline:
+                timed(reads, lambda: client.get('/user/home'))
+                timed(reads, lambda: client.get('/api/lots'))
+
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(writers)] + \
+                  [threading.Thread(target=read, args=(index,)) for index in range(readers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        metrics = app.extensions['metrics']
+        retries = metrics['parking_spot_claim_retries_total'].values()
+        rows[profile] = {
+            'reads_per_s': len(reads) / wall, 'writes_per_s': len(writes) / wall,
+            'read_p99_ms': percentile_ms(reads, 0.99), 'write_p99_ms': percentile_ms(writes, 0.99),
+            'conflicts': retries.get(('conflict',), 0), 'busy_retries': retries.get(('busy',), 0),
+            'lot_full': metrics['parking_bookings_total'].values().get(('lot_full',), 0), 'errors': len(errors),
+        }
+    return rows
+
+
+@scenario
+def event_fanout(bench, events=20, interval=0.02, audiences=((100, 0), (300, 0), (1000, 0), (300, 300))):
+    # one thread per subscriber blocked in get(), as an SSE stream is, for (listening, stalled) audiences;
+    # stalled subscribers never read, so their queues overflow. Each event carries its publish time
+    from vehicle.events import EventBroker
+    rows = {}
+    for listening, stalled in audiences:
+        broker = EventBroker()
+        latencies, publishes = [], []
+        ready = threading.Barrier(listening + 1)
+        for _ in range(stalled):
+            broker.subscribe()
+
+        def listen(subscription):
+            ready.wait()
+            for _ in range(events):
+                event = subscription.get(timeout=10)
+                latencies.append(time.perf_counter() - event['sent'])
+
+        threads = [threading.Thread(target=listen, args=(broker.subscribe(),)) for _ in range(listening)]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        for spot_id in range(events):
+            started = time.perf_counter()
+            broker.publish({'type': 'spot', 'lot_id': 1, 'spot_id': spot_id, 'status': 'O', 'sent': started})
+            publishes.append(time.perf_counter() - started)
+            time.sleep(interval)
+        for thread in threads:
+            thread.join()
+        rows[f'{listening} listening' + (f' + {stalled} stalled' if stalled else '')] = {
+            'publish_p50_ms': percentile_ms(publishes, 0.5), 'publish_max_ms': percentile_ms(publishes, 1.0),
+            'delivery_p50_ms': percentile_ms(latencies, 0.5), 'delivery_p99_ms': percentile_ms(latencies, 0.99),
+            'delivery_max_ms': percentile_ms(latencies, 1.0), 'delivered': len(latencies),
+        }
+    return rows
+
+
+@scenario
+def gate_batch(bench, vehicles=1000, lots=20, batch_sizes=(1, 10, 100, 500)):
+    # `vehicles` check-ins and then their check-outs: one book_spot / release_spot form post per vehicle,
+    # against /api/gate/batch requests of growing size; every variant starts from the same empty lots
+    from vehicle.models import ParkingLot, Reservation
+    from benchmarks.seed import BENCH_PASSWORD
+    from benchmarks.run import GATE_TOKEN
+    sizes = dict(users=1, lots=lots, spots_per_lot=vehicles // lots, reservations=0, active_fraction=0.0, deleted_lots=0)
+    plates = [f'GB{i:06d}' for i in range(vehicles)]
+
+    def measure(app, check_in, check_out):
+        with app.app_context():
+            lot_ids = db.session.scalars(db.select(ParkingLot.lot_id).order_by(ParkingLot.lot_id)).all()
+            engine = db.engine
+        timings = []
+        with statements(engine) as counted:
+            for step in (check_in, check_out):
+                started = time.perf_counter()
+                step(lot_ids)
+                timings.append(time.perf_counter() - started)
+        with app.app_context():
+            closed = db.session.scalar(db.select(db.func.count()).select_from(Reservation).where(Reservation.actual_checkout_time.is_not(None)))
+        assert closed == vehicles, f'{closed} of {vehicles} vehicles checked out'
+        return {'items_per_s': 2 * vehicles / sum(timings), 'checkin_ms_per_item': timings[0] * 1000 / vehicles,
+                'checkout_ms_per_item': timings[1] * 1000 / vehicles, 'statements_per_item': len(counted) / (2 * vehicles)}
+
+    rows = {}
+    app = bench.scratch(settings={'SQL_QUERY_BUDGET_STRICT': False}, **sizes)
+    client = login(app.test_client(), 'bench0', BENCH_PASSWORD)
+
+    def drop_flashes():
+        # a browser shows the flash on the page it is redirected to; without that it piles up in the cookie
+        with client.session_transaction() as session:
+            session.pop('_flashes', None)
+
+    def book_each(lot_ids):
+        for i, plate in enumerate(plates):
+            ok(client.post('/user/book_spot', data={'lot_id': lot_ids[i % len(lot_ids)], 'cost_per_hour': 30, 'no_of_hours': 2,
+                                                    'vehicle_model': 'car', 'vehicle_number': plate}))
+            drop_flashes()
+
+    def release_each(lot_ids):
+        # a client already holds its reservation id; the lookup is not part of the release
+        with app.app_context():
+            r_ids = db.session.scalars(db.select(Reservation.r_id)).all()
+        for r_id in r_ids:
+            ok(client.post(f'/user/release_spot/{r_id}'))
+            drop_flashes()
+
+    rows['book_spot + release_spot'] = measure(app, book_each, release_each)
+
+    for size in batch_sizes:
+        app = bench.scratch(settings={'SQL_QUERY_BUDGET_STRICT': False}, **sizes)
+        gate = app.test_client()
+
+        def post(field, items):
+            for offset in range(0, len(items), size):
+                results = ok(gate.post('/api/gate/batch', headers={'Authorization': f'Bearer {GATE_TOKEN}'},
+                                       json={field: items[offset:offset + size]})).get_json()[field]
+                if not all(result['ok'] for result in results):
+                    raise RuntimeError(f'gate batch rejected: {results}')
+
+        rows[f'gate batch of {size}'] = measure(
+            app, lambda lot_ids: post('checkins', [{'lot_id': lot_ids[i % len(lot_ids)], 'vehicle_number': plate, 'vehicle_model': 'car',
+                                                    'hours': 2} for i, plate in enumerate(plates)]),
+            lambda lot_ids: post('checkouts', [{'vehicle_number': plate} for plate in plates]))
+    return rows
+
+
+def export_dataset(bench):
+    # shared by the billing and export scenarios: a million reservations by default
+    total = bench.size(1000000)
+    return bench.dataset('exports', reservations=total), total
+
+
+@scenario
+def billing(bench):
+    # pricing every reservation at one `now`: Reservation.calculate_cost_at row by row against bill_columns,
+    # first on columns already in memory, then straight from SQLite as ORM objects or as chunks of Core rows
+    from datetime import datetime
+    from vehicle.models import Reservation
+    from vehicle.billing import bill_columns, bill_rows
+    from vehicle.exports import reservation_query
+    app, total = export_dataset(bench)
+    now = datetime.now()
+    with app.app_context():
+        columns = db.session.execute(db.select(Reservation.checkin_time, Reservation.actual_checkout_time, Reservation.cost_per_unit)).all()
+    checkins, ends, rates = (list(column) for column in zip(*columns))
+    del columns
+
+    class Row:
+        __slots__ = ('checkin_time', 'cost_per_unit')
+
+        def __init__(self, checkin_time, cost_per_unit):
+            self.checkin_time, self.cost_per_unit = checkin_time, cost_per_unit
+
+    objects = [Row(checkin, rate) for checkin, rate in zip(checkins, rates)]
+
+    def scalar_in_memory():
+        [Reservation.calculate_cost_at(row, now if end is None else end) for row, end in zip(objects, ends)]
+
+    def orm_scalar():
+        with app.app_context():
+            [res.calculate_cost_at(res.actual_checkout_time or now) for res in Reservation.query.all()]
+
+    def chunked_columns():
+        with app.app_context():
+            # the export query, whose first four columns are what bill_rows reads
+            for rows in db.session.execute(reservation_query().execution_options(yield_per=1000)).partitions():
+                bill_rows(rows, now)
+
+    rows = {}
+    for name, fn in (('in memory: scalar', scalar_in_memory), ('in memory: columns', lambda: bill_columns(checkins, ends, rates, now)),
+                     ('from SQLite: ORM + scalar', orm_scalar), ('from SQLite: chunked columns', chunked_columns)):
+        elapsed, peak_mb = timed_and_traced(fn)
+        rows[name] = {'total_ms': elapsed * 1000, 'ns_per_row': elapsed * 1e9 / total, 'peak_mb': peak_mb}
+    return rows
+
+
+@scenario
+def export_memory(bench):
+    # the streamed reservation exports as the route sends them, piece by piece to a sink that only counts
+    # bytes: the whole dataset against its last week. The peak must not grow with the row count
+    from datetime import date, timedelta
+    from vehicle.exports import FORMATS, RESERVATION_FIELDS, reservation_chunks
+    app, total = export_dataset(bench)
+    week = (date.today() - timedelta(days=7), date.today())
+    rows = {}
+    for label, (start, end) in (('everything', (None, None)), ('last week', week)):
+        for extension, (render, _) in FORMATS.items():
+            sent = []
+
+            def export():
+                sent.clear()
+                with app.app_context():
+                    for piece in render(reservation_chunks(start, end), RESERVATION_FIELDS):
+                        sent.append(len(piece))
+
+            elapsed, peak_mb = timed_and_traced(export)
+            with app.app_context():
+                count = sum(len(chunk) for chunk in reservation_chunks(start, end))
+            rows[f'{extension}, {label}'] = {'rows': count, 'rows_per_s': count / elapsed, 'mb_sent': sum(sent) / 2**20, 'peak_mb': peak_mb}
+    return rows
+
+
+@scenario
+def metrics_overhead(bench, calls=200000, requests=3000):
+    # what recording costs: the metric primitives and the per-request hooks on their own, then a whole
+    # request to / with metrics on and off, interleaved so drift hits both alike
+    from vehicle.metrics import Counter, Histogram, count
+    settings = {'SQL_INSTRUMENTATION': False}
+    app = bench.scratch(settings=dict(settings, METRICS_ENABLED=True))
+    plain = bench.scratch(settings=dict(settings, METRICS_ENABLED=False))
+    counter, histogram = Counter('bench_total', '', ('result',)), Histogram('bench_seconds', '', ('endpoint',))
+    finish_request = next(hook for hook in app.after_request_funcs[None] if hook.__name__ == 'finish_request')
+    response = app.response_class()
+
+    def per_call_us(fn, n=calls):
+        started = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return (time.perf_counter() - started) * 1e6 / n
+
+    rows = {
+        'Counter.inc': {'us': per_call_us(lambda: counter.inc('ok'))},
+        'Histogram.observe': {'us': per_call_us(lambda: histogram.observe(0.004, 'main.welcome'))},
+    }
+    with app.app_context():
+        rows['count() helper'] = {'us': per_call_us(lambda: count('parking_bookings_total', 'ok'))}
+    with app.test_request_context('/', environ_base={'vehicle.metrics_started': time.perf_counter()}):
+        rows['finish_request hook'] = {'us': per_call_us(lambda: finish_request(response))}
+
+    # a second metrics-off app shows how far two identical apps drift apart anyway
+    clients = {'metrics on': app.test_client(), 'metrics off': plain.test_client(),
+               'metrics off, second app': bench.scratch(settings=dict(settings, METRICS_ENABLED=False)).test_client()}
+    for client in clients.values():
+        for _ in range(100):
+            ok(client.get('/'))
+    timings = {name: [] for name in clients}
+    for i in range(requests):
+        for name, client in (clients.items() if i % 2 else reversed(clients.items())):
+            started = time.perf_counter()
+            ok(client.get('/'))
+            timings[name].append(time.perf_counter() - started)
+    baseline = statistics.median(timings['metrics off'])
+    for name, samples in timings.items():
+        rows[f'GET /, {name}'] = {'us': statistics.median(samples) * 1e6, 'vs_off_us': (statistics.median(samples) - baseline) * 1e6}
+    return rows
+
+
+@scenario
+def expiry_sweep(bench, lots=2500, spots_per_lot=40, overdue=2000):
+    # every spot occupied (100k open reservations next to the closed history), `overdue` of them past their
+    # booked end: the scan an expiry pass without overage_due_at would need, then the passes it does make.
+    # Passes change the data, so each is timed once, in order
+    from datetime import datetime, timedelta
+    from vehicle.models import Reservation
+    from vehicle.expiry import expire_overstays, next_overage_due
+    app = bench.scratch(users=200, lots=lots, spots_per_lot=spots_per_lot, reservations=bench.size(100000), active_fraction=1.0,
+                        deleted_lots=0)
+    now = datetime.now()
+    with app.app_context():
+        table = Reservation.__table__
+        late = db.select(table.c.r_id).where(table.c.actual_checkout_time.is_(None)).order_by(table.c.r_id).limit(overdue).scalar_subquery()
+        db.session.execute(db.update(table).where(table.c.r_id.in_(late))
+                           .values(checkout_time=now - timedelta(minutes=30), overage_due_at=now - timedelta(minutes=30)))
+        db.session.commit()
+        active = db.session.scalar(db.select(db.func.count()).select_from(table).where(table.c.actual_checkout_time.is_(None)))
+
+    def scan():
+        return len(db.session.execute(db.select(table.c.r_id).where(table.c.actual_checkout_time.is_(None), table.c.checkout_time < now)).all())
+
+    def reads(fn):
+        # read-only, so the median of repeated runs
+        with app.app_context():
+            return {'ms': median_ms(fn), 'rows': fn()}
+
+    def once(fn):
+        with app.app_context():
+            started = time.perf_counter()
+            result = fn()
+            return {'ms': (time.perf_counter() - started) * 1000, 'rows': result}
+
+    return {
+        'scan by checkout_time': dict(reads(scan), open=active),
+        'next_overage_due': dict(reads(lambda: int(next_overage_due() is not None)), open=active),
+        'flag pass': once(lambda: expire_overstays(now)),
+        'idle pass': once(lambda: expire_overstays(now)),
+        're-price pass at +1h': once(lambda: expire_overstays(now + timedelta(hours=1))),
+    }
+
+
+@scenario
+def availability_queries(bench, spots=40, windows_per_spot=150, queries=2000):
+    # one lot with ~6000 booked windows over the next two months: free_count + best_spot for random windows
+    # from the warm timeline (alone, and behind the version lookup), cold timeline loads, the per-window
+    # SQL count it saves, and the /api/lots/<id>/availability route
+    from datetime import datetime, timedelta
+    from vehicle.models import User, ParkingLot, ParkingSpot, Reservation, AdvanceBooking
+    from vehicle.availability import LotTimeline
+    app = bench.scratch(settings={'SQL_INSTRUMENTATION': False}, users=1, lots=1, spots_per_lot=spots, reservations=0, active_fraction=0.0,
+                        deleted_lots=0)
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    rng = bench.random
+    with app.app_context():
+        lot = db.session.scalars(db.select(ParkingLot)).one()
+        lot_id, user_id = lot.lot_id, db.session.scalar(db.select(User.id))
+        rows = []
+        for spot_id in db.session.scalars(db.select(ParkingSpot.spot_id).filter_by(lot_id=lot_id)):
+            end = now
+            for i in range(windows_per_spot):
+                start = end + timedelta(hours=rng.randrange(0, 12))
+                end = start + timedelta(hours=rng.randrange(1, 9))
+                rows.append({'user_id': user_id, 'lot_id': lot_id, 'spot_id': spot_id, 'start_time': start, 'end_time': end,
+                             'vehicle_model': 'car', 'nameplate_num': f'AB{spot_id:03d}{i:04d}', 'cost_per_unit': 30.0,
+                             'estimated_cost': 30.0, 'status': 'B'})
+        db.session.execute(db.insert(AdvanceBooking), rows)
+        ParkingLot.touch(lot_id)
+        db.session.commit()
+        horizon = int((max(row['end_time'] for row in rows) - now).total_seconds() // 3600)
+        version = lot.version
+    windows = [(start, start + timedelta(hours=rng.randrange(1, 9)))
+               for start in (now + timedelta(hours=rng.randrange(horizon)) for _ in range(queries))]
+    index = app.extensions['availability']
+
+    def throughput(fn, items=windows):
+        with app.app_context():
+            started = time.perf_counter()
+            for start, end in items:
+                fn(start, end)
+            elapsed = time.perf_counter() - started
+        return {'per_s': len(items) / elapsed, 'us_each': elapsed * 1e6 / len(items)}
+
+    def timeline_only(start, end):
+        timeline.free_count(start, end)
+        timeline.best_spot(start, end)
+
+    def through_index(start, end):
+        timeline = index.timeline(lot_id)
+        timeline.free_count(start, end)
+        timeline.best_spot(start, end)
+
+    def sql_count(start, end):
+        parked = db.exists().where(Reservation.spot_id == ParkingSpot.spot_id, Reservation.actual_checkout_time.is_(None),
+                                   Reservation.checkout_time > start)
+        db.session.scalar(db.select(db.func.count()).select_from(ParkingSpot)
+                          .where(ParkingSpot.lot_id == lot_id, ~AdvanceBooking.overlapping(ParkingSpot.spot_id, start, end), ~parked))
+
+    client = app.test_client()
+
+    def api(start, end):
+        ok(client.get(f'/api/lots/{lot_id}/availability', query_string={'start': start.isoformat(), 'end': end.isoformat()}))
+
+    with app.app_context():
+        timeline = index.timeline(lot_id)
+        cold_ms = median_ms(lambda: LotTimeline.load(lot_id, version, now))
+    return {
+        'timeline: free_count + best_spot': throughput(timeline_only),
+        'index: version check + the same': throughput(through_index),
+        'cold LotTimeline.load': {'per_s': 1000 / cold_ms, 'us_each': cold_ms * 1000},
+        'SQL free count per window': throughput(sql_count, windows[:200]),
+        'GET availability': throughput(api, windows[:500]),
+    }
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+if sys.argv[1] == 'dependencies':
+    import flask, flask_sqlalchemy, flask_migrate, flask_login, flask_bcrypt, flask_wtf, wtforms
+    print(json.dumps({'import_ms': (time.perf_counter() - started) * 1000}))
+    sys.exit()
+import vehicle
+imported = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+connections = []
+event.listen(Engine, 'connect', lambda *args: connections.append(1))
+vehicle.create_app()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'create_app_ms': (time.perf_counter() - imported) * 1000,
+                  'db_connections': len(connections)}))
+"""
+
+
+@scenario
+def startup(bench, runs=5):
+    # `import vehicle` and create_app() in fresh interpreters, against importing the dependencies alone;
+    # neither may open the database, which is checked on a path that does not exist yet
+    rows = {}
+    for target in ('dependencies', 'vehicle'):
+        samples = []
+        for run in range(runs):
+            path = bench.path(f'startup-{run}.db')
+            env = dict(os.environ, VEHICLE_CONFIG='development', DATABASE_URL=f'sqlite:///{path}', PYTHONDONTWRITEBYTECODE='1')
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, target], env=env, capture_output=True, text=True, check=True).stdout
+            samples.append(dict(json.loads(output), db_file_created=os.path.exists(path)))
+        rows[target] = {key: statistics.median(sample[key] for sample in samples) if isinstance(samples[0][key], float) else
+                        max(sample[key] for sample in samples) for key in samples[0]}
+    return rows
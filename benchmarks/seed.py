@@ -0,0 +1,82 @@
+import random
+from datetime import datetime, timedelta
+from math import ceil
+from vehicle import db, bcrypt
+from vehicle.models import User, ParkingLot, ParkingSpot, Reservation, LotDailyRollup
+
+AREAS = ['Downtown', 'Airport', 'Shamshabad', 'Chikkadpally', 'Gachibowli', 'Secunderabad', 'Kukatpally', 'Madhapur']
+MODELS = ['Swift', 'City', 'Creta', 'Nexon', 'Innova', 'Activa']
+BENCH_PASSWORD = 'bench-pass'
+CHUNK = 50000
+
+
+def _insert(table, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(db.insert(table), rows[start:start + CHUNK])
+
+
+def seed(users=200, lots=40, spots_per_lot=40, reservations=100000, archived_fraction=0.1, active_fraction=0.3,
+         days=365, deleted_lots=5, seed_value=42, now=None, log=print):
+    # fills an empty database with a reproducible synthetic dataset: every user shares BENCH_PASSWORD,
+    # closed reservations are spread over the last `days` days, `archived_fraction` of them belong to
+    # lots that no longer exist (spot_id NULL + archived_* copies), and `active_fraction` of the spots
+    # are currently occupied
+    rng = random.Random(seed_value)
+    now = now or datetime.now()
+    password_hash = bcrypt.generate_password_hash(BENCH_PASSWORD).decode('utf-8')
+
+    _insert(User.__table__, [{'first_name': 'Bench', 'last_name': f'User{i}', 'email_address': f'bench{i}@example.com',
+                              'username': f'bench{i}', 'password_hash': password_hash, 'contact_number': f'{7000000000 + i}',
+                              'address': 'Bench Street', 'pincode': '500001', 'is_admin': False} for i in range(users)])
+    user_ids = db.session.scalars(db.select(User.id).where(User.username.like('bench%'))).all()
+    log(f"seeded {len(user_ids)} users")
+
+    _insert(ParkingLot.__table__, [{'primary_location': AREAS[i % len(AREAS)], 'full_address': f'{i} Bench Road', 'pincode': '500001',
+                                    'max_spots': spots_per_lot, 'cost_per_unit': rng.choice([25, 30, 40, 50, 60])} for i in range(lots)])
+    lot_rows = db.session.execute(db.select(ParkingLot.lot_id, ParkingLot.cost_per_unit)).all()
+    for lot_id, _ in lot_rows:
+        ParkingSpot.provision(lot_id, range(spots_per_lot))
+    spots = db.session.execute(db.select(ParkingSpot.spot_id, ParkingSpot.lot_id)).all()
+    cost_by_lot = dict(lot_rows)
+    log(f"seeded {len(lot_rows)} lots with {len(spots)} spots")
+
+    # lot ids past the live ones stand in for deleted lots
+    first_deleted = max(cost_by_lot) + 1
+    archived_lots = [(first_deleted + i, AREAS[i % len(AREAS)], rng.choice([25, 30, 40, 50, 60])) for i in range(deleted_lots)]
+    # and, as a real delete would have, they push the AUTOINCREMENT sequence past their ids
+    db.session.execute(db.text("UPDATE sqlite_sequence SET seq = :seq WHERE name = 'parking_lot'"), {'seq': first_deleted + deleted_lots - 1})
+    rows = []
+    for i in range(reservations):
+        checkin = now - timedelta(days=days) + timedelta(seconds=rng.randrange(days * 86400 - 36000))
+        checkout = checkin + timedelta(minutes=rng.randrange(10, 600))
+        hours = max(1, ceil((checkout - checkin).total_seconds() / 3600))
+        row = {'user_id': rng.choice(user_ids), 'checkin_time': checkin, 'checkout_time': checkin + timedelta(hours=rng.randrange(1, 8)),
+               'actual_checkout_time': checkout, 'vehicle_model': rng.choice(MODELS), 'nameplate_num': f'TS{rng.randrange(10**6):06d}',
+               'spot_id': None, 'archived_spot_id': None, 'archived_lot_id': None, 'archived_primary_location': None}
+        if archived_lots and rng.random() < archived_fraction:
+            lot_id, location, cost = rng.choice(archived_lots)
+            row.update(archived_spot_id=rng.randrange(10**5, 10**6), archived_lot_id=lot_id, archived_primary_location=location)
+        else:
+            spot_id, lot_id = rng.choice(spots)
+            cost = cost_by_lot[lot_id]
+            row['spot_id'] = spot_id
+        row.update(cost_per_unit=float(cost), estimated_cost=float(cost * 2), final_cost=round(hours * float(cost), 2))
+        rows.append(row)
+        if len(rows) == CHUNK:
+            _insert(Reservation.__table__, rows)
+            rows = []
+    _insert(Reservation.__table__, rows)
+    log(f"seeded {reservations} closed reservations")
+
+    occupied = rng.sample(spots, int(len(spots) * active_fraction))
+    _insert(Reservation.__table__, [{'user_id': rng.choice(user_ids), 'spot_id': spot_id, 'checkin_time': now - timedelta(minutes=rng.randrange(5, 600)),
+                                     'checkout_time': now + timedelta(hours=2), 'actual_checkout_time': None, 'vehicle_model': rng.choice(MODELS),
+                                     'nameplate_num': f'AC{i:06d}', 'cost_per_unit': float(cost_by_lot[lot_id]),
+                                     'estimated_cost': float(cost_by_lot[lot_id] * 2), 'final_cost': None}
+                                    for i, (spot_id, lot_id) in enumerate(occupied)])
+    if occupied:
+        ParkingSpot.query.filter(ParkingSpot.spot_id.in_([spot_id for spot_id, _ in occupied])).update({'status': 'O'}, synchronize_session=False)
+    ParkingLot.reconcile_counts()
+    LotDailyRollup.rebuild()
+    db.session.commit()
+    log(f"seeded {len(occupied)} active reservations")
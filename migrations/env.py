@@ -97,6 +97,13 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # batch migrations rebuild a table by copy, drop and rename; with foreign keys on, the drop
+            # would cascade into the child tables. The pragma is ignored inside a transaction, so it
+            # is set and committed before the migration transaction starts
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -106,6 +113,13 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+        if connection.dialect.name == 'sqlite':
+            violations = connection.exec_driver_sql('PRAGMA foreign_key_check').fetchall()
+            connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+            connection.commit()
+            if violations:
+                raise RuntimeError(f"foreign key violations after migrating: {violations}")
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,32 @@
+"""Rebuild parking_lot with AUTOINCREMENT so lot ids are never reused
+
+Revision ID: 1b7e4c9d3f28
+Revises: f3a9d5b7c164
+Create Date: 2026-10-18 21:04:12.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b7e4c9d3f28'
+down_revision = 'f3a9d5b7c164'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite only takes AUTOINCREMENT at CREATE TABLE time, so the table is rebuilt (env.py keeps the
+    # rebuild from cascading into parking_spot)
+    with op.batch_alter_table('parking_lot', schema=None, recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+    # lots deleted before this migration live on as archived_lot_id; start the sequence past those too
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'parking_lot'")
+    op.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'parking_lot', "
+               "max((SELECT coalesce(max(lot_id), 0) FROM parking_lot), (SELECT coalesce(max(archived_lot_id), 0) FROM reservation))")
+
+
+def downgrade():
+    with op.batch_alter_table('parking_lot', schema=None, recreate='always', table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
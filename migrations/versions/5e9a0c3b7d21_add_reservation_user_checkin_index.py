@@ -0,0 +1,28 @@
+"""Add reservation (user_id, checkin_time) index for history paging, replacing the user_id index
+
+Revision ID: 5e9a0c3b7d21
+Revises: 8d4b2f6a1c07
+Create Date: 2026-10-18 12:26:05.913447
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a0c3b7d21'
+down_revision = '8d4b2f6a1c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.create_index('ix_reservation_user_checkin', ['user_id', 'checkin_time'], unique=False)
+        batch_op.drop_index('ix_reservation_user_id')
+
+
+def downgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.create_index('ix_reservation_user_id', ['user_id'], unique=False)
+        batch_op.drop_index('ix_reservation_user_checkin')
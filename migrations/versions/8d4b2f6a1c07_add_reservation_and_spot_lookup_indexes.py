@@ -0,0 +1,36 @@
+"""Add reservation and parking spot lookup indexes
+
+Revision ID: 8d4b2f6a1c07
+Revises: 3c1f7a9d2e54
+Create Date: 2026-10-18 11:03:17.552890
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4b2f6a1c07'
+down_revision = '3c1f7a9d2e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('parking_spot', schema=None) as batch_op:
+        batch_op.create_index('ix_parking_spot_lot_status_index', ['lot_id', 'status', 'spot_index'], unique=False)
+
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.create_index('ix_reservation_spot_checkin', ['spot_id', 'checkin_time'], unique=False)
+        batch_op.create_index('ix_reservation_active_nameplate', ['nameplate_num'], unique=False, sqlite_where=sa.text('actual_checkout_time IS NULL'))
+        batch_op.create_index('ix_reservation_active_spot', ['spot_id'], unique=False, sqlite_where=sa.text('actual_checkout_time IS NULL'))
+
+
+def downgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.drop_index('ix_reservation_active_spot')
+        batch_op.drop_index('ix_reservation_active_nameplate')
+        batch_op.drop_index('ix_reservation_spot_checkin')
+
+    with op.batch_alter_table('parking_spot', schema=None) as batch_op:
+        batch_op.drop_index('ix_parking_spot_lot_status_index')
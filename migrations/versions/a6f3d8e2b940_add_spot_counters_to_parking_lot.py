@@ -0,0 +1,35 @@
+"""Add available/occupied spot counters to ParkingLot
+
+Revision ID: a6f3d8e2b940
+Revises: 5e9a0c3b7d21
+Create Date: 2026-10-18 13:41:52.307716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6f3d8e2b940'
+down_revision = '5e9a0c3b7d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('parking_lot', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('available_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('occupied_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill from the current spot statuses
+    op.execute("""
+        UPDATE parking_lot SET
+            available_count = (SELECT COUNT(*) FROM parking_spot WHERE parking_spot.lot_id = parking_lot.lot_id AND parking_spot.status = 'A'),
+            occupied_count = (SELECT COUNT(*) FROM parking_spot WHERE parking_spot.lot_id = parking_lot.lot_id AND parking_spot.status = 'O')
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('parking_lot', schema=None) as batch_op:
+        batch_op.drop_column('occupied_count')
+        batch_op.drop_column('available_count')
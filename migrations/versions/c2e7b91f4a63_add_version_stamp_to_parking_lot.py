@@ -0,0 +1,26 @@
+"""Add version stamp to ParkingLot
+
+Revision ID: c2e7b91f4a63
+Revises: a6f3d8e2b940
+Create Date: 2026-10-18 15:22:38.140275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e7b91f4a63'
+down_revision = 'a6f3d8e2b940'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('parking_lot', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('parking_lot', schema=None) as batch_op:
+        batch_op.drop_column('version')
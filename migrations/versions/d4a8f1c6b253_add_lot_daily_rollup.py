@@ -0,0 +1,53 @@
+"""Add per-lot daily revenue/occupancy rollup table
+
+Revision ID: d4a8f1c6b253
+Revises: c2e7b91f4a63
+Create Date: 2026-10-18 18:31:07.514820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8f1c6b253'
+down_revision = 'c2e7b91f4a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('lot_daily_rollup',
+    sa.Column('lot_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('primary_location', sa.String(length=100), nullable=True),
+    sa.Column('revenue', sa.Float(), server_default='0', nullable=False),
+    sa.Column('reservations', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('occupied_hours', sa.Float(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('lot_id', 'day')
+    )
+    with op.batch_alter_table('lot_daily_rollup', schema=None) as batch_op:
+        batch_op.create_index('ix_lot_daily_rollup_day', ['day'], unique=False)
+
+    # backfill from every reservation that has been checked out
+    op.execute("""
+        INSERT INTO lot_daily_rollup (lot_id, day, primary_location, revenue, reservations, occupied_hours)
+        SELECT COALESCE(parking_spot.lot_id, reservation.archived_lot_id, -1),
+               DATE(reservation.actual_checkout_time),
+               MAX(COALESCE(parking_lot.primary_location, reservation.archived_primary_location)),
+               COALESCE(SUM(reservation.final_cost), 0),
+               COUNT(reservation.r_id),
+               SUM((JULIANDAY(reservation.actual_checkout_time) - JULIANDAY(reservation.checkin_time)) * 24)
+        FROM reservation
+        LEFT OUTER JOIN parking_spot ON parking_spot.spot_id = reservation.spot_id
+        LEFT OUTER JOIN parking_lot ON parking_lot.lot_id = parking_spot.lot_id
+        WHERE reservation.actual_checkout_time IS NOT NULL
+        GROUP BY 1, 2
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('lot_daily_rollup', schema=None) as batch_op:
+        batch_op.drop_index('ix_lot_daily_rollup_day')
+
+    op.drop_table('lot_daily_rollup')
@@ -0,0 +1,37 @@
+"""Add overstay tracking columns and due-time index to reservation
+
+Revision ID: e7b3c9a1d482
+Revises: d4a8f1c6b253
+Create Date: 2026-10-18 21:04:52.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c9a1d482'
+down_revision = 'd4a8f1c6b253'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('overstayed_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('overage_cost', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('overage_due_at', sa.DateTime(), nullable=True))
+
+    # open reservations fall due at their booked end; the scheduler catches up on the first pass
+    op.execute("UPDATE reservation SET overage_due_at = checkout_time WHERE actual_checkout_time IS NULL")
+
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.create_index('ix_reservation_active_overage_due', ['overage_due_at'], unique=False, sqlite_where=sa.text('actual_checkout_time IS NULL'))
+
+
+def downgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.drop_index('ix_reservation_active_overage_due')
+        batch_op.drop_column('overage_due_at')
+        batch_op.drop_column('overage_cost')
+        batch_op.drop_column('overstayed_at')
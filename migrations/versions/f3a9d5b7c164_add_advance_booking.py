@@ -0,0 +1,53 @@
+"""Add advance_booking table for future time-window bookings
+
+Revision ID: f3a9d5b7c164
+Revises: e7b3c9a1d482
+Create Date: 2026-10-18 23:12:36.905127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d5b7c164'
+down_revision = 'e7b3c9a1d482'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('advance_booking',
+    sa.Column('booking_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('lot_id', sa.Integer(), nullable=False),
+    sa.Column('spot_id', sa.Integer(), nullable=True),
+    sa.Column('r_id', sa.Integer(), nullable=True),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('end_time', sa.DateTime(), nullable=False),
+    sa.Column('vehicle_model', sa.String(length=20), nullable=False),
+    sa.Column('nameplate_num', sa.String(length=15), nullable=False),
+    sa.Column('cost_per_unit', sa.Float(), nullable=False),
+    sa.Column('estimated_cost', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=1), server_default='B', nullable=False),
+    sa.ForeignKeyConstraint(['lot_id'], ['parking_lot.lot_id'], name='fk_advance_booking_lot', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['r_id'], ['reservation.r_id'], ),
+    sa.ForeignKeyConstraint(['spot_id'], ['parking_spot.spot_id'], name='fk_advance_booking_spot', ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('booking_id')
+    )
+    with op.batch_alter_table('advance_booking', schema=None) as batch_op:
+        batch_op.create_index('ix_advance_booking_lot_end', ['lot_id', 'end_time'], unique=False, sqlite_where=sa.text("status = 'B'"))
+        batch_op.create_index('ix_advance_booking_nameplate', ['nameplate_num'], unique=False, sqlite_where=sa.text("status = 'B'"))
+        batch_op.create_index('ix_advance_booking_spot_start', ['spot_id', 'start_time'], unique=False, sqlite_where=sa.text("status = 'B'"))
+        batch_op.create_index('ix_advance_booking_user_start', ['user_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('advance_booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_advance_booking_user_start')
+        batch_op.drop_index('ix_advance_booking_spot_start')
+        batch_op.drop_index('ix_advance_booking_nameplate')
+        batch_op.drop_index('ix_advance_booking_lot_end')
+
+    op.drop_table('advance_booking')
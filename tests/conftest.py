@@ -0,0 +1,28 @@
+import pytest
+from vehicle import create_app, db
+from vehicle.config import TestingConfig
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # TestingConfig on a throwaway SQLite file (threads need a shared database, so not :memory:)
+    apps = []
+
+    def factory(name='test', **settings):
+        config = type('TestConfig', (TestingConfig,), {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / name}.db', **settings})
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+        apps.append(app)
+        return app
+
+    yield factory
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
@@ -0,0 +1,23 @@
+from vehicle import db
+from vehicle.models import User
+from benchmarks.seed import seed
+
+
+def create_user(username, is_admin=False):
+    user = User(first_name='Test', last_name=username, email_address=f'{username}@example.com', username=username,
+                contact_number=None, address='Test Street', pincode='500001', is_admin=is_admin)
+    user.password = 'test-pass'
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def seed_quietly(**sizes):
+    seed(log=lambda *args: None, **sizes)
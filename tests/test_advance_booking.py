@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from vehicle import db
+from vehicle.models import ParkingLot, ParkingSpot, AdvanceBooking
+from tests.helpers import create_user, login
+
+SPOTS = 12
+
+
+def make_lot(spots=SPOTS):
+    lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=spots,
+                     cost_per_unit=30, available_count=spots, occupied_count=0)
+    db.session.add(lot)
+    db.session.flush()
+    ParkingSpot.provision(lot.lot_id, range(spots))
+    db.session.commit()
+    return lot.lot_id
+
+
+def book_ahead(client, lot_id, plate, start, hours=2):
+    return client.post('/user/book_ahead', data={'lot_id': lot_id, 'start_time': start.strftime('%Y-%m-%dT%H:%M'), 'no_of_hours': hours,
+                                                 'vehicle_model': 'car', 'vehicle_number': plate})
+
+
+def shrink(admin, lot_id, max_spots):
+    return admin.post(f'/admin/edit_lot/{lot_id}', data={'primary_location': 'Downtown', 'full_address': '1 Test Road', 'pincode': '500001',
+                                                         'cost_per_unit': '30', 'max_spots': str(max_spots)})
+
+
+def test_shrinking_a_lot_keeps_every_booked_spot(app):
+    start = datetime.now().replace(second=0, microsecond=0)
+    with app.app_context():
+        lot_id = make_lot()
+        user = login(app.test_client(), create_user('driver'))
+        admin = login(app.test_client(), create_user('admin', is_admin=True))
+    for n in range(SPOTS):
+        book_ahead(user, lot_id, f'AB{n:04d}', start)
+
+    shrink(admin, lot_id, 10)
+    with app.app_context():
+        assert ParkingSpot.query.filter_by(lot_id=lot_id).count() == SPOTS
+        assert db.session.get(ParkingLot, lot_id).max_spots == SPOTS
+        assert AdvanceBooking.query.filter_by(status='B', spot_id=None).count() == 0
+        cancelled = db.session.scalars(db.select(AdvanceBooking.booking_id).order_by(AdvanceBooking.booking_id).limit(2)).all()
+    for booking_id in cancelled:
+        user.post(f'/user/advance_booking/{booking_id}/cancel')
+
+    # with two windows cancelled, exactly the two free spots go
+    shrink(admin, lot_id, 10)
+    with app.app_context():
+        assert ParkingSpot.query.filter_by(lot_id=lot_id).count() == 10
+        booked = AdvanceBooking.query.filter_by(status='B').all()
+        assert len(booked) == 10 and all(booking.spot is not None for booking in booked)
+        booking_ids = [booking.booking_id for booking in booked]
+    for booking_id in booking_ids:
+        user.post(f'/user/advance_booking/{booking_id}/check_in')
+    with app.app_context():
+        assert AdvanceBooking.query.filter_by(status='I').count() == 10
+        lot = db.session.get(ParkingLot, lot_id)
+        assert (lot.available_count, lot.occupied_count) == (0, 10)
+
+
+def test_bad_lot_ids_are_rejected_by_the_form(app):
+    start = datetime.now() + timedelta(days=1)
+    with app.app_context():
+        make_lot()
+        user = login(app.test_client(), create_user('driver'))
+    for lot_id in ('abc', '', '1.5', str(2**64), '-1'):
+        response = book_ahead(user, lot_id, 'AB0001', start)
+        assert response.status_code == 302
+    assert book_ahead(user, 999, 'AB0001', start).status_code == 404
+    with app.app_context():
+        assert AdvanceBooking.query.count() == 0
+
+
+def test_recreated_lot_books_from_its_own_timeline(app):
+    start = datetime.now() + timedelta(days=1)
+    index = app.extensions['availability']
+    with app.app_context():
+        deleted_id = make_lot()
+        user = login(app.test_client(), create_user('driver'))
+        admin = login(app.test_client(), create_user('admin', is_admin=True))
+    assert user.get(f'/api/lots/{deleted_id}/availability', query_string={'start': start.isoformat(),
+                                                                          'end': (start + timedelta(hours=2)).isoformat()}).status_code == 200
+    assert deleted_id in index
+
+    admin.post(f'/admin/delete_lot/{deleted_id}')
+    assert deleted_id not in index
+    with app.app_context():
+        lot_id = make_lot()
+        spot_ids = set(db.session.scalars(db.select(ParkingSpot.spot_id).filter_by(lot_id=lot_id)))
+    assert lot_id != deleted_id
+    book_ahead(user, lot_id, 'AB0001', start)
+    with app.app_context():
+        booking = AdvanceBooking.query.filter_by(nameplate_num='AB0001').one()
+        assert booking.lot_id == lot_id and booking.spot_id in spot_ids
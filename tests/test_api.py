@@ -0,0 +1,28 @@
+from vehicle import db
+from vehicle.models import ParkingLot
+from tests.helpers import create_user, login
+
+
+def create_lot(admin, cost):
+    return admin.post('/admin/home', data={'primary_location': 'Downtown', 'full_address': '1 Test Road', 'pincode': '500001',
+                                           'cost_per_unit': str(cost), 'max_spots': '10'})
+
+
+def test_recreated_lot_does_not_revalidate_the_deleted_one(app):
+    with app.app_context():
+        admin = login(app.test_client(), create_user('admin', is_admin=True))
+    kiosk = app.test_client()
+    create_lot(admin, 30)
+    first = kiosk.get('/api/lots')
+    [deleted] = first.get_json()
+    assert kiosk.get('/api/lots', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    admin.post(f"/admin/delete_lot/{deleted['lot_id']}")
+    create_lot(admin, 99)
+    with app.app_context():
+        lot = db.session.scalars(db.select(ParkingLot)).one()
+        # the new lot gets a fresh id, so its (lot_id, version) stamp is one the kiosk has never seen
+        assert (lot.lot_id, lot.version) != (deleted['lot_id'], 1) and lot.lot_id > deleted['lot_id']
+    response = kiosk.get('/api/lots', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert [(lot['lot_id'], lot['cost_per_unit']) for lot in response.get_json()] == [(lot.lot_id, 99)]
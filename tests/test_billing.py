@@ -0,0 +1,37 @@
+import random
+from datetime import datetime, timedelta
+from vehicle.billing import bill_columns, bill_reservations
+from vehicle.models import Reservation
+
+NOW = datetime(2026, 10, 18, 12, 0, 0)
+RATES = [0, 1, 10, 25, 30, 33.33, 49.99, 0.1, 0.7, 12.345]
+
+
+def random_reservation(rng, r_id):
+    # durations cluster around whole hours, where the ceil and the one hour minimum matter
+    checkin = NOW - timedelta(days=rng.randrange(30), seconds=rng.randrange(86400), microseconds=rng.randrange(10**6))
+    hours = rng.choice([0, 1, 2, 3, rng.randrange(200)])
+    duration = timedelta(hours=hours, seconds=rng.choice([-1, 0, 1, rng.randrange(3600)]), microseconds=rng.choice([0, 1, rng.randrange(10**6)]))
+    end = checkin + max(duration, timedelta(0))
+    rate = rng.choice(RATES + [round(rng.uniform(0, 500), 2)])
+    return Reservation(r_id=r_id, checkin_time=checkin, checkout_time=checkin + timedelta(hours=2),
+                       actual_checkout_time=None if end > NOW or rng.random() < 0.3 else end, cost_per_unit=rate)
+
+
+def test_column_billing_matches_per_reservation_billing():
+    rng = random.Random(2026)
+    for _ in range(50):
+        reservations = [random_reservation(rng, r_id) for r_id in range(rng.randrange(1, 200))]
+        bills = bill_reservations(reservations, NOW)
+        for res in reservations:
+            end = res.actual_checkout_time or NOW
+            assert bills[res.r_id]['cost'] == res.calculate_cost_at(end)
+            if res.actual_checkout_time is not None:
+                assert bills[res.r_id]['duration'] == res.parking_duration
+
+
+def test_billed_hours_round_up_with_a_one_hour_minimum():
+    checkins = [NOW - timedelta(seconds=seconds) for seconds in (0, 1, 3600, 3601, 7200)]
+    bills = bill_columns(checkins, [None] * len(checkins), [10] * len(checkins), NOW)
+    assert bills['hours'] == [1, 1, 1, 2, 2]
+    assert bills['cost'] == [10, 10, 10, 20, 20]
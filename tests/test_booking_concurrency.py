@@ -0,0 +1,84 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from vehicle import db
+from vehicle.models import ParkingLot, ParkingSpot, Reservation
+from tests.helpers import create_user, login
+
+THREADS = 16
+BOOKINGS_PER_THREAD = 20
+SPOTS = 40
+
+
+def test_parallel_bookings_never_share_a_spot(make_app):
+    # WAL and a busy timeout as in production; budgets are not enforced because lost claims retry
+    app = make_app(SQLITE_PROFILE='production', SQL_QUERY_BUDGET_STRICT=False)
+    with app.app_context():
+        lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=SPOTS,
+                         cost_per_unit=30, available_count=SPOTS, occupied_count=0)
+        db.session.add(lot)
+        db.session.flush()
+        ParkingSpot.provision(lot.lot_id, range(SPOTS))
+        db.session.commit()
+        lot_id = lot.lot_id
+        user_ids = [create_user(f'user{i}') for i in range(THREADS)]
+
+    def book(index):
+        client = login(app.test_client(), user_ids[index])
+        for n in range(BOOKINGS_PER_THREAD):
+            response = client.post('/user/book_spot', data={'lot_id': lot_id, 'cost_per_hour': 30, 'no_of_hours': 2,
+                                                             'vehicle_model': 'car', 'vehicle_number': f'TS{index:02d}{n:04d}'})
+            assert response.status_code == 302
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(book, range(THREADS)))
+
+    with app.app_context():
+        open_spots = db.session.scalars(db.select(Reservation.spot_id).where(Reservation.actual_checkout_time.is_(None))).all()
+        assert len(open_spots) == SPOTS
+        assert len(set(open_spots)) == SPOTS
+        assert ParkingSpot.query.filter_by(lot_id=lot_id, status='O').count() == SPOTS
+        lot = db.session.get(ParkingLot, lot_id)
+        assert (lot.available_count, lot.occupied_count) == (0, SPOTS)
+
+
+def test_claim_retries_when_the_spot_lookup_is_locked(make_app, tmp_path):
+    # a short busy timeout, and another connection holding the write lock for the first candidate SELECT
+    app = make_app('locked', SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 0.05}}, METRICS_ENABLED=True)
+    with app.app_context():
+        lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=2,
+                         cost_per_unit=30, available_count=2, occupied_count=0)
+        db.session.add(lot)
+        db.session.flush()
+        ParkingSpot.provision(lot.lot_id, range(2))
+        db.session.commit()
+        lot_id = lot.lot_id
+        client = login(app.test_client(), create_user('driver'))
+        engine = db.engine
+    blocker = sqlite3.connect(tmp_path / 'locked.db', isolation_level=None)
+
+    def lock_first_lookup(conn, cursor, statement, *args):
+        if 'ORDER BY parking_spot.spot_index' in statement and not blocker.in_transaction and not errors:
+            blocker.execute('BEGIN EXCLUSIVE')
+
+    def release(context):
+        errors.append(context.original_exception)
+        blocker.execute('ROLLBACK')
+
+    errors = []
+    event.listen(engine, 'before_cursor_execute', lock_first_lookup)
+    event.listen(engine, 'handle_error', release)
+    try:
+        response = client.post('/user/book_spot', data={'lot_id': lot_id, 'cost_per_hour': 30, 'no_of_hours': 2,
+                                                         'vehicle_model': 'car', 'vehicle_number': 'TS0001'})
+    finally:
+        event.remove(engine, 'before_cursor_execute', lock_first_lookup)
+        event.remove(engine, 'handle_error', release)
+        blocker.close()
+
+    assert response.status_code == 302
+    assert len(errors) == 1 and 'locked' in str(errors[0])
+    assert app.extensions['metrics']['parking_spot_claim_retries_total'].values() == {('busy',): 1}
+    with app.app_context():
+        assert db.session.scalars(db.select(Reservation.nameplate_num)).all() == ['TS0001']
+        assert db.session.get(ParkingLot, lot_id).occupied_count == 1
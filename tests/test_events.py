@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from vehicle.events import EventBroker
+
+SUBSCRIBERS = 300
+
+
+def spot_event(spot_id, status='O'):
+    return {'type': 'spot', 'lot_id': 1, 'spot_id': spot_id, 'status': status}
+
+
+def test_every_subscriber_gets_every_event():
+    broker = EventBroker(queue_size=64)
+    subscriptions = [broker.subscribe() for _ in range(SUBSCRIBERS)]
+
+    def drain(subscription):
+        received = []
+        while len(received) < 10:
+            event = subscription.get(timeout=5)
+            assert event is not None
+            received.append(event['spot_id'])
+        return received
+
+    with ThreadPoolExecutor(32) as pool:
+        results = [pool.submit(drain, subscription) for subscription in subscriptions]
+        for spot_id in range(10):
+            broker.publish(spot_event(spot_id))
+        assert all(result.result() == list(range(10)) for result in results)
+    assert broker.subscriber_count() == SUBSCRIBERS
+    for subscription in subscriptions:
+        broker.unsubscribe(subscription)
+    assert broker.subscriber_count() == 0
+
+
+def test_newer_event_replaces_pending_one_for_the_same_spot():
+    broker = EventBroker(queue_size=4)
+    subscription = broker.subscribe()
+    broker.publish(spot_event(1, 'O'))
+    broker.publish(spot_event(2, 'O'))
+    broker.publish(spot_event(1, 'A'))
+    assert [subscription.get(timeout=0), subscription.get(timeout=0)] == [spot_event(1, 'A'), spot_event(2, 'O')]
+    assert subscription.get(timeout=0) is None
+
+
+def test_slow_subscriber_is_told_to_resync_without_blocking_the_others():
+    broker = EventBroker(queue_size=4)
+    slow, fast = broker.subscribe(), broker.subscribe()
+    for spot_id in range(10):
+        broker.publish(spot_event(spot_id))
+        assert fast.get(timeout=0) == spot_event(spot_id)
+    assert slow.get(timeout=0) == {'type': 'resync', 'dropped': 6}
+    # the newest events are kept after the resync notice
+    assert [slow.get(timeout=0)['spot_id'] for _ in range(4)] == [6, 7, 8, 9]
+    assert slow.get(timeout=0) is None
+
+
+def test_fan_out_reaches_every_subscriber_quickly():
+    # one thread per subscriber, blocked in get() as an SSE stream is; every event carries its publish time
+    broker = EventBroker(queue_size=64)
+    latencies, ready = [], threading.Barrier(SUBSCRIBERS + 1)
+
+    def listen(subscription):
+        ready.wait()
+        for _ in range(5):
+            event = subscription.get(timeout=5)
+            latencies.append(time.perf_counter() - event['sent'])
+
+    threads = [threading.Thread(target=listen, args=(broker.subscribe(),)) for _ in range(SUBSCRIBERS)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    publish_times = []
+    for spot_id in range(5):
+        started = time.perf_counter()
+        broker.publish(dict(spot_event(spot_id), sent=started))
+        publish_times.append(time.perf_counter() - started)
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+
+    assert len(latencies) == SUBSCRIBERS * 5
+    # publishing only enqueues; generous bounds, a shared CI box still clears them by an order of magnitude
+    assert max(publish_times) < 0.1
+    assert sorted(latencies)[int(len(latencies) * 0.99)] < 1.0
@@ -0,0 +1,172 @@
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from vehicle import db
+from vehicle.expiry import ExpiryScheduler, due_overstays, expire_overstays, next_overage_due, process_overstays
+from vehicle.models import ParkingLot, ParkingSpot, Reservation
+
+BOOKED = datetime(2026, 10, 18, 10, 0, 0)
+
+
+class FakeClock:
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def park(count, lot_id=None, checkout_time=BOOKED, rate=30.0):
+    # `count` cars parked two hours before `checkout_time`, one per spot of a fresh lot
+    lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=count,
+                     cost_per_unit=rate, available_count=0, occupied_count=count)
+    db.session.add(lot)
+    db.session.flush()
+    ParkingSpot.provision(lot.lot_id, range(count))
+    spot_ids = db.session.scalars(db.select(ParkingSpot.spot_id).filter_by(lot_id=lot.lot_id).order_by(ParkingSpot.spot_index)).all()
+    ParkingSpot.query.filter(ParkingSpot.spot_id.in_(spot_ids)).update({'status': 'O'})
+    reservations = [Reservation(spot_id=spot_id, user_id=None, checkin_time=checkout_time - timedelta(hours=2), checkout_time=checkout_time,
+                                vehicle_model='car', nameplate_num=f'EX{spot_id:04d}', cost_per_unit=rate, estimated_cost=rate * 2)
+                    for spot_id in spot_ids]
+    db.session.add_all(reservations)
+    db.session.commit()
+    return [res.r_id for res in reservations]
+
+
+def test_overstays_are_flagged_after_the_booked_end_and_repriced_hourly(app):
+    with app.app_context():
+        [r_id] = park(1)
+        assert db.session.get(Reservation, r_id).overage_due_at == BOOKED
+        assert expire_overstays(BOOKED) == 0
+
+        late = BOOKED + timedelta(seconds=1)
+        events = []
+        assert expire_overstays(late, publish=events.append) == 1
+        res = db.session.get(Reservation, r_id)
+        assert (res.overstayed_at, res.overage_cost, res.overage_due_at) == (late, 30.0, BOOKED + timedelta(hours=1))
+        assert events == [{'type': 'overstay', 'lot_id': res.spot.lot_id, 'spot_id': res.spot_id, 'r_id': r_id, 'overage': 30.0, 'new': True}]
+        # not due again until the next hour starts
+        assert expire_overstays(BOOKED + timedelta(hours=1)) == 0
+
+        later = BOOKED + timedelta(hours=2, minutes=30)
+        assert expire_overstays(later, publish=events.append) == 1
+        db.session.expire_all()
+        res = db.session.get(Reservation, r_id)
+        assert (res.overstayed_at, res.overage_cost, res.overage_due_at) == (late, 90.0, BOOKED + timedelta(hours=3))
+        assert events[-1]['new'] is False
+
+        # checking out records the same overage and takes the reservation off the queue
+        res.check_out(later)
+        db.session.commit()
+        assert res.overage_cost == 90.0
+        assert due_overstays(BOOKED + timedelta(days=1), 10) == []
+        assert next_overage_due() is None
+
+
+def test_due_reservations_are_processed_in_batches(app):
+    with app.app_context():
+        r_ids = park(5)
+        now = BOOKED + timedelta(minutes=5)
+        assert len(process_overstays(now, batch_size=2)) == 2
+        db.session.rollback()
+
+        commits = []
+
+        def committed(session):
+            commits.append(session)
+
+        event.listen(db.session, 'after_commit', committed)
+        try:
+            assert expire_overstays(now, batch_size=2) == 5
+        finally:
+            event.remove(db.session, 'after_commit', committed)
+        # 2 + 2 + 1, each batch committed on its own
+        assert len(commits) == 3
+        assert sorted(db.session.scalars(db.select(Reservation.r_id).where(Reservation.overstayed_at == now))) == r_ids
+
+
+def test_gate_check_ins_get_a_due_time(make_app):
+    app = make_app(GATE_API_TOKEN='gate')
+    with app.app_context():
+        lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=1,
+                         cost_per_unit=30, available_count=1, occupied_count=0)
+        db.session.add(lot)
+        db.session.flush()
+        ParkingSpot.provision(lot.lot_id, [0])
+        db.session.commit()
+        lot_id = lot.lot_id
+    response = app.test_client().post('/api/gate/batch', headers={'Authorization': 'Bearer gate'}, json={
+        'checkins': [{'lot_id': lot_id, 'hours': 3, 'vehicle_model': 'car', 'vehicle_number': 'GT0001'}]})
+    assert response.get_json()['checkins'][0]['ok']
+    with app.app_context():
+        res = Reservation.query.filter_by(nameplate_num='GT0001').one()
+        assert res.overage_due_at == res.checkout_time
+
+
+def test_expiry_queries_read_the_due_index(app):
+    with app.app_context():
+        park(3)
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            due_overstays(BOOKED + timedelta(minutes=1), 10)
+            next_overage_due()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        connection = db.session.connection().connection.driver_connection
+        for statement, parameters in statements:
+            plan = ' '.join(row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+            assert 'ix_reservation_active_overage_due' in plan, plan
+        assert len(statements) == 2
+
+
+def test_scheduler_sleeps_until_the_next_due_reservation(app):
+    clock = FakeClock(BOOKED - timedelta(hours=1))
+    scheduler = ExpiryScheduler(app, interval=60, clock=clock)
+    assert scheduler.tick() == 60
+    with app.app_context():
+        park(1)
+    # due in an hour: capped by the interval
+    assert scheduler.tick() == 60
+    clock.now = BOOKED - timedelta(seconds=20)
+    assert scheduler.tick() == 20
+    # due right now (the booked end itself is not overdue yet): never spins faster than once a second
+    clock.now = BOOKED
+    assert scheduler.tick() == 1.0
+    clock.now = BOOKED + timedelta(minutes=59, seconds=30)
+    assert scheduler.tick() == 30
+    with app.app_context():
+        assert Reservation.query.one().overage_cost == 30.0
+
+
+def test_scheduler_thread_starts_with_the_first_request_and_stops(make_app):
+    app = make_app(EXPIRY_SCHEDULER=True, EXPIRY_INTERVAL=0.05)
+    scheduler = app.extensions['expiry_scheduler']
+    scheduler.clock = FakeClock(BOOKED + timedelta(minutes=1))
+    with app.app_context():
+        [r_id] = park(1)
+    # building the app (and so every `flask` command) leaves the thread alone
+    assert scheduler._thread is None
+    app.test_client().get('/')
+    thread = scheduler._thread
+    assert thread is not None and thread.is_alive()
+    app.test_client().get('/')
+    assert scheduler._thread is thread
+    try:
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with app.app_context():
+                if db.session.get(Reservation, r_id).overstayed_at is not None:
+                    break
+            time.sleep(0.02)
+        with app.app_context():
+            assert db.session.get(Reservation, r_id).overage_cost == 30.0
+    finally:
+        scheduler.stop(timeout=5)
+    assert not thread.is_alive() and scheduler._thread is None
@@ -0,0 +1,34 @@
+from vehicle import db
+from vehicle.models import ParkingLot, ParkingSpot, Reservation
+
+TOKEN = 'gate-token'
+
+
+def make_lot(spots=3):
+    lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=spots,
+                     cost_per_unit=30, available_count=spots, occupied_count=0)
+    db.session.add(lot)
+    db.session.flush()
+    ParkingSpot.provision(lot.lot_id, range(spots))
+    db.session.commit()
+    return lot.lot_id
+
+
+def checkin(lot_id, plate, **fields):
+    return {'lot_id': lot_id, 'hours': 2, 'vehicle_model': 'car', 'vehicle_number': plate, **fields}
+
+
+def test_out_of_range_items_fail_alone(make_app):
+    app = make_app(GATE_API_TOKEN=TOKEN)
+    with app.app_context():
+        lot_id = make_lot()
+    response = app.test_client().post('/api/gate/batch', headers={'Authorization': f'Bearer {TOKEN}'}, json={'checkins': [
+        checkin(lot_id, 'GT0001', hours=10**9), checkin(lot_id, 'GT0002', hours=25), checkin(10**30, 'GT0003'),
+        checkin(lot_id, 'GT0004', user_id=2**63), checkin(lot_id, 'GT0005', hours=24)]})
+    assert response.status_code == 200
+    results = response.get_json()['checkins']
+    assert [result['ok'] for result in results] == [False, False, False, False, True]
+    assert results[0]['error'] == results[1]['error'] == "hours must be at most 24"
+    with app.app_context():
+        assert db.session.scalars(db.select(Reservation.nameplate_num)).all() == ['GT0005']
+        assert db.session.get(ParkingLot, lot_id).occupied_count == 1
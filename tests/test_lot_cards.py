@@ -0,0 +1,20 @@
+from tests.helpers import create_user, login
+
+
+def lot_form(location):
+    return {'primary_location': location, 'full_address': '1 Test Road', 'pincode': '500001', 'cost_per_unit': '30', 'max_spots': '10'}
+
+
+def test_other_workers_do_not_serve_a_deleted_lots_card(make_app):
+    # two workers on one database, each with its own in-memory fragment cache
+    first, second = make_app('shared'), make_app('shared')
+    with first.app_context():
+        admin_id = create_user('admin', is_admin=True)
+    admin_a, admin_b = login(first.test_client(), admin_id), login(second.test_client(), admin_id)
+    admin_a.post('/admin/home', data=lot_form('Alpha'))
+    assert 'Parking Lot #1 - Alpha' in admin_a.get('/admin/home').get_data(as_text=True)
+
+    admin_b.post('/admin/delete_lot/1')
+    admin_b.post('/admin/home', data=lot_form('Beta'))
+    page = admin_a.get('/admin/home').get_data(as_text=True)
+    assert 'Alpha' not in page and 'Parking Lot #2 - Beta' in page
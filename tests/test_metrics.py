@@ -0,0 +1,54 @@
+import threading
+import pytest
+from vehicle import create_app, db
+from vehicle.config import DevelopmentConfig, ProductionConfig
+from vehicle.metrics import Counter, Histogram
+
+
+def run_in_threads(target, count):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_exited_threads_fold_their_shards_into_the_totals():
+    counter, histogram = Counter('test_total', "Test counter.", ('result',)), Histogram('test_seconds', "Test histogram.")
+
+    def work():
+        for _ in range(3):
+            counter.inc('ok')
+            histogram.observe(0.01)
+
+    # one thread per request, as werkzeug's threaded dev server does
+    run_in_threads(work, 500)
+    assert counter.shard_count() == histogram.shard_count() == 0
+    assert counter.values() == {('ok',): 1500}
+    assert histogram.values()[()][-1] == 1500
+    work()
+    assert counter.shard_count() == 1
+    assert counter.values() == {('ok',): 1503}
+
+
+def configured_app(tmp_path, base=ProductionConfig, **settings):
+    config = type('MetricsTestConfig', (base,), {'SECRET_KEY': 'test', 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/prod.db', **settings})
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def test_production_keeps_metrics_private(tmp_path):
+    assert configured_app(tmp_path, METRICS_ENABLED=False).test_client().get('/metrics').status_code == 404
+    with pytest.raises(RuntimeError, match='METRICS_TOKEN'):
+        configured_app(tmp_path, METRICS_ENABLED=True, METRICS_TOKEN=None)
+    client = configured_app(tmp_path, METRICS_ENABLED=True, METRICS_TOKEN='scrape').test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape'}).status_code == 200
+
+
+def test_metrics_are_off_unless_enabled(tmp_path):
+    app = configured_app(tmp_path, base=DevelopmentConfig)
+    assert 'metrics' not in app.extensions
+    assert app.test_client().get('/metrics').status_code == 404
@@ -0,0 +1,78 @@
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from vehicle import db
+from vehicle.models import User, ParkingLot, Reservation
+from tests.helpers import create_user, login, seed_quietly
+
+# tables that grow with traffic; parking_lot is small and listed whole by the dashboards
+FULL_SCAN = re.compile(r'^SCAN (reservation|parking_spot|advance_booking)\b')
+
+
+def test_hot_lookups_use_indexes(app):
+    with app.app_context():
+        seed_quietly(users=5, lots=3, spots_per_lot=5, reservations=500)
+        admin_id = create_user('admin', is_admin=True)
+        user_id = User.query.filter_by(username='bench0').one().id
+        lot_id = db.session.scalar(db.select(ParkingLot.lot_id).order_by(ParkingLot.lot_id))
+        engine = db.engine
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        user, admin = login(app.test_client(), user_id), login(app.test_client(), admin_id)
+        user.post('/user/book_spot', data={'lot_id': lot_id, 'cost_per_hour': 30, 'no_of_hours': 2, 'vehicle_model': 'car', 'vehicle_number': 'PLAN01'})
+        with app.app_context():
+            r_id = db.session.scalar(db.select(Reservation.r_id).filter_by(nameplate_num='PLAN01', actual_checkout_time=None))
+        user.post(f'/user/release_spot/{r_id}')
+        start = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M')
+        user.post('/user/book_ahead', data={'lot_id': lot_id, 'start_time': start, 'no_of_hours': 2, 'vehicle_model': 'car', 'vehicle_number': 'PLAN02'})
+        user.get('/user/home')
+        admin.get('/admin/home')
+        admin.get(f'/admin/user_history/{user_id}')
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    assert statements
+    with app.app_context():
+        connection = db.session.connection().connection.driver_connection
+        for statement, parameters in statements:
+            plan = [row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            assert not [step for step in plan if FULL_SCAN.match(step)], f"full scan in {statement}: {plan}"
+
+
+def test_history_pages_walk_the_index_in_order(app):
+    # a page must not sort the user's whole history (USE TEMP B-TREE), or its cost grows with the history
+    with app.app_context():
+        seed_quietly(users=1, lots=2, spots_per_lot=5, reservations=300)
+        admin_id = create_user('admin', is_admin=True)
+        user_id = User.query.filter_by(username='bench0').one().id
+        engine = db.engine
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith('SELECT') and 'LIMIT' in statement and 'FROM reservation' in statement:
+            statements.append((statement, parameters))
+
+    user, admin = login(app.test_client(), user_id), login(app.test_client(), admin_id)
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        for client, path in ((user, '/user/home'), (admin, f'/admin/user_history/{user_id}')):
+            after = None
+            for _ in range(3):
+                response = client.get(path, query_string={'after': after} if after else {})
+                assert response.status_code == 200
+                after = re.search(r'after=(\d+)', response.get_data(as_text=True)).group(1)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    assert len(statements) >= 6
+    with app.app_context():
+        connection = db.session.connection().connection.driver_connection
+        for statement, parameters in statements:
+            plan = [row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            assert not [step for step in plan if 'TEMP B-TREE' in step], f"sorted page in {statement}: {plan}"
@@ -0,0 +1,76 @@
+import csv
+import io
+from datetime import date, timedelta
+from vehicle import db
+from vehicle.analytics import revenue_by_lot
+from vehicle.models import ParkingLot, ParkingSpot, Reservation, LotDailyRollup
+from tests.helpers import create_user, login
+
+
+def book_and_release(client, lot_id, plate):
+    client.post('/user/book_spot', data={'lot_id': lot_id, 'cost_per_hour': 30, 'no_of_hours': 1, 'vehicle_model': 'car', 'vehicle_number': plate})
+    r_id = db.session.scalar(db.select(Reservation.r_id).filter_by(nameplate_num=plate, actual_checkout_time=None))
+    client.post(f'/user/release_spot/{r_id}')
+
+
+def test_single_day_range_includes_that_day(app):
+    today = date.today().isoformat()
+    with app.app_context():
+        lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=2,
+                         cost_per_unit=30, available_count=2, occupied_count=0)
+        db.session.add(lot)
+        db.session.flush()
+        ParkingSpot.provision(lot.lot_id, range(2))
+        db.session.commit()
+        lot_id = lot.lot_id
+        user = login(app.test_client(), create_user('driver'))
+        admin = login(app.test_client(), create_user('admin', is_admin=True))
+        book_and_release(user, lot_id, 'RL0001')
+        book_and_release(user, lot_id, 'RL0002')
+
+        assert revenue_by_lot(date.today(), date.today())[lot_id]['reservations'] == 2
+        assert revenue_by_lot(date.today() + timedelta(days=1)) == {}
+        # rebuilding a range that is already rolled up replaces its rows instead of colliding with them
+        for _ in range(2):
+            result = app.test_cli_runner().invoke(args=['rebuild-rollups', '--start', today, '--end', today])
+            assert result.exit_code == 0, result.output
+            assert 'Rebuilt 1 daily rollup row(s).' in result.output
+        assert [(row.lot_id, row.reservations, row.revenue) for row in LotDailyRollup.query] == [(lot_id, 2, 60)]
+
+    response = admin.get(f'/admin/summary?start={today}&end={today}')
+    assert response.status_code == 200 and b'Downtown (ID: ' in response.data
+    rows = list(csv.DictReader(io.StringIO(admin.get(f'/admin/export/revenue.csv?start={today}&end={today}').get_data(as_text=True))))
+    assert [(int(row['lot_id']), int(row['reservations'])) for row in rows] == [(lot_id, 2)]
+
+
+def test_summary_exports_select_the_same_reservations(app):
+    today = date.today()
+    with app.app_context():
+        lot = ParkingLot(primary_location='Downtown', full_address='1 Test Road', pincode='500001', max_spots=3,
+                         cost_per_unit=30, available_count=3, occupied_count=0)
+        db.session.add(lot)
+        db.session.flush()
+        ParkingSpot.provision(lot.lot_id, range(3))
+        db.session.commit()
+        lot_id = lot.lot_id
+        user = login(app.test_client(), create_user('driver'))
+        admin = login(app.test_client(), create_user('admin', is_admin=True))
+        book_and_release(user, lot_id, 'RL0001')
+        # checked in yesterday, out today: revenue of today, check-in of yesterday
+        reservation = Reservation.query.filter_by(nameplate_num='RL0001').one()
+        reservation.checkin_time -= timedelta(days=1)
+        db.session.commit()
+        user.post('/user/book_spot', data={'lot_id': lot_id, 'cost_per_hour': 30, 'no_of_hours': 1, 'vehicle_model': 'car', 'vehicle_number': 'RL0002'})
+
+    summary = admin.get(f'/admin/summary?start={today}&end={today}').get_data(as_text=True)
+    link = f'/admin/export/reservations.csv?by=checkout&amp;start={today}&amp;end={today}'
+    assert link in summary
+    reservations = list(csv.DictReader(io.StringIO(admin.get(link.replace('&amp;', '&')).get_data(as_text=True))))
+    revenue = list(csv.DictReader(io.StringIO(admin.get(f'/admin/export/revenue.csv?start={today}&end={today}').get_data(as_text=True))))
+    assert [row['nameplate_num'] for row in reservations] == ['RL0001']
+    assert [int(row['reservations']) for row in revenue] == [1]
+    assert float(reservations[0]['final_cost']) == float(revenue[0]['revenue'])
+    # the default stays on the check-in day
+    by_checkin = admin.get(f'/admin/export/reservations.csv?start={today}&end={today}').get_data(as_text=True)
+    assert 'RL0002' in by_checkin and 'RL0001' not in by_checkin
+    assert admin.get('/admin/export/reservations.csv?by=spot').status_code == 404
@@ -0,0 +1,25 @@
+from vehicle.models import User
+from tests.helpers import create_user, login, seed_quietly
+
+# the summary pages aggregate in SQL, so the number of statements they run must not grow with the data
+
+
+def summary_query_counts(app, reservations):
+    with app.app_context():
+        seed_quietly(users=5, lots=4, spots_per_lot=5, reservations=reservations, deleted_lots=2)
+        admin_id = create_user('admin', is_admin=True)
+        user_id = User.query.filter_by(username='bench0').one().id
+    admin, user = login(app.test_client(), admin_id), login(app.test_client(), user_id)
+    counts = {}
+    for client, path in ((admin, '/admin/summary'), (admin, '/admin/summary?start=2020-01-01&end=2100-01-01'), (admin, '/admin/home'),
+                         (user, '/user/summary')):
+        response = client.get(path)
+        assert response.status_code == 200
+        counts[path] = int(response.headers['X-SQL-Queries'])
+    return counts
+
+
+def test_summary_query_count_does_not_grow_with_data(make_app):
+    small = summary_query_counts(make_app('small'), 20)
+    large = summary_query_counts(make_app('large'), 2000)
+    assert small == large
@@ -1,11 +1,20 @@
-from flask import Flask
+from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
 import sqlite3
+import os
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_migrate import Migrate
+from sqlalchemy.orm import make_transient_to_detached
+from vehicle.caching import LRUCache, SQLiteCache, FragmentCache
+from vehicle.passwords import PasswordPool
+from vehicle.events import EventBroker
+from vehicle.instrumentation import init_instrumentation
+from vehicle.metrics import init_metrics
+from vehicle.sqlite_profiles import PROFILES, apply_pragmas
+from vehicle.config import get_config
 
 @event.listens_for(Engine, "connect")
 def enforce_sqlite_foreign_keys(dbapi_connection, connection_record):
@@ -16,27 +25,72 @@ def enforce_sqlite_foreign_keys(dbapi_connection, connection_record):
 
 db = SQLAlchemy()
 migrate = Migrate()
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///vehicle.db'  
-app.config['SECRET_KEY'] = 'a7d09d781f30ce21722f71f0e69e34'
-db.init_app(app)
-migrate.init_app(app, db)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = "login_page"
+bcrypt = Bcrypt()
+login_manager = LoginManager()
+login_manager.login_view = "main.login_page"
 login_manager.login_message_category="info"
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-with app.app_context():
     from vehicle.models import User
-    db.create_all()
-    if not User.query.filter_by(is_admin = True).first():
-        admin = User(first_name = 'John', last_name = 'Doe',email_address = 'adminvp@gmail.com',username = 'admin',contact_number = '9988776655',address = 'Admin Headquarters, XYZ', pincode = '501011',is_admin = True)
-        admin.password= 'admin-vp101'
-        db.session.add(admin)
-        db.session.commit()
-
-from vehicle.controllers import routes
+    # the cache holds plain column values; merge(load=False) attaches a fresh instance
+    # to this request's session without a SELECT
+    user_cache = current_app.extensions['user_cache']
+    values = user_cache.get(int(user_id))
+    if values is None:
+        user = db.session.get(User, int(user_id))
+        if user is not None:
+            user_cache.set(user.id, {column.key: getattr(user, column.key) for column in User.__table__.columns})
+        return user
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def make_fragment_backend(app):
+    if app.config['FRAGMENT_CACHE_BACKEND'] == 'sqlite':
+        path = app.config['FRAGMENT_CACHE_PATH'] or os.path.join(app.instance_path, 'fragments.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteCache(path, ttl=app.config['FRAGMENT_CACHE_TTL'])
+    return LRUCache(maxsize=app.config['FRAGMENT_CACHE_SIZE'], ttl=app.config['FRAGMENT_CACHE_TTL'])
+
+def create_app(config=None):
+    # building the app never touches the database; schema creation and the admin
+    # account are handled by the `flask init-db` / `flask seed-admin` commands
+    app = Flask(__name__)
+    app.config.from_object(get_config(config))
+    if not app.config.get('SECRET_KEY'):
+        raise RuntimeError("SECRET_KEY must be set for this configuration.")
+    if app.config['METRICS_ENABLED'] and app.config['METRICS_REQUIRE_TOKEN'] and not app.config.get('METRICS_TOKEN'):
+        raise RuntimeError("METRICS_TOKEN must be set to enable /metrics in this configuration.")
+
+    sqlite_profile = PROFILES[app.config['SQLITE_PROFILE']]
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', sqlite_profile['engine_options'])
+    db.init_app(app)
+    migrate.init_app(app, db)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    with app.app_context():
+        apply_pragmas(db.engine, sqlite_profile['pragmas'])
+        if app.config['SQL_INSTRUMENTATION']:
+            init_instrumentation(app, db.engine)
+
+    app.extensions['user_cache'] = LRUCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    app.extensions['password_pool'] = PasswordPool(workers=app.config['BCRYPT_WORKERS'], max_pending=app.config['BCRYPT_MAX_PENDING'])
+    app.extensions['fragment_cache'] = FragmentCache(make_fragment_backend(app))
+    app.extensions['event_broker'] = EventBroker(queue_size=app.config['EVENT_QUEUE_SIZE'])
+    if app.config['METRICS_ENABLED']:
+        init_metrics(app)
+
+    from vehicle.controllers.routes import main
+    from vehicle.controllers.api import api
+    from vehicle.commands import register_commands
+    from vehicle.availability import AvailabilityIndex
+    app.extensions['availability'] = AvailabilityIndex()
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+    register_commands(app)
+
+    if app.config['EXPIRY_SCHEDULER']:
+        from vehicle.expiry import init_expiry_scheduler
+        init_expiry_scheduler(app)
+    return app
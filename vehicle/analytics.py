@@ -0,0 +1,62 @@
+from vehicle import db
+from vehicle.models import ParkingLot, ParkingSpot, Reservation, LotDailyRollup
+from sqlalchemy import func
+from datetime import datetime
+
+
+def revenue_by_lot(start=None, end=None):
+    # reads the daily rollups, so the cost is lots x days in range rather than every reservation ever made;
+    # start/end are inclusive days
+    query = db.session.query(LotDailyRollup.lot_id, ParkingLot.primary_location, func.max(LotDailyRollup.primary_location),
+                             func.sum(LotDailyRollup.revenue), func.sum(LotDailyRollup.reservations), func.sum(LotDailyRollup.occupied_hours))\
+        .outerjoin(ParkingLot, ParkingLot.lot_id == LotDailyRollup.lot_id)\
+        .group_by(LotDailyRollup.lot_id, ParkingLot.primary_location)\
+        .order_by(func.min(LotDailyRollup.day), LotDailyRollup.lot_id)
+    if start:
+        query = query.filter(LotDailyRollup.day >= start)
+    if end:
+        query = query.filter(LotDailyRollup.day <= end)
+
+    revenue = {}
+    for lot_id, location, archived_location, total, reservations, hours in query:
+        if location is not None:
+            label = f"{location} (ID: {lot_id})"
+        else:
+            label = f"{archived_location or 'Deleted Lot'} (ID: {lot_id if lot_id >= 0 else None}) (Deleted)"
+        revenue[lot_id] = {"label": label, "value": total or 0, "reservations": reservations, "occupied_hours": hours or 0}
+    return revenue
+
+
+def occupancy_by_lot():
+    rows = db.session.query(ParkingLot.lot_id, ParkingLot.primary_location, ParkingLot.max_spots, ParkingLot.occupied_count)\
+        .order_by(ParkingLot.lot_id)
+
+    return {lot_id: {'label': f"{location} (ID:{lot_id})", 'available': max_spots - occupied, 'occupied': occupied}
+            for lot_id, location, max_spots, occupied in rows}
+
+
+def user_stats_by_lot(user_id, now=None):
+    # visits and total parked minutes per lot for one user; open reservations run until `now`
+    now = now or datetime.now()
+    minutes = (func.julianday(func.coalesce(Reservation.actual_checkout_time, now)) - func.julianday(Reservation.checkin_time)) * 1440
+
+    live = db.session.query(ParkingLot.lot_id, ParkingLot.primary_location, func.count(Reservation.r_id), func.sum(minutes), func.min(Reservation.r_id))\
+        .join(ParkingSpot, ParkingSpot.lot_id == ParkingLot.lot_id)\
+        .join(Reservation, Reservation.spot_id == ParkingSpot.spot_id)\
+        .filter(Reservation.user_id == user_id)\
+        .group_by(ParkingLot.lot_id, ParkingLot.primary_location)
+
+    archived = db.session.query(Reservation.archived_lot_id, func.max(Reservation.archived_primary_location), func.count(Reservation.r_id), func.sum(minutes), func.min(Reservation.r_id))\
+        .filter(Reservation.user_id == user_id, Reservation.spot_id.is_(None))\
+        .group_by(Reservation.archived_lot_id)
+
+    rows = [(lot_id, location, False, visits, total, first_r_id) for lot_id, location, visits, total, first_r_id in live]
+    rows += [(lot_id if lot_id is not None else -1, location, True, visits, total, first_r_id) for lot_id, location, visits, total, first_r_id in archived]
+
+    stats = {}
+    for lot_id, location, deleted, visits, total, first_r_id in sorted(rows, key=lambda row: row[5]):
+        if lot_id not in stats:
+            stats[lot_id] = {'location': location, 'deleted': deleted, 'visits': 0, 'minutes': 0}
+        stats[lot_id]['visits'] += visits
+        stats[lot_id]['minutes'] += total or 0
+    return stats
@@ -0,0 +1,129 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from math import ceil
+from flask import current_app
+from vehicle import db
+from vehicle.models import ParkingLot, ParkingSpot, Reservation, AdvanceBooking
+
+# Availability for future windows. Each spot keeps its commitments as an interval index: the booked end
+# of the car parked there now, then its booked windows, which never overlap, so ordering them by start
+# also orders their ends and a single bisect finds the neighbours of [start, end). A lot query is one
+# bisect per spot (lots hold at most 40), and timelines are cached per lot against parking_lot.version.
+
+
+class SpotTimeline:
+    __slots__ = ('spot_id', 'spot_index', 'held_until', 'starts', 'ends')
+
+    def __init__(self, spot_id, spot_index, held_until=None, windows=()):
+        self.spot_id = spot_id
+        self.spot_index = spot_index
+        self.held_until = held_until
+        self.starts = [start for start, _ in windows]
+        self.ends = [end for _, end in windows]
+
+    def slack(self, start, end):
+        # (idle time before, idle time after) when [start, end) fits, else None; a side with nothing
+        # booked on it is None
+        i = bisect_right(self.starts, start)
+        before = self.ends[i - 1] if i else None
+        if self.held_until is not None and (before is None or self.held_until > before):
+            before = self.held_until
+        if before is not None and before > start:
+            return None
+        after = self.starts[i] if i < len(self.starts) else None
+        if after is not None and after < end:
+            return None
+        return (None if before is None else start - before, None if after is None else after - end)
+
+
+class LotTimeline:
+
+    def __init__(self, lot_id, version, spots):
+        self.lot_id = lot_id
+        self.version = version
+        self.spots = spots
+
+    def placements(self, start, end):
+        # (score, spot) for every spot that can take the window. Best fit: windows go into the gap they
+        # fill most tightly, so untouched spots stay whole for long bookings and walk-ins
+        for spot in self.spots:
+            slack = spot.slack(start, end)
+            if slack is not None:
+                before, after = slack
+                idle = (before or timedelta(0)) + (after or timedelta(0))
+                yield ((before is None) + (after is None), idle, spot.spot_index), spot
+
+    def free_count(self, start, end):
+        return sum(1 for _ in self.placements(start, end))
+
+    def best_spot(self, start, end, exclude=()):
+        best = min(((score, spot) for score, spot in self.placements(start, end) if spot.spot_id not in exclude),
+                   key=lambda placement: placement[0], default=None)
+        return best[1] if best else None
+
+    @classmethod
+    def load(cls, lot_id, version, now):
+        # two queries: the spots with the booked end of whatever is parked on them, and the lot's booked windows
+        spots = db.session.execute(db.select(ParkingSpot.spot_id, ParkingSpot.spot_index, Reservation.checkout_time)
+                                   .outerjoin(Reservation, db.and_(Reservation.spot_id == ParkingSpot.spot_id,
+                                                                   Reservation.actual_checkout_time.is_(None)))
+                                   .where(ParkingSpot.lot_id == lot_id).order_by(ParkingSpot.spot_index)).all()
+        windows = defaultdict(list)
+        for spot_id, start, end in db.session.execute(db.select(AdvanceBooking.spot_id, AdvanceBooking.start_time, AdvanceBooking.end_time)
+                                                      .where(AdvanceBooking.lot_id == lot_id, AdvanceBooking.status == 'B',
+                                                             AdvanceBooking.end_time > now)
+                                                      .order_by(AdvanceBooking.start_time)):
+            windows[spot_id].append((start, end))
+        return cls(lot_id, version, [SpotTimeline(spot_id, spot_index, held_until, windows.get(spot_id, ()))
+                                     for spot_id, spot_index, held_until in spots])
+
+
+# built once: constructing and caching a fresh ORM select costs several times more than running it
+_LOT_VERSION = db.select(ParkingLot.__table__.c.version).where(ParkingLot.__table__.c.lot_id == db.bindparam('lot_id'))
+
+
+class AvailabilityIndex:
+    # per-app cache of lot timelines. Every booking, release, check-in and advance booking bumps the lot
+    # version, so while nothing changes a query costs one version lookup; timelines are never mutated,
+    # which lets request threads share them without a lock
+
+    def __init__(self):
+        self._lots = {}
+
+    def timeline(self, lot_id, now=None):
+        version = db.session.scalar(_LOT_VERSION, {'lot_id': lot_id})
+        if version is None:
+            self._lots.pop(lot_id, None)
+            return None
+        timeline = self._lots.get(lot_id)
+        if timeline is None or timeline.version != version:
+            timeline = self._lots[lot_id] = LotTimeline.load(lot_id, version, now or datetime.now())
+        return timeline
+
+    def invalidate(self, lot_id):
+        # deleted lots are dropped right away instead of lingering until someone queries them
+        self._lots.pop(lot_id, None)
+
+    def __contains__(self, lot_id):
+        return lot_id in self._lots
+
+
+def allocate_window(lot, user_id, start, end, vehicle_model, nameplate_num, attempts=5):
+    # best-fit spot from the cached timeline, then the guarded insert; a spot lost to a concurrent
+    # booking is skipped and the next best one tried. Returns the booking or None when the lot is full
+    index = current_app.extensions['availability']
+    hours = ceil((end - start).total_seconds() / 3600)
+    tried = set()
+    for _ in range(attempts):
+        spot = index.timeline(lot.lot_id).best_spot(start, end, exclude=tried)
+        if spot is None:
+            return None
+        booking_id = AdvanceBooking.reserve(spot.spot_id, user_id=user_id, lot_id=lot.lot_id, start_time=start, end_time=end,
+                                            vehicle_model=vehicle_model, nameplate_num=nameplate_num,
+                                            cost_per_unit=float(lot.cost_per_unit), estimated_cost=float(lot.cost_per_unit * hours))
+        if booking_id is not None:
+            ParkingLot.touch(lot.lot_id)
+            return db.session.get(AdvanceBooking, booking_id)
+        tried.add(spot.spot_id)
+    return None
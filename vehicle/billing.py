@@ -0,0 +1,46 @@
+from datetime import datetime
+from math import ceil
+
+# Column-wise billing: a whole result set is billed against one `now` snapshot, so every row of
+# a page or export agrees on the time. The results match calculate_cost_at / parking_duration
+# exactly, float rounding included.
+
+
+def elapsed_seconds(checkins, ends, now):
+    # open reservations (end is None) run until `now`
+    return [((now if end is None else end) - checkin).total_seconds() for checkin, end in zip(checkins, ends)]
+
+
+def billed_hours(seconds):
+    # every started hour is billed, with a one hour minimum
+    return [max(1, ceil(elapsed / 3600)) for elapsed in seconds]
+
+
+def costs(hours, rates):
+    return [round(billed * rate, 2) for billed, rate in zip(hours, rates)]
+
+
+def format_durations(seconds):
+    return [f"{int(s // 3600)} hr {int((s % 3600) // 60)} min" for s in seconds]
+
+
+def bill_columns(checkins, ends, rates, now=None):
+    now = now or datetime.now()
+    seconds = elapsed_seconds(checkins, ends, now)
+    hours = billed_hours(seconds)
+    return {'seconds': seconds, 'hours': hours, 'cost': costs(hours, rates)}
+
+
+def bill_rows(rows, now=None):
+    # rows: (r_id, checkin_time, actual_checkout_time, cost_per_unit), e.g. straight from a Core select
+    r_ids, checkins, ends, rates = ([row[i] for row in rows] for i in range(4))
+    return dict(bill_columns(checkins, ends, rates, now), r_id=r_ids)
+
+
+def bill_reservations(reservations, now=None):
+    # r_id -> {'hours', 'cost', 'duration'} for the templates
+    columns = bill_columns([res.checkin_time for res in reservations], [res.actual_checkout_time for res in reservations],
+                           [res.cost_per_unit for res in reservations], now)
+    durations = format_durations(columns['seconds'])
+    return {res.r_id: {'hours': hours, 'cost': cost, 'duration': duration}
+            for res, hours, cost, duration in zip(reservations, columns['hours'], columns['cost'], durations)}
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from threading import Lock, local
+import sqlite3
+import json
+import time
+
+
+class LRUCache:
+    # thread-safe in-process LRU with a per-entry time to live and hit/miss counters
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class SQLiteCache:
+    # file-backed cache with the same get/set/invalidate interface as LRUCache; the file can be
+    # shared by every worker process on the host
+
+    def __init__(self, path, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = local()
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cache_entry (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key, default=None):
+        row = self._connect().execute("SELECT value, expires FROM cache_entry WHERE key = ?", (str(key),)).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO cache_entry (key, value, expires) VALUES (?, ?, ?)",
+                               (str(key), json.dumps(value), time.time() + self.ttl))
+
+    def invalidate(self, key):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM cache_entry WHERE key = ?", (str(key),))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM cache_entry")
+
+    def stats(self):
+        size = self._connect().execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+
+class FragmentCache:
+    # rendered HTML keyed by an object id and validated against a version stamp, so a bumped
+    # stamp makes the old fragment a miss without having to find and delete it
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp):
+        entry = self.backend.get(key)
+        if entry is None or entry[0] != stamp:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, stamp, html):
+        self.backend.set(key, [stamp, str(html)])
+
+    def invalidate(self, key):
+        self.backend.invalidate(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
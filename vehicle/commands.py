@@ -0,0 +1,92 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_migrate import stamp
+from vehicle import db
+from vehicle.models import User, ParkingLot, LotDailyRollup
+from vehicle.exports import FORMATS, DATE_COLUMNS, RESERVATION_FIELDS, reservation_chunks
+from vehicle.expiry import ExpiryScheduler, expire_overstays
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db():
+    """Create any missing tables; a fresh database is also stamped with the latest migration."""
+    fresh = not db.inspect(db.engine).get_table_names()
+    db.create_all()
+    if fresh:
+        # the tables already match the models, so later `flask db upgrade` runs start from here
+        stamp()
+    click.echo("Database tables created.")
+
+
+@click.command('seed-admin')
+@click.option('--username', default='admin', show_default=True)
+@click.option('--password', default='admin-vp101', show_default=True)
+@click.option('--email', default='adminvp@gmail.com', show_default=True)
+@with_appcontext
+def seed_admin(username, password, email):
+    """Create the admin account if there is none yet."""
+    if User.query.filter_by(is_admin = True).first():
+        click.echo("An admin account already exists.")
+        return
+    admin = User(first_name = 'John', last_name = 'Doe',email_address = email,username = username,contact_number = '9988776655',address = 'Admin Headquarters, XYZ', pincode = '501011',is_admin = True)
+    admin.password = password
+    db.session.add(admin)
+    db.session.commit()
+    click.echo(f"Admin account '{username}' created.")
+
+
+@click.command('reconcile-lot-counts')
+@with_appcontext
+def reconcile_lot_counts():
+    """Recompute every lot's available/occupied counters from parking_spot."""
+    updated = ParkingLot.reconcile_counts()
+    db.session.commit()
+    click.echo(f"Reconciled spot counts for {updated} lot(s).")
+
+
+@click.command('export-reservations')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv', show_default=True)
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='First day (inclusive).')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Last day (inclusive).')
+@click.option('--by', type=click.Choice(sorted(DATE_COLUMNS)), default='checkin', show_default=True,
+              help='Filter on the check-in day, or on the checkout day like the revenue rollups.')
+@click.option('--lot-id', type=int, help='Only reservations of this lot, deleted lots included.')
+@click.option('--output', type=click.File('w'), default='-', show_default=True)
+@with_appcontext
+def export_reservations(fmt, start, end, by, lot_id, output):
+    """Stream reservations, with their lot and billed amount, as CSV or NDJSON."""
+    writer = FORMATS[fmt][0]
+    chunks = reservation_chunks(start=start and start.date(), end=end and end.date(), lot_id=lot_id, chunk_size=current_app.config['EXPORT_CHUNK_SIZE'], by=by)
+    for data in writer(chunks, RESERVATION_FIELDS):
+        output.write(data)
+
+
+@click.command('rebuild-rollups')
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='First day to rebuild (inclusive).')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Last day to rebuild (inclusive).')
+@with_appcontext
+def rebuild_rollups(start, end):
+    """Recompute the daily per-lot revenue/occupancy rollups from reservations."""
+    rows = LotDailyRollup.rebuild(start and start.date(), end and end.date())
+    db.session.commit()
+    click.echo(f"Rebuilt {rows} daily rollup row(s).")
+
+
+@click.command('expire-overstays')
+@click.option('--loop', is_flag=True, help='Keep running, waking up whenever the next reservation falls due.')
+@with_appcontext
+def expire_overstays_command(loop):
+    """Flag reservations past their booked end and update their accrued overage."""
+    app = current_app._get_current_object()
+    if loop:
+        ExpiryScheduler(app, interval=app.config['EXPIRY_INTERVAL'], batch_size=app.config['EXPIRY_BATCH_SIZE']).run()
+    else:
+        processed = expire_overstays(batch_size=app.config['EXPIRY_BATCH_SIZE'])
+        click.echo(f"Flagged or re-priced {processed} overstayed reservation(s).")
+
+
+def register_commands(app):
+    for command in (init_db, seed_admin, reconcile_lot_counts, export_reservations, rebuild_rollups, expire_overstays_command):
+        app.cli.add_command(command)
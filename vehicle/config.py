@@ -0,0 +1,76 @@
+import os
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///vehicle.db')
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'a7d09d781f30ce21722f71f0e69e34')
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'default')
+    PAGE_SIZE = 20
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 300
+    BCRYPT_LOG_ROUNDS = 12
+    BCRYPT_WORKERS = 4
+    BCRYPT_MAX_PENDING = 32
+    # 'memory' is per process; 'sqlite' shares fragments between workers through FRAGMENT_CACHE_PATH
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    FRAGMENT_CACHE_PATH = os.environ.get('FRAGMENT_CACHE_PATH')
+    FRAGMENT_CACHE_SIZE = 512
+    FRAGMENT_CACHE_TTL = 60
+    EVENT_QUEUE_SIZE = 64
+    SSE_KEEPALIVE = 15
+    GATE_API_TOKEN = os.environ.get('GATE_API_TOKEN')
+    GATE_BATCH_LIMIT = 500
+    EXPORT_CHUNK_SIZE = 1000
+    # per-request query count/time headers, N+1 warnings and query budgets (see vehicle/instrumentation.py)
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    SQL_REPEAT_THRESHOLD = 3
+    SQL_QUERY_BUDGET_STRICT = False
+    # request counters/latency histograms and lot occupancy gauges on /metrics; per-lot occupancy is not
+    # for the public, so the endpoint is off unless asked for. Set METRICS_TOKEN to require a bearer token
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_REQUIRE_TOKEN = False
+    # background overstay expiry inside the web process (see vehicle/expiry.py); `flask expire-overstays` runs it standalone
+    EXPIRY_SCHEDULER = os.environ.get('EXPIRY_SCHEDULER', '').lower() in ('1', 'true', 'yes')
+    EXPIRY_INTERVAL = 60
+    EXPIRY_BATCH_SIZE = 500
+    # how far ahead a spot can be booked for a later window
+    ADVANCE_BOOKING_DAYS = 30
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    FRAGMENT_CACHE_BACKEND = 'memory'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+    SQLITE_PROFILE = 'default'
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    SQL_INSTRUMENTATION = True
+    SQL_QUERY_BUDGET_STRICT = True
+
+
+class ProductionConfig(Config):
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+    # enabling /metrics in production also takes a token
+    METRICS_REQUIRE_TOKEN = True
+
+
+configs = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_config(config=None):
+    # accepts a config name, a config class, or None for $VEHICLE_CONFIG (default: development)
+    if config is None:
+        config = os.environ.get('VEHICLE_CONFIG', 'development')
+    if isinstance(config, str):
+        return configs[config]
+    return config
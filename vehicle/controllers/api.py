@@ -0,0 +1,97 @@
+from flask import Blueprint, current_app, jsonify, request, abort
+from functools import wraps
+from datetime import datetime
+from hashlib import sha1
+from hmac import compare_digest
+from sqlalchemy.exc import OperationalError
+from vehicle import db
+from vehicle.models import ParkingLot, ParkingSpot
+from vehicle.gate import process_gate_batch
+from vehicle.instrumentation import query_budget
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+def gate_token_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # gate controllers authenticate with a shared bearer token; the endpoints are off until one is configured
+        token = current_app.config.get('GATE_API_TOKEN')
+        if not token:
+            abort(404)
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not compare_digest(supplied.encode(), token.encode()):
+            abort(401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@api.route('/lots')
+@query_budget(4)
+def lot_availability():
+    # the ETag only depends on (lot_id, version) of the matching lots, so an unchanged poll
+    # is answered with 304 from one parking_lot query and never reaches parking_spot; lot ids are
+    # never reused, so a deleted and recreated lot cannot come back with a stamp seen before
+    location = request.args.get('location')
+    query = db.session.query(ParkingLot.lot_id, ParkingLot.version)
+    if location:
+        query = query.filter(ParkingLot.primary_location == location)
+    stamps = query.order_by(ParkingLot.lot_id).all()
+    etag = sha1(f"{location}|{stamps}".encode()).hexdigest()
+
+    if request.if_none_match.contains(etag):
+        response = jsonify()
+        response.status_code = 304
+    else:
+        lots = ParkingLot.query.filter(ParkingLot.lot_id.in_([lot_id for lot_id, _ in stamps])).order_by(ParkingLot.lot_id).all()
+        first_free = ParkingSpot.first_free_by_lot([lot.lot_id for lot in lots])
+        response = jsonify([{'lot_id': lot.lot_id, 'location': lot.primary_location, 'cost_per_unit': lot.cost_per_unit,
+                             'available_count': lot.available_count, 'first_free_spot': first_free.get(lot.lot_id)} for lot in lots])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@api.route('/lots/<int:lot_id>/availability')
+@query_budget(3)
+def lot_window_availability(lot_id):
+    # free spots for the window [start, end) (ISO datetimes) and the spot a booking would get
+    try:
+        start, end = datetime.fromisoformat(request.args['start']), datetime.fromisoformat(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify(error="'start' and 'end' must be ISO datetimes"), 400
+    if end <= start:
+        return jsonify(error="'end' must be after 'start'"), 400
+    timeline = current_app.extensions['availability'].timeline(lot_id)
+    if timeline is None:
+        abort(404)
+    spot = timeline.best_spot(start, end)
+    return jsonify(lot_id=lot_id, start=start.isoformat(), end=end.isoformat(), free_spots=timeline.free_count(start, end),
+                   spot_id=spot.spot_id if spot else None)
+
+
+@api.route('/gate/batch', methods=['POST'])
+@gate_token_required
+def gate_batch():
+    # many check-ins/check-outs in one transaction, answered with one result per item in request order
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error="expected a JSON object with 'checkins' and/or 'checkouts'"), 400
+    checkins, checkouts = payload.get('checkins', []), payload.get('checkouts', [])
+    if not isinstance(checkins, list) or not isinstance(checkouts, list):
+        return jsonify(error="'checkins' and 'checkouts' must be lists"), 400
+    if len(checkins) + len(checkouts) > current_app.config['GATE_BATCH_LIMIT']:
+        return jsonify(error=f"at most {current_app.config['GATE_BATCH_LIMIT']} items per batch"), 413
+
+    try:
+        checkin_results, checkout_results = process_gate_batch(checkins, checkouts)
+        db.session.commit()
+    except OperationalError:
+        db.session.rollback()
+        return jsonify(error="database busy, retry the batch"), 503
+
+    broker = current_app.extensions['event_broker']
+    for result, status in [(r, 'A') for r in checkout_results] + [(r, 'O') for r in checkin_results]:
+        if result['ok']:
+            broker.publish({'type': 'spot', 'lot_id': result['lot_id'], 'spot_id': result['spot_id'], 'status': status})
+    return jsonify(checkins=checkin_results, checkouts=checkout_results)
@@ -1,5 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, IntegerField, DecimalField, SelectField, HiddenField
+from wtforms import StringField, PasswordField, SubmitField, IntegerField, DecimalField, SelectField, HiddenField, DateTimeLocalField
+from wtforms.widgets import HiddenInput
 from wtforms.validators import Length, EqualTo, Email, DataRequired, ValidationError, Regexp, NumberRange
 from vehicle.models import User, ParkingLot
 
@@ -60,6 +61,15 @@ class BookingForm(FlaskForm):
     vehicle_number = StringField(label='Vehicle Number:', validators=[DataRequired()])
     submit = SubmitField('Book The Spot')
 
+class AdvanceBookingForm(FlaskForm):
+    # rendered as a hidden input; out-of-range ids would overflow SQLite's INTEGER when bound
+    lot_id = IntegerField(widget=HiddenInput(), validators=[DataRequired(), NumberRange(min=1, max=2**63 - 1)])
+    start_time = DateTimeLocalField(label='Arrival:', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
+    no_of_hours = IntegerField(label='Number of hours:', validators=[DataRequired(), NumberRange(min=1, max=24)])
+    vehicle_model = StringField(label='Vehicle Model:', validators=[DataRequired(), Length(max=20)])
+    vehicle_number = StringField(label='Vehicle Number:', validators=[DataRequired(), Length(max=15)])
+    submit = SubmitField('Book Ahead')
+
 class ReleaseSpotForm(FlaskForm):
     r_id = HiddenField()
     submit = SubmitField(label='Release')
@@ -1,54 +1,85 @@
-from vehicle import app, db
-from flask import render_template, flash, redirect, url_for, abort, request
+from vehicle import db
+from flask import Blueprint, Response, current_app, render_template, flash, redirect, url_for, abort, request, stream_with_context
 from functools import wraps
 from datetime import datetime, timedelta
-from vehicle.controllers.forms import RegistrationForm, LoginForm, CreateParkingLotForm, DeleteParkingLotForm, SearchParkingLot, BookingForm, ReleaseSpotForm, EditProfileForm, AdminSearchForm
-from vehicle.models import User, ParkingLot, ParkingSpot, Reservation
+from vehicle.controllers.forms import RegistrationForm, LoginForm, CreateParkingLotForm, DeleteParkingLotForm, SearchParkingLot, BookingForm, AdvanceBookingForm, ReleaseSpotForm, EditProfileForm, AdminSearchForm
+from vehicle.models import User, ParkingLot, ParkingSpot, Reservation, LotDailyRollup, AdvanceBooking
+from vehicle.availability import allocate_window
+from vehicle.analytics import revenue_by_lot, occupancy_by_lot, user_stats_by_lot
+from vehicle.pagination import keyset_page
+from vehicle.billing import bill_reservations
+from vehicle.exports import FORMATS, DATE_COLUMNS, RESERVATION_FIELDS, REVENUE_FIELDS, reservation_chunks, revenue_chunks
+from vehicle.passwords import PasswordPoolBusy
+from vehicle.instrumentation import query_budget
+from vehicle.metrics import CONTENT_TYPE, count, observe
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy.orm import joinedload
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from hmac import compare_digest
 from collections import defaultdict
-from sqlalchemy import desc
+import json
+import time
 
-@app.route('/')
-@app.route('/home')
+main = Blueprint('main', __name__)
+
+@main.route('/')
+@main.route('/home')
 def welcome():
     return render_template('welcome.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login_page():
     form = LoginForm()
     if form.validate_on_submit():
         attempted_user = User.query.filter_by(username = form.username.data).first()
         if attempted_user:
-            if attempted_user.check_password(password_to_check = form.pass_1.data):
+            try:
+                password_ok = attempted_user.check_password(password_to_check = form.pass_1.data)
+                if password_ok and attempted_user.needs_rehash():
+                    attempted_user.password = form.pass_1.data
+                    db.session.commit()
+                    current_app.extensions['user_cache'].invalidate(attempted_user.id)
+            except PasswordPoolBusy:
+                count('parking_logins_total', 'busy')
+                flash('Too many people are logging in right now. Please try again in a moment.', category='warning')
+                return render_template('auth/login.html', form=form), 503
+            if password_ok:
+                count('parking_logins_total', 'success')
                 login_user(attempted_user)
                 if attempted_user.is_admin:
                     flash(f'Welcome! You are now logged in as {form.username.data}', category='success')
-                    return redirect(url_for('admin_home'))
+                    return redirect(url_for('main.admin_home'))
                 else:
                     flash(f'Welcome! You are now logged in as {form.username.data}', category='success')
-                    return redirect(url_for('user_home'))
+                    return redirect(url_for('main.user_home'))
             else:
+                count('parking_logins_total', 'bad_password')
                 flash(f'Username and password do not match. Please recheck.', category='danger')
         else:
+            count('parking_logins_total', 'unknown_user')
             flash(f'Sorry! Username does not exist. Please recheck.', category='danger')
     return render_template('auth/login.html', form=form)
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register_page():
     form = RegistrationForm()
     if form.validate_on_submit():
         phone_num = form.contact_number.data
         if User.query.filter_by(contact_number = phone_num).first():
             flash(f'Phone number already registered!','danger')
-            return redirect(url_for('register_page'))
+            return redirect(url_for('main.register_page'))
         new_user = User(first_name = form.first_name.data, last_name = form.last_name.data, email_address = form.email_address.data, username = form.username.data,  contact_number = form.contact_number.data, address = form.address.data, pincode = form.pincode.data)
-        new_user.password = form.pass_1.data
+        try:
+            new_user.password = form.pass_1.data
+        except PasswordPoolBusy:
+            flash('Too many people are signing up right now. Please try again in a moment.', category='warning')
+            return render_template('auth/register.html', form=form), 503
         db.session.add(new_user)
         db.session.commit()
         login_user(new_user)
         flash(f'Account Creation Successful! You are now logged in as : {new_user.username}', category='success')
-        return redirect(url_for('user_home'))
+        return redirect(url_for('main.user_home'))
     if form.errors != {} :
         for field_errors in form.errors.values():
             for error_message in field_errors:
@@ -62,10 +93,10 @@ def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
-            return redirect(url_for('login_page'))
+            return redirect(url_for('main.login_page'))
         if not current_user.is_admin:
             flash(f'You do not have permission to access this page!',category='danger')
-            return redirect(url_for('user_home'))
+            return redirect(url_for('main.user_home'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -73,35 +104,63 @@ def user_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
-            return redirect(url_for('login_page'))
+            return redirect(url_for('main.login_page'))
         if current_user.is_admin:
             flash(f'You do not have permission to access this page!',category='danger')
-            return redirect(url_for('admin_home'))
+            return redirect(url_for('main.admin_home'))
         return f(*args, **kwargs)
     return decorated_function
 
 
 # Admin routes
 
-
-@app.route('/admin/home', methods=["GET", "POST"])
+CSRF_PLACEHOLDER = '__csrf_token__'
+
+def parse_day(value):
+    # a date, not a datetime: lot_daily_rollup.day is a Date column and SQLite compares them as text
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def publish_event(event):
+    current_app.extensions['event_broker'].publish(event)
+
+def render_lot_cards(lots):
+    # each lot card is cached against the lot's version stamp and only re-rendered after
+    # book/release/edit changes it; the session's CSRF token is swapped in on the way out.
+    # Lot ids are never reused, so a (lot_id, version) hit is always the same lot in the same
+    # state, whichever worker cached it; invalidate() in delete_lot only frees this process's copy
+    fragment_cache = current_app.extensions['fragment_cache']
+    cards = {lot.lot_id: fragment_cache.get(lot.lot_id, lot.version) for lot in lots}
+    missing = [lot for lot in lots if cards[lot.lot_id] is None]
+    csrf_token = generate_csrf()
+
+    if missing:
+        lot_ids = [lot.lot_id for lot in missing]
+        spots = defaultdict(list)
+        for spot in ParkingSpot.query.join(ParkingLot).filter(ParkingSpot.lot_id.in_(lot_ids), ParkingSpot.spot_index < ParkingLot.max_spots):
+            spots[spot.lot_id].append(spot)
+        active_reservations = Reservation.active_by_spot(lot_ids)
+        bills = bill_reservations(list(active_reservations.values()))
+        delete_form = DeleteParkingLotForm(formdata=None)
+        for lot in missing:
+            html = render_template('components/lot_card.html', lot=lot, spots=spots[lot.lot_id], active_reservations=active_reservations, bills=bills,
+                                   edit_form={lot.lot_id: CreateParkingLotForm(formdata=None, obj=lot)}, delete_form=delete_form)
+            html = html.replace(csrf_token, CSRF_PLACEHOLDER)
+            fragment_cache.set(lot.lot_id, lot.version, html)
+            cards[lot.lot_id] = html
+
+    return {lot_id: Markup(html.replace(CSRF_PLACEHOLDER, csrf_token)) for lot_id, html in cards.items()}
+
+
+
+@main.route('/admin/home', methods=["GET", "POST"])
 @login_required
 @admin_required
+@query_budget(6)
 def admin_home():
-    lots = ParkingLot.query.options(joinedload(ParkingLot.parking_spots)).all()
-
-    for lot in lots:
-        lot.parking_spots = [spot for spot in lot.parking_spots if spot.spot_index < lot.max_spots]
-        lot.occupied = sum(1 for spot in lot.parking_spots if spot.status == 'O')
-
-    reservations = Reservation.query.all()
-
     form = CreateParkingLotForm()
-    delete_form = DeleteParkingLotForm()
-    edit_form = {lot.lot_id: CreateParkingLotForm(obj=lot) for lot in lots}
 
     if request.method == "POST" and form.validate_on_submit():
-        new_lot = ParkingLot(primary_location=form.primary_location.data,full_address=form.full_address.data,pincode=form.pincode.data,cost_per_unit=float(form.cost_per_unit.data),max_spots=form.max_spots.data)
+        new_lot = ParkingLot(primary_location=form.primary_location.data,full_address=form.full_address.data,pincode=form.pincode.data,cost_per_unit=float(form.cost_per_unit.data),max_spots=form.max_spots.data,available_count=form.max_spots.data,occupied_count=0)
         db.session.add(new_lot)
         db.session.flush()
 
@@ -110,49 +169,50 @@ def admin_home():
         if existing_spots > 0:
             db.session.rollback()
             flash("Something went wrong: This new lot already had spots. Cancelling operation.", "danger")
-            return redirect(url_for('admin_home'))
+            return redirect(url_for('main.admin_home'))
 
-        for i in range(new_lot.max_spots):
-            db.session.add(ParkingSpot(status='A', lot_id=new_lot.lot_id, spot_index=i))
+        ParkingSpot.provision(new_lot.lot_id, range(new_lot.max_spots))
 
         db.session.commit()
         flash('Parking Lot Creation Successful!', category='success')
-        return redirect(url_for('admin_home'))
+        return redirect(url_for('main.admin_home'))
 
     if form.errors:
         for field_errors in form.errors.values():
             for error_message in field_errors:
                 flash(f'There was an error creating the lot: {error_message}', category='danger')
 
-    return render_template('admin_dashboard/admin_home.html',user=current_user,form=form,lots=lots,delete_form=delete_form,edit_form=edit_form,reservations=reservations)
+    lots = ParkingLot.query.all()
+    return render_template('admin_dashboard/admin_home.html',user=current_user,form=form,lots=lots,lot_cards=render_lot_cards(lots))
 
 
-@app.route('/admin/delete_lot/<int:lot_id>', methods=["POST"])
+@main.route('/admin/delete_lot/<int:lot_id>', methods=["POST"])
 @login_required
 @admin_required
+@query_budget(7)
 def delete_lot(lot_id):
     lot_to_delete = ParkingLot.query.get_or_404(lot_id)
 
-    for spot in lot_to_delete.parking_spots:
-        if spot.status == 'O':
-            flash("Cannot delete the lot. One or more spots are currently occupied.", "danger")
-            return redirect(url_for('admin_home'))
+    if lot_to_delete.has_occupied_spots():
+        flash("Cannot delete the lot. One or more spots are currently occupied.", "danger")
+        return redirect(url_for('main.admin_home'))
 
-    for spot in lot_to_delete.parking_spots:
-        for res in spot.reservations:
-            res.archived_primary_location = lot_to_delete.primary_location
-            res.archived_spot_id = spot.spot_id
-            res.archived_lot_id = lot_to_delete.lot_id
+    if lot_to_delete.has_upcoming_bookings(datetime.now()):
+        flash("Cannot delete the lot. It has upcoming advance bookings.", "danger")
+        return redirect(url_for('main.admin_home'))
 
-    db.session.commit()
+    lot_to_delete.archive_history()
     db.session.delete(lot_to_delete)
     db.session.commit()
+    current_app.extensions['fragment_cache'].invalidate(lot_id)
+    current_app.extensions['availability'].invalidate(lot_id)
+    publish_event({'type': 'lot', 'action': 'deleted', 'lot_id': lot_id})
 
     flash("Parking lot deleted successfully.", "success")
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
 
-@app.route('/admin/edit_lot/<int:lot_id>', methods=["POST"])
+@main.route('/admin/edit_lot/<int:lot_id>', methods=["POST"])
 @login_required
 @admin_required
 def edit_lot(lot_id):
@@ -165,17 +225,23 @@ def edit_lot(lot_id):
 
         if new_max_spots is None or new_cost is None:
             flash("Please fill in all required fields.", "danger")
-            return redirect(url_for('admin_home'))
+            return redirect(url_for('main.admin_home'))
 
         occupied_spots = ParkingSpot.query.filter_by(lot_id=lot.lot_id, status='O').count() or 0
 
         if new_max_spots < occupied_spots:
             flash(f"Cannot reduce max spots to {new_max_spots} as {occupied_spots} spot(s) are occupied.", "danger")
-            return redirect(url_for('admin_home'))
+            return redirect(url_for('main.admin_home'))
+
+        if new_max_spots < lot.max_spots:
+            held_spots = lot.held_spot_count(datetime.now())
+            if new_max_spots < held_spots:
+                flash(f"Cannot reduce max spots to {new_max_spots} as {held_spots} spot(s) are occupied or booked ahead.", "danger")
+                return redirect(url_for('main.admin_home'))
 
         if occupied_spots > 0 and float(new_cost) != float(lot.cost_per_unit):
             flash("Cannot change the cost while spots are occupied.", "warning")
-            return redirect(url_for('admin_home'))
+            return redirect(url_for('main.admin_home'))
 
         old_max_spots = lot.max_spots
         lot.max_spots = new_max_spots
@@ -185,29 +251,17 @@ def edit_lot(lot_id):
         lot.pincode = form.pincode.data
 
         if new_max_spots > old_max_spots:
-            existing_indexes = {s.spot_index for s in lot.parking_spots}
-            for index in range(old_max_spots, new_max_spots):
-                if index not in existing_indexes:
-                    new_spot = ParkingSpot(status='A', lot_id=lot.lot_id, spot_index=index)
-                    db.session.add(new_spot)
+            existing_indexes = set(db.session.scalars(db.select(ParkingSpot.spot_index).filter_by(lot_id=lot.lot_id)))
+            ParkingSpot.provision(lot.lot_id, [index for index in range(old_max_spots, new_max_spots) if index not in existing_indexes])
 
         elif new_max_spots < old_max_spots:
-            deletable_spots = ParkingSpot.query.filter_by(lot_id=lot.lot_id, status='A')\
-                .order_by(ParkingSpot.spot_index.desc()).all()
-
-            to_delete = deletable_spots[:old_max_spots - new_max_spots]
-
-            for spot in to_delete:
-                if spot.status != 'A':  
-                    flash(f"Cannot delete Spot {spot.spot_index} as it is occupied.", "danger")
-                    return redirect(url_for('admin_home'))
-                for res in spot.reservations:
-                    res.archived_spot_id = spot.spot_id
-                    res.archived_lot_id = lot.lot_id
-                    res.archived_primary_location = lot.primary_location
-                db.session.delete(spot)
+            ParkingSpot.retire_free(lot, old_max_spots - new_max_spots)
 
+        db.session.flush()
+        ParkingLot.reconcile_counts([lot.lot_id])
         db.session.commit()
+        publish_event({'type': 'lot', 'action': 'updated', 'lot_id': lot.lot_id, 'max_spots': lot.max_spots,
+                       'available': lot.available_count, 'occupied': lot.occupied_count})
         flash("Parking Lot Updated Successfully!", "success")
 
     else:
@@ -215,24 +269,74 @@ def edit_lot(lot_id):
             for error in errors:
                 flash(f"Error in {field}: {error}", "danger")
 
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/users')
+@main.route('/admin/events')
 @login_required
 @admin_required
+def admin_events():
+    # server-sent events stream of spot/lot changes for the admin dashboard
+    broker = current_app.extensions['event_broker']
+    keepalive = current_app.config['SSE_KEEPALIVE']
+    subscription = broker.subscribe()
+
+    def stream():
+        try:
+            # flushes the headers straight away and tells the browser how soon to reconnect
+            yield "retry: 5000\n\n"
+            while True:
+                event = subscription.get(timeout=keepalive)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@main.route('/admin/export/<kind>.<fmt>')
+@login_required
+@admin_required
+def admin_export(kind, fmt):
+    by = request.args.get('by', 'checkin')
+    if kind not in ('reservations', 'revenue') or fmt not in FORMATS or by not in DATE_COLUMNS:
+        abort(404)
+    start, end = request.args.get('start', type=parse_day), request.args.get('end', type=parse_day)
+    if kind == 'reservations':
+        chunks = reservation_chunks(start=start, end=end, lot_id=request.args.get('lot_id', type=int), chunk_size=current_app.config['EXPORT_CHUNK_SIZE'], by=by)
+        fields = RESERVATION_FIELDS
+    else:
+        chunks, fields = revenue_chunks(start, end), REVENUE_FIELDS
+    writer, mimetype = FORMATS[fmt]
+    # the generator keeps the request context (and its db session) alive while the body streams out
+    return Response(stream_with_context(writer(chunks, fields)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={kind}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}'})
+
+@main.route('/admin/users')
+@login_required
+@admin_required
+@query_budget(3)
 def display_users():
-    users = User.query.filter_by(is_admin= False).all()
-    return render_template('admin_dashboard/display_users.html', user = current_user, users = users)
+    after = request.args.get('after', type=int)
+    users, has_more = keyset_page(User.query.filter_by(is_admin= False), (User.id,), after=(after,) if after else None, page_size=current_app.config['PAGE_SIZE'])
+    next_after = users[-1].id if has_more else None
+    return render_template('admin_dashboard/display_users.html', user = current_user, users = users, next_after = next_after)
 
-@app.route('/admin/user_history/<int:user_id>')
+@main.route('/admin/user_history/<int:user_id>')
 @login_required
 @admin_required
+@query_budget(4)
 def user_parking_history(user_id):
     user = User.query.get_or_404(user_id)
-    reservations = Reservation.query.filter_by(user_id = user_id).order_by(Reservation.checkin_time.desc()).all()
-    return render_template('admin_dashboard/user_parking_history.html', user = user, reservations = reservations)
-
-@app.route('/admin/edit_profile', methods=["GET", "POST"])
+    query = Reservation.query.filter_by(user_id = user_id).options(joinedload(Reservation.spot).joinedload(ParkingSpot.lot))
+    after = request.args.get('after', type=int)
+    anchor = db.session.query(Reservation.checkin_time, Reservation.r_id).filter_by(r_id = after, user_id = user_id).first() if after else None
+    reservations, has_more = keyset_page(query, (Reservation.checkin_time, Reservation.r_id), after=tuple(anchor) if anchor else None, page_size=current_app.config['PAGE_SIZE'], descending=True)
+    next_after = reservations[-1].r_id if has_more else None
+    return render_template('admin_dashboard/user_parking_history.html', user = user, reservations = reservations, bills = bill_reservations(reservations), next_after = next_after)
+
+@main.route('/admin/edit_profile', methods=["GET", "POST"])
 @admin_required
 @login_required
 def edit_admin_profile():
@@ -246,8 +350,9 @@ def edit_admin_profile():
         current_user.address = form.address.data
         current_user.pincode = form.pincode.data
         db.session.commit()
+        current_app.extensions['user_cache'].invalidate(current_user.id)
         flash(f"Profile updated Successfully!", "success")
-        return redirect(url_for('admin_home'))
+        return redirect(url_for('main.admin_home'))
     
     elif request.method == "GET":
         form.first_name.data = current_user.first_name
@@ -260,16 +365,15 @@ def edit_admin_profile():
 
     return render_template('admin_dashboard/admin_edit.html', form = form)
 
-@app.route('/admin/search', methods= ["GET", "POST"])
+@main.route('/admin/search', methods= ["GET", "POST"])
 @login_required
 @admin_required
+@query_budget(6)
 def admin_search():
     form = AdminSearchForm()
-    edit_form = {}
-    delete_form = {}
     user_record = None
     lots = None
-    reservations = []
+    lot_cards = {}
     search_choice = None
     search_string = None
     if form.validate_on_submit():
@@ -285,47 +389,24 @@ def admin_search():
                 flash('User does not exist.', 'danger')
         elif search_choice == 'loc':
             lots = ParkingLot.query.filter_by(primary_location = search_string).all()
-            for lot in lots:
-                lot.occupied = sum(1 for spot in lot.parking_spots if spot.status == 'O')
             if not lots:
                 flash('Location not found. Try checking the spelling', 'danger')
-            reservations = Reservation.query.all()
-            delete_form = DeleteParkingLotForm()
-            edit_form = {}
-            for lot in lots:
-                edit_form[lot.lot_id] = CreateParkingLotForm(obj=lot)
+            lot_cards = render_lot_cards(lots)
     else:
         for field, errors in form.errors.items():
             for error in errors:
                 flash(f"{error}", "danger")
-    return render_template('admin_dashboard/admin_search.html', form = form, search_choice = search_choice, user_record = user_record, lots = lots, search_string = search_string, reservations = reservations, edit_form = edit_form, delete_form = delete_form)
+    return render_template('admin_dashboard/admin_search.html', form = form, search_choice = search_choice, user_record = user_record, lots = lots, search_string = search_string, lot_cards = lot_cards)
 
-@app.route('/admin/summary')
+@main.route('/admin/summary')
 @login_required
 @admin_required
+@query_budget(4)
 def admin_summary():
+    start, end = request.args.get('start', type=parse_day), request.args.get('end', type=parse_day)
 
     # Revenue Generated Bar Graph Data
-    reservations = Reservation.query.all()
-    revenue_data = {}
-
-    for res in reservations:
-        if res.final_cost is None:
-            continue
-        if res.spot and res.spot.lot:
-            lot_id = res.spot.lot.lot_id
-            label = f"{res.spot.lot.primary_location} (ID: {lot_id})"
-        else:
-            lot_id = res.archived_lot_id or -1
-            label = f"{res.archived_primary_location or 'Deleted Lot'} (ID: {res.archived_lot_id}) (Deleted)"
-
-        if lot_id not in revenue_data:
-            revenue_data[lot_id] = {
-                "label": label,
-                "value": 0
-            }
-
-        revenue_data[lot_id]["value"] += res.final_cost or 0
+    revenue_data = revenue_by_lot(start, end)
 
     chart_data = {
         "labels": [v["label"] for v in revenue_data.values()],
@@ -333,16 +414,7 @@ def admin_summary():
     }
 
     # Occupied/Available Spot distribution Bar Graph Data
-    reservation_dist = {}
-    lots = ParkingLot.query.all()
-    for lot in lots:
-        occupied_count = 0
-        total = lot.max_spots
-        for spot in lot.parking_spots:
-            if spot.status == 'O':
-                occupied_count += 1
-        reservation_dist[lot.lot_id] = {'label': f"{lot.primary_location} (ID:{lot.lot_id})", 'available': total - occupied_count,
-            'occupied': occupied_count}
+    reservation_dist = occupancy_by_lot()
 
     second_chart = {
         "labels": [v['label'] for v in reservation_dist.values()],
@@ -350,19 +422,27 @@ def admin_summary():
         "occupied": [v['occupied'] for v in reservation_dist.values()]
     }
 
-    return render_template('admin_dashboard/admin_summary.html',chart_data=chart_data, second_chart=second_chart)
+    return render_template('admin_dashboard/admin_summary.html',chart_data=chart_data, second_chart=second_chart, revenue_data=revenue_data, start=start, end=end)
 
 
 
 # User routes
 
-@app.route('/user/home', methods=["GET", "POST"])
+@main.route('/user/home', methods=["GET", "POST"])
 @login_required
 @user_required
+@query_budget(7)
 def user_home():
     form = SearchParkingLot()
     release_form = ReleaseSpotForm()
-    reservations = Reservation.query.filter_by(user_id=current_user.id).order_by(desc(Reservation.r_id)).all()
+    advance_form = AdvanceBookingForm()
+    query = Reservation.query.filter_by(user_id=current_user.id).options(joinedload(Reservation.spot).joinedload(ParkingSpot.lot))
+    after = request.args.get('after', type=int)
+    # same (checkin_time, r_id) seek as the admin history: it walks ix_reservation_user_checkin, where
+    # ordering on r_id alone would sort the user's whole history for every page
+    anchor = db.session.query(Reservation.checkin_time, Reservation.r_id).filter_by(r_id=after, user_id=current_user.id).first() if after else None
+    reservations, has_more = keyset_page(query, (Reservation.checkin_time, Reservation.r_id), after=tuple(anchor) if anchor else None, page_size=current_app.config['PAGE_SIZE'], descending=True)
+    next_after = reservations[-1].r_id if has_more else None
     areas = db.session.query(ParkingLot.primary_location).distinct().all()
     form.location.choices = [(area[0], area[0]) for area in areas]
 
@@ -373,16 +453,19 @@ def user_home():
         selected_area = form.location.data
         available_lots = ParkingLot.query.filter_by(primary_location=selected_area).all()
 
+        first_free = ParkingSpot.first_free_by_lot([lot.lot_id for lot in available_lots])
+
         for lot in available_lots:
-            available_spots = [s for s in lot.parking_spots if s.status == 'A']
-            spot = sorted(available_spots, key=lambda s: s.spot_id)[0] if available_spots else None
-            lot_info.append({'lot_id': lot.lot_id, 'full_address': lot.full_address, 'cost_per_unit': lot.cost_per_unit, 'available_count': len(available_spots), 'spot_id': spot.spot_id if spot else None})
-    return render_template('user_dashboard/user_home.html', user=current_user, form=form, lots=lot_info, reservations = reservations, now=datetime.now(), datetime=datetime, release_form = release_form)
+            lot_info.append({'lot_id': lot.lot_id, 'full_address': lot.full_address, 'cost_per_unit': lot.cost_per_unit, 'available_count': lot.available_count, 'spot_id': first_free.get(lot.lot_id)})
+    now = datetime.now()
+    bookings = AdvanceBooking.upcoming_for(current_user.id, now)
+    return render_template('user_dashboard/user_home.html', user=current_user, form=form, lots=lot_info, reservations = reservations, bills = bill_reservations(reservations, now), now=now, datetime=datetime, release_form = release_form, advance_form = advance_form, bookings = bookings, next_after = next_after)
 
 
-@app.route('/user/book_spot', methods=["POST"])
+@main.route('/user/book_spot', methods=["POST"])
 @login_required
 @user_required
+@query_budget(10)
 def book_spot():
     form = BookingForm()
     if form.validate_on_submit():
@@ -395,55 +478,149 @@ def book_spot():
 
         existing_vehicle = Reservation.query.filter_by(nameplate_num=vehicle_number, actual_checkout_time=None).first()
         if existing_vehicle:
+            count('parking_bookings_total', 'already_parked')
             flash("This vehicle is already actively parked!", "danger")
-            return redirect(url_for("user_home"))
+            return redirect(url_for("main.user_home"))
 
-        spot = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').order_by(ParkingSpot.spot_index).first()
+        # spots booked ahead for a window starting before this stay ends are skipped
+        checkin_time = datetime.now()
+        checkout_time = checkin_time + timedelta(hours=num_hrs)
+        started = time.perf_counter()
+        spot = ParkingSpot.claim_available(lot_id, until=checkout_time, now=checkin_time)
+        observe('parking_spot_claim_seconds', time.perf_counter() - started)
         if not spot:
+            count('parking_bookings_total', 'lot_full')
+            db.session.rollback()
             flash('All the spots in this lot are full!', 'danger')
-            return redirect(url_for("user_home"))
+            return redirect(url_for("main.user_home"))
 
         existing_res = Reservation.query.filter_by(spot_id=spot.spot_id).order_by(Reservation.checkin_time.desc()).first()
         if existing_res and existing_res.actual_checkout_time is None:
+            count('parking_bookings_total', 'spot_conflict')
+            db.session.rollback()
             flash("This parking spot already has an active reservation.", "danger")
-            return redirect(url_for("user_home"))
+            return redirect(url_for("main.user_home"))
 
-
-        checkin_time = datetime.now()
-        checkout_time = checkin_time + timedelta(hours=num_hrs)
         estimated_cost = cost_per_hour * num_hrs
 
         reservation = Reservation(spot_id=spot.spot_id, user_id=user_id, checkin_time=checkin_time, checkout_time=checkout_time, vehicle_model=vehicle_model, nameplate_num=vehicle_number, cost_per_unit=cost_per_hour, estimated_cost=estimated_cost)
 
-        spot.status = 'O'
         db.session.add(reservation)
         db.session.commit()
+        count('parking_bookings_total', 'booked')
+        publish_event({'type': 'spot', 'lot_id': spot.lot_id, 'spot_id': spot.spot_id, 'status': 'O'})
 
         flash(f'Spot reservation successful! Spot ID: {spot.spot_id}, Estimated Cost: ₹{estimated_cost}', 'success')
-        return redirect(url_for('user_home'))
+        return redirect(url_for('main.user_home'))
 
+    count('parking_bookings_total', 'invalid')
     flash('Something went wrong! Reservation unsuccessful!', 'danger')
-    return redirect(url_for('user_home'))
+    return redirect(url_for('main.user_home'))
 
 
-@app.route('/user/release_spot/<int:r_id>', methods = ["POST"])
+@main.route('/user/release_spot/<int:r_id>', methods = ["POST"])
 @login_required
 @user_required
+@query_budget(12)
 def release_spot(r_id):
     reservation = Reservation.query.get_or_404(r_id)
-    if reservation.actual_checkout_time or reservation.spot.status == "A":
+    if reservation.is_released:
+        count('parking_releases_total', 'already_released')
         flash("Spot already released!", "danger")
-        return redirect(url_for('user_home'))
-    reservation.actual_checkout_time = datetime.now()
-    reservation.final_cost = reservation.calculate_cost_at(reservation.actual_checkout_time)
-    reservation.spot.status = "A"
+        return redirect(url_for('main.user_home'))
+    reservation.check_out(datetime.now())
+    ParkingLot.adjust_counts(reservation.spot.lot_id, -1)
+    LotDailyRollup.add_checkouts([reservation])
+    db.session.commit()
+    count('parking_releases_total', 'released')
+    publish_event({'type': 'spot', 'lot_id': reservation.spot.lot_id, 'spot_id': reservation.spot_id, 'status': 'A'})
+
+    flash(f"Spot Released Successfully! Total Cost : {reservation.final_cost}", "success")
+
+    return redirect(url_for('main.user_home'))
+
+@main.route('/user/book_ahead', methods=["POST"])
+@login_required
+@user_required
+@query_budget(15)
+def book_ahead():
+    form = AdvanceBookingForm()
+    if not form.validate_on_submit():
+        count('parking_advance_bookings_total', 'invalid')
+        flash('Something went wrong! Advance booking unsuccessful!', 'danger')
+        return redirect(url_for('main.user_home'))
+
+    now = datetime.now()
+    start_time = form.start_time.data
+    end_time = start_time + timedelta(hours=form.no_of_hours.data)
+    days = current_app.config['ADVANCE_BOOKING_DAYS']
+    # the form has minute precision, so "now" means the current minute
+    if not now.replace(second=0, microsecond=0) <= start_time <= now + timedelta(days=days):
+        count('parking_advance_bookings_total', 'invalid')
+        flash(f"Advance bookings must start between now and {days} days from now.", "danger")
+        return redirect(url_for('main.user_home'))
+
+    lot = ParkingLot.query.get_or_404(form.lot_id.data)
+    if AdvanceBooking.nameplate_booked(form.vehicle_number.data, start_time, end_time):
+        count('parking_advance_bookings_total', 'already_booked')
+        flash("This vehicle already has a booking during that time.", "danger")
+        return redirect(url_for('main.user_home'))
+
+    booking = allocate_window(lot, current_user.id, start_time, end_time, form.vehicle_model.data, form.vehicle_number.data)
+    if booking is None:
+        count('parking_advance_bookings_total', 'lot_full')
+        db.session.rollback()
+        flash('No spot in this lot is free for that whole time.', 'danger')
+        return redirect(url_for('main.user_home'))
+    db.session.commit()
+    count('parking_advance_bookings_total', 'booked')
+
+    flash(f"Spot reserved! Spot ID: {booking.spot_id}, {start_time:%Y-%m-%d %H:%M} to {end_time:%Y-%m-%d %H:%M}, Estimated Cost: ₹{booking.estimated_cost}", 'success')
+    return redirect(url_for('main.user_home'))
+
+
+@main.route('/user/advance_booking/<int:booking_id>/check_in', methods=["POST"])
+@login_required
+@user_required
+@query_budget(12)
+def check_in_booking(booking_id):
+    booking = AdvanceBooking.query.filter_by(booking_id=booking_id, user_id=current_user.id).first_or_404()
+    now = datetime.now()
+    if booking.status != 'B' or not booking.start_time <= now < booking.end_time:
+        flash("This booking can only be checked in during its booked time.", "danger")
+        return redirect(url_for('main.user_home'))
+    if Reservation.active_nameplates([booking.nameplate_num]):
+        flash("This vehicle is already actively parked!", "danger")
+        return redirect(url_for('main.user_home'))
+
+    reservation = booking.check_in(now)
+    if reservation is None:
+        db.session.rollback()
+        flash('All the spots in this lot are full!', 'danger')
+        return redirect(url_for('main.user_home'))
     db.session.commit()
+    publish_event({'type': 'spot', 'lot_id': booking.lot_id, 'spot_id': reservation.spot_id, 'status': 'O'})
+
+    flash(f'Checked in! Spot ID: {reservation.spot_id}', 'success')
+    return redirect(url_for('main.user_home'))
 
-    flash(f"Spot Released Successfully! Total Cost : {reservation.total_cost}", "success")
 
-    return redirect(url_for('user_home'))
+@main.route('/user/advance_booking/<int:booking_id>/cancel', methods=["POST"])
+@login_required
+@user_required
+@query_budget(4)
+def cancel_booking(booking_id):
+    booking = AdvanceBooking.query.filter_by(booking_id=booking_id, user_id=current_user.id).first_or_404()
+    if booking.status != 'B':
+        flash("This booking can no longer be cancelled.", "danger")
+        return redirect(url_for('main.user_home'))
+    booking.status = 'C'
+    ParkingLot.touch(booking.lot_id)
+    db.session.commit()
+    flash("Booking cancelled.", "info")
+    return redirect(url_for('main.user_home'))
 
-@app.route('/user/edit_profile', methods=["GET", "POST"])
+@main.route('/user/edit_profile', methods=["GET", "POST"])
 @user_required
 @login_required
 def edit_user_profile():
@@ -457,8 +634,9 @@ def edit_user_profile():
         current_user.address = form.address.data
         current_user.pincode = form.pincode.data
         db.session.commit()
+        current_app.extensions['user_cache'].invalidate(current_user.id)
         flash(f"Profile updated Successfully!", "success")
-        return redirect(url_for('user_home'))
+        return redirect(url_for('main.user_home'))
     
     elif request.method == "GET":
         form.first_name.data = current_user.first_name
@@ -470,69 +648,53 @@ def edit_user_profile():
     
     return render_template('user_dashboard/user_edit.html', form = form)
 
-@app.route('/user/summary')
+@main.route('/user/summary')
 @login_required
 @user_required
+@query_budget(5)
 def user_summary():
-    reservations = Reservation.query.all()
-    res_freq = {}
+    lot_stats = user_stats_by_lot(current_user.id)
 
-    for res in reservations:
-        if res.user_id != current_user.id:
-            continue
-        if res.spot and res.spot.lot:
-            lot_id = res.spot.lot.lot_id  
-            label = f"{res.spot.lot.primary_location} (ID: {lot_id})"
-        else:
-            lot_id = res.archived_lot_id if res.archived_lot_id is not None else -1
-            label = f"{res.archived_primary_location or "Deleted lot"}" + " (Deleted) " + "(ID: {lot_id})"
-        if lot_id in res_freq:
-                res_freq[lot_id]['frequency'] += 1
+    res_freq = {}
+    avg_dur = {}
+    for lot_id, stats in lot_stats.items():
+        if stats['deleted']:
+            res_freq[lot_id] = f"{stats['location'] or 'Deleted lot'} (Deleted) (ID: {lot_id})"
+            avg_dur[lot_id] = (stats['location'] or "Deleted Lot") + " (Deleted)"
         else:
-            res_freq[lot_id] = {
-                'label': label,
-                'frequency': 1
-            }
+            res_freq[lot_id] = avg_dur[lot_id] = f"{stats['location']} (ID: {lot_id})"
 
     user_res = {
-        "lots" : [v['label'] for v in res_freq.values()],
-        "visits" : [v['frequency'] for v in res_freq.values()]
+        "lots" : list(res_freq.values()),
+        "visits" : [stats['visits'] for stats in lot_stats.values()]
     }
 
-    duration_data = defaultdict(list)
-    for res in reservations:
-        if res.user_id != current_user.id:
-            continue
-        if res.spot and res.spot.lot:
-            lot_id = res.spot.lot.lot_id
-            lot_label = f"{res.spot.lot.primary_location} (ID: {lot_id})"
-        else:
-            lot_id = res.archived_lot_id if res.archived_lot_id is not None else -1
-            lot_label = (res.archived_primary_location or "Deleted Lot") + " (Deleted)"
-        start = res.checkin_time
-        end = res.actual_checkout_time or datetime.now()
-        duration = (end - start).total_seconds()/60
-        
-        duration_data[lot_id].append((lot_label, duration))
-
     avg_dur_data = {
-        'labels' : [],
-        'values' : []
+        'labels' : list(avg_dur.values()),
+        'values' : [round(stats['minutes'] / stats['visits'], 2) for stats in lot_stats.values()]
     }
 
-    for id, values in duration_data.items():
-        labels, durations = zip(*values)
-        avg = sum(durations) / len(durations)
-        avg_dur_data['labels'].append(labels[0])
-        avg_dur_data['values'].append(round(avg, 2))
-
     return render_template('user_dashboard/user_summary.html', user_res = user_res, avg_dur_data = avg_dur_data)
 
 # Logout Route
-@app.route('/logout')
+@main.route('/logout')
 def logout_page():
     logout_user()
     flash(f'You have been logged out.', category='info')
     return render_template('welcome.html')
 
 
+
+@main.route('/metrics')
+@query_budget(2)
+def metrics():
+    # Prometheus text exposition; open unless METRICS_TOKEN is set (production requires it), in which case scrapers send it as a bearer token
+    registry = current_app.extensions.get('metrics')
+    if registry is None:
+        abort(404)
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not compare_digest(supplied.encode(), token.encode()):
+            abort(401)
+    return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from threading import Condition, Lock
+
+
+class Subscription:
+    # bounded per-subscriber queue; a newer event for the same spot/lot replaces the pending one,
+    # and when the queue is full the oldest event is dropped and the subscriber is told to resync
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._pending = OrderedDict()
+        self._overflowed = False
+        self._condition = Condition()
+
+    def put(self, key, event):
+        with self._condition:
+            if key not in self._pending and len(self._pending) >= self.maxsize:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+                self._overflowed = True
+            self._pending[key] = event
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        with self._condition:
+            if not self._pending and not self._overflowed:
+                self._condition.wait(timeout)
+            if self._overflowed:
+                self._overflowed = False
+                return {'type': 'resync', 'dropped': self.dropped}
+            if not self._pending:
+                return None
+            return self._pending.popitem(last=False)[1]
+
+
+class EventBroker:
+    # in-process pub/sub; publish never blocks on slow subscribers
+
+    def __init__(self, queue_size=64):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        key = (event['type'], event.get('spot_id', event.get('lot_id')))
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(key, event)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
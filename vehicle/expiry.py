@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from vehicle import db
+from vehicle.models import ParkingSpot, Reservation
+from vehicle.billing import bill_columns
+
+# Overstay expiry. Every open reservation carries overage_due_at, the next moment its overage changes:
+# the booked checkout_time first, then each further hour. The partial index on it (open reservations
+# only) is the scheduler's priority queue, so a pass reads just the due prefix and the next wake-up
+# is the index head, never a scan of the reservation table.
+
+
+def due_overstays(now, limit):
+    return db.session.execute(db.select(Reservation.r_id, Reservation.spot_id, ParkingSpot.lot_id, Reservation.checkout_time,
+                                        Reservation.cost_per_unit, Reservation.overstayed_at)
+                              .outerjoin(ParkingSpot, ParkingSpot.spot_id == Reservation.spot_id)
+                              .where(Reservation.actual_checkout_time.is_(None), Reservation.overage_due_at < now)
+                              .order_by(Reservation.overage_due_at).limit(limit)).all()
+
+
+def next_overage_due():
+    return db.session.scalar(db.select(db.func.min(Reservation.overage_due_at)).where(Reservation.actual_checkout_time.is_(None)))
+
+
+def process_overstays(now, batch_size=500):
+    # flags and re-prices one batch of due reservations; returns their events for the caller
+    # to publish once the batch is committed
+    rows = due_overstays(now, batch_size)
+    if not rows:
+        return []
+    # billed from the booked end instead of check-in: every started hour over is charged
+    bills = bill_columns([row.checkout_time for row in rows], [None] * len(rows), [row.cost_per_unit for row in rows], now)
+    updates = [{'due_r_id': row.r_id, 'flagged_at': now, 'overage': overage, 'next_due': row.checkout_time + timedelta(hours=hours)}
+               for row, hours, overage in zip(rows, bills['hours'], bills['cost'])]
+    table = Reservation.__table__
+    db.session.execute(db.update(table).where(table.c.r_id == db.bindparam('due_r_id'), table.c.actual_checkout_time.is_(None))
+                       .values(overstayed_at=db.func.coalesce(table.c.overstayed_at, db.bindparam('flagged_at', type_=db.DateTime)),
+                               overage_cost=db.bindparam('overage'), overage_due_at=db.bindparam('next_due')), updates)
+    return [{'type': 'overstay', 'lot_id': row.lot_id, 'spot_id': row.spot_id, 'r_id': row.r_id,
+             'overage': overage, 'new': row.overstayed_at is None} for row, overage in zip(rows, bills['cost'])]
+
+
+def expire_overstays(now=None, batch_size=500, publish=None):
+    # drains everything due at `now`, committing (and publishing) batch by batch
+    now = now or datetime.now()
+    processed = 0
+    while True:
+        events = process_overstays(now, batch_size)
+        db.session.commit()
+        if publish:
+            for event in events:
+                publish(event)
+        processed += len(events)
+        if len(events) < batch_size:
+            return processed
+
+
+class ExpiryScheduler:
+    # background thread: runs a pass, then sleeps until the earliest overage_due_at, waking at least
+    # every `interval` seconds to pick up reservations booked in the meantime
+
+    def __init__(self, app, interval=60, batch_size=500, clock=datetime.now):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.clock = clock
+        self._stopping = Event()
+        self._thread = None
+        self._start_lock = Lock()
+
+    def tick(self):
+        # one pass; returns how long to sleep before the next one
+        with self.app.app_context():
+            now = self.clock()
+            broker = self.app.extensions.get('event_broker')
+            processed = expire_overstays(now, self.batch_size, broker.publish if broker else None)
+            next_due = next_overage_due()
+        if processed:
+            self.app.logger.info("flagged or re-priced %d overstayed reservation(s)", processed)
+        if next_due is None:
+            return self.interval
+        return min(self.interval, max(1.0, (next_due - now).total_seconds()))
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                delay = self.tick()
+            except Exception:
+                self.app.logger.exception("overstay expiry pass failed")
+                delay = self.interval
+            self._stopping.wait(delay)
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = Thread(target=self.run, name='overstay-expiry', daemon=True)
+        self._thread.start()
+
+    def start_once(self):
+        # for the request hook: the first request starts the thread, later ones only read an attribute
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def init_expiry_scheduler(app):
+    # the thread starts with the first request the app serves, not in create_app, so `flask` commands
+    # (db upgrade included) never run it and the debug reloader's watcher process never serves one
+    scheduler = app.extensions['expiry_scheduler'] = ExpiryScheduler(app, interval=app.config['EXPIRY_INTERVAL'],
+                                                                     batch_size=app.config['EXPIRY_BATCH_SIZE'])
+    app.before_request(scheduler.start_once)
+    return scheduler
@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from vehicle import db
+from vehicle.models import ParkingLot, ParkingSpot, Reservation
+from vehicle.analytics import revenue_by_lot
+from vehicle.billing import bill_rows
+
+RESERVATION_FIELDS = ['r_id', 'user_id', 'lot_id', 'location', 'lot_deleted', 'spot_id', 'nameplate_num', 'vehicle_model',
+                      'checkin_time', 'checkout_time', 'actual_checkout_time', 'cost_per_unit', 'estimated_cost', 'final_cost',
+                      'billed_hours', 'amount']
+REVENUE_FIELDS = ['lot_id', 'label', 'revenue', 'reservations', 'occupied_hours']
+
+
+# which day a reservation is filtered on: when it started, or when it was checked out (as the revenue rollups are)
+DATE_COLUMNS = {'checkin': Reservation.checkin_time, 'checkout': Reservation.actual_checkout_time}
+
+
+def reservation_query(start=None, end=None, lot_id=None, by='checkin'):
+    # start/end are inclusive days of the `by` column, so 'checkout' leaves out open reservations;
+    # deleted spots/lots only survive in the archived_* copies
+    day_column = DATE_COLUMNS[by]
+    lot_id_column = db.func.coalesce(ParkingSpot.lot_id, Reservation.archived_lot_id)
+    stmt = db.select(Reservation.r_id, Reservation.checkin_time, Reservation.actual_checkout_time, Reservation.cost_per_unit,
+                     Reservation.user_id, lot_id_column,
+                     db.func.coalesce(ParkingLot.primary_location, Reservation.archived_primary_location),
+                     Reservation.spot_id.is_(None), db.func.coalesce(Reservation.spot_id, Reservation.archived_spot_id),
+                     Reservation.nameplate_num, Reservation.vehicle_model, Reservation.checkout_time,
+                     Reservation.estimated_cost, Reservation.final_cost)\
+        .outerjoin(ParkingSpot, ParkingSpot.spot_id == Reservation.spot_id)\
+        .outerjoin(ParkingLot, ParkingLot.lot_id == ParkingSpot.lot_id)\
+        .order_by(Reservation.r_id)
+    if start:
+        stmt = stmt.where(day_column >= start)
+    if end:
+        stmt = stmt.where(day_column < end + timedelta(days=1))
+    if lot_id is not None:
+        stmt = stmt.where(lot_id_column == lot_id)
+    return stmt
+
+
+def reservation_chunks(start=None, end=None, lot_id=None, chunk_size=1000, now=None, by='checkin'):
+    # rows are fetched `chunk_size` at a time from the open cursor and billed per chunk, so memory
+    # does not grow with the size of the export; every chunk is billed against the same `now`
+    now = now or datetime.now()
+    result = db.session.execute(reservation_query(start, end, lot_id, by).execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        bills = bill_rows(rows, now)
+        yield [{'r_id': row[0], 'user_id': row[4], 'lot_id': row[5], 'location': row[6], 'lot_deleted': row[7], 'spot_id': row[8],
+                'nameplate_num': row[9], 'vehicle_model': row[10], 'checkin_time': row[1], 'checkout_time': row[11],
+                'actual_checkout_time': row[2], 'cost_per_unit': row[3], 'estimated_cost': row[12], 'final_cost': row[13],
+                'billed_hours': hours, 'amount': amount}
+               for row, hours, amount in zip(rows, bills['hours'], bills['cost'])]
+
+
+def revenue_chunks(start=None, end=None):
+    yield [{'lot_id': lot_id, 'label': entry['label'], 'revenue': round(entry['value'], 2), 'reservations': entry['reservations'],
+            'occupied_hours': round(entry['occupied_hours'], 2)} for lot_id, entry in revenue_by_lot(start, end).items()]
+
+
+def _json_value(value):
+    return value.isoformat(sep=' ') if isinstance(value, datetime) else value
+
+
+def as_csv(chunks, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def as_ndjson(chunks, fields):
+    for chunk in chunks:
+        yield ''.join(json.dumps({field: _json_value(row[field]) for field in fields}) + '\n' for row in chunk)
+
+
+FORMATS = {'csv': (as_csv, 'text/csv'), 'ndjson': (as_ndjson, 'application/x-ndjson')}
@@ -0,0 +1,158 @@
+from vehicle import db
+from vehicle.models import User, ParkingLot, ParkingSpot, Reservation, LotDailyRollup
+from sqlalchemy.orm import joinedload
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+
+# longest stay a gate check-in can book, as in the advance booking form
+MAX_HOURS = 24
+# SQLite INTEGER is signed 64-bit; larger ids cannot even be bound as parameters
+MAX_ID = 2**63 - 1
+
+
+class GateItemError(ValueError):
+    pass
+
+
+def _text(item, field, max_length):
+    value = item.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise GateItemError(f"{field} is required")
+    value = value.strip()
+    if len(value) > max_length:
+        raise GateItemError(f"{field} must be at most {max_length} characters")
+    return value
+
+
+def _positive_int(item, field, maximum=MAX_ID):
+    value = item.get(field)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise GateItemError(f"{field} must be a positive integer")
+    if value > maximum:
+        raise GateItemError(f"{field} must be at most {maximum}")
+    return value
+
+
+def _parse_checkin(item):
+    if not isinstance(item, dict):
+        raise GateItemError("check-in must be an object")
+    user_id = item.get('user_id')
+    if user_id is not None:
+        user_id = _positive_int(item, 'user_id')
+    return {'lot_id': _positive_int(item, 'lot_id'), 'user_id': user_id, 'hours': _positive_int(item, 'hours', MAX_HOURS),
+            'vehicle_model': _text(item, 'vehicle_model', 20), 'vehicle_number': _text(item, 'vehicle_number', 15)}
+
+
+def _parse_checkout(item):
+    if not isinstance(item, dict):
+        raise GateItemError("check-out must be an object")
+    if item.get('r_id') is not None:
+        return {'r_id': _positive_int(item, 'r_id')}
+    return {'vehicle_number': _text(item, 'vehicle_number', 15)}
+
+
+def process_checkouts(items, now):
+    results = [None] * len(items)
+    parsed = {}
+    for i, item in enumerate(items):
+        try:
+            parsed[i] = _parse_checkout(item)
+        except GateItemError as e:
+            results[i] = {'ok': False, 'error': str(e)}
+
+    r_ids = [p['r_id'] for p in parsed.values() if 'r_id' in p]
+    nameplates = [p['vehicle_number'] for p in parsed.values() if 'vehicle_number' in p]
+    by_id = {res.r_id: res for res in Reservation.query.options(joinedload(Reservation.spot).joinedload(ParkingSpot.lot))
+             .filter(Reservation.r_id.in_(r_ids))} if r_ids else {}
+    by_nameplate = {res.nameplate_num: res for res in Reservation.query.options(joinedload(Reservation.spot).joinedload(ParkingSpot.lot))
+                    .filter(Reservation.actual_checkout_time.is_(None), Reservation.nameplate_num.in_(nameplates))} if nameplates else {}
+
+    deltas = defaultdict(int)
+    checked_out = []
+    for i, p in parsed.items():
+        reservation = by_id.get(p['r_id']) if 'r_id' in p else by_nameplate.get(p['vehicle_number'])
+        if reservation is None:
+            results[i] = {'ok': False, 'error': "no such reservation" if 'r_id' in p else "vehicle is not parked"}
+            continue
+        if reservation.is_released:
+            results[i] = {'ok': False, 'error': "spot already released"}
+            continue
+        reservation.check_out(now)
+        checked_out.append(reservation)
+        deltas[reservation.spot.lot_id] -= 1
+        results[i] = {'ok': True, 'r_id': reservation.r_id, 'lot_id': reservation.spot.lot_id,
+                      'spot_id': reservation.spot_id, 'final_cost': reservation.final_cost}
+    LotDailyRollup.add_checkouts(checked_out)
+    return results, deltas
+
+
+def process_checkins(items, now):
+    results = [None] * len(items)
+    parsed = {}
+    for i, item in enumerate(items):
+        try:
+            parsed[i] = _parse_checkin(item)
+        except GateItemError as e:
+            results[i] = {'ok': False, 'error': str(e)}
+
+    lots = {lot.lot_id: lot for lot in ParkingLot.query.filter(ParkingLot.lot_id.in_({p['lot_id'] for p in parsed.values()}))}
+    user_ids = {p['user_id'] for p in parsed.values() if p['user_id'] is not None}
+    known_users = set(db.session.scalars(db.select(User.id).where(User.id.in_(user_ids)))) if user_ids else set()
+    parked = Reservation.active_nameplates({p['vehicle_number'] for p in parsed.values()})
+
+    wanted = defaultdict(list)
+    for i, p in parsed.items():
+        if p['lot_id'] not in lots:
+            results[i] = {'ok': False, 'error': "no such parking lot"}
+        elif p['user_id'] is not None and p['user_id'] not in known_users:
+            results[i] = {'ok': False, 'error': "no such user"}
+        elif p['vehicle_number'] in parked:
+            results[i] = {'ok': False, 'error': "vehicle is already actively parked"}
+        else:
+            parked.add(p['vehicle_number'])
+            wanted[p['lot_id']].append(i)
+
+    deltas = defaultdict(int)
+    claimed = {}
+    for lot_id, indexes in wanted.items():
+        spot_ids = ParkingSpot.claim_many(lot_id, len(indexes), until=now + timedelta(hours=max(parsed[i]['hours'] for i in indexes)), now=now)
+        if spot_ids:
+            deltas[lot_id] += len(spot_ids)
+        claimed.update(zip(indexes, spot_ids))
+        for i in indexes[len(spot_ids):]:
+            results[i] = {'ok': False, 'error': "all the spots in this lot are full"}
+
+    # same guard as book_spot: a free spot must not still carry an open reservation
+    stale = set(db.session.scalars(db.select(Reservation.spot_id)
+                                   .where(Reservation.actual_checkout_time.is_(None), Reservation.spot_id.in_(claimed.values()))))
+    rows = {}
+    for i, spot_id in claimed.items():
+        if spot_id in stale:
+            results[i] = {'ok': False, 'error': "this parking spot already has an active reservation"}
+            continue
+        p, lot = parsed[i], lots[parsed[i]['lot_id']]
+        rows[i] = {'spot_id': spot_id, 'user_id': p['user_id'], 'checkin_time': now, 'checkout_time': now + timedelta(hours=p['hours']),
+                   'vehicle_model': p['vehicle_model'], 'nameplate_num': p['vehicle_number'], 'cost_per_unit': float(lot.cost_per_unit),
+                   'estimated_cost': float(lot.cost_per_unit * p['hours'])}
+    if rows:
+        # one multi-row INSERT ... RETURNING; the plates are unique within the batch, so they map the new ids back
+        r_ids = {nameplate: r_id for r_id, nameplate in db.session.execute(
+            db.insert(Reservation).returning(Reservation.r_id, Reservation.nameplate_num), list(rows.values()))}
+        for i, row in rows.items():
+            results[i] = {'ok': True, 'r_id': r_ids[row['nameplate_num']], 'lot_id': parsed[i]['lot_id'],
+                          'spot_id': row['spot_id'], 'estimated_cost': row['estimated_cost']}
+    return results, deltas
+
+
+def process_gate_batch(checkins, checkouts, now=None):
+    # check-outs run first so their spots can be handed to check-ins of the same batch;
+    # everything is flushed into the caller's transaction, which commits once
+    now = now or datetime.now()
+    checkout_results, checkout_deltas = process_checkouts(checkouts, now)
+    db.session.flush()
+    checkin_results, checkin_deltas = process_checkins(checkins, now)
+    # one counter/version UPDATE per touched lot, even when its check-ins and check-outs cancel out
+    for lot_id in sorted(set(checkout_deltas) | set(checkin_deltas)):
+        ParkingLot.adjust_counts(lot_id, checkin_deltas.get(lot_id, 0) + checkout_deltas.get(lot_id, 0))
+    return checkin_results, checkout_results
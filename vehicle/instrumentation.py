@@ -0,0 +1,77 @@
+import re
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(limit):
+    # declares how many statements a view may run; checked when SQL_INSTRUMENTATION is on
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+def fingerprint(statement):
+    # statements differing only in bound values or IN-list length share a fingerprint
+    return _SPACE.sub(' ', _IN_LIST.sub('(?)', statement)).strip()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['sql_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_stats' in g:
+        stats = g.sql_stats
+        stats['count'] += 1
+        stats['time'] += time.perf_counter() - conn.info['sql_started']
+        stats['statements'][fingerprint(statement)] += 1
+
+
+def _start_request():
+    g.sql_stats = {'count': 0, 'time': 0.0, 'statements': Counter()}
+
+
+def _finish_request(response):
+    # streamed bodies (exports, SSE) run their queries after this point and are not counted
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+    config = current_app.config
+    milliseconds = stats['time'] * 1000
+    response.headers['X-SQL-Queries'] = str(stats['count'])
+    response.headers.add('Server-Timing', f'db;dur={milliseconds:.2f};desc="{stats["count"]} queries"')
+
+    repeated = [(count, statement) for statement, count in stats['statements'].most_common()
+                if count >= config['SQL_REPEAT_THRESHOLD']]
+    message = f"{request.method} {request.path}: {stats['count']} queries in {milliseconds:.1f}ms"
+    if repeated:
+        current_app.logger.warning("%s; likely N+1: %s", message,
+                                   '; '.join(f"{count}x {statement[:200]}" for count, statement in repeated))
+    else:
+        current_app.logger.debug(message)
+
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    if budget is not None and stats['count'] > budget:
+        detail = f"{request.endpoint} ran {stats['count']} queries, budget is {budget}"
+        if config['SQL_QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(detail)
+        current_app.logger.warning(detail)
+    return response
+
+
+def init_instrumentation(app, engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,251 @@
+import time
+import weakref
+from bisect import bisect_left
+from threading import RLock, local
+from flask import current_app, request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardOwner:
+    # lives in the thread's local storage; when the thread exits it is collected and its shard retired
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self):
+        self.shard = {}
+
+
+class _Sharded:
+    # every thread writes only to its own shard, so the hot path takes no lock; the lock is held once
+    # per thread to register the shard, and scrapes merge all shards (a scrape may miss an update in flight).
+    # A thread's shard is folded into `_retired` when the thread exits, so servers that start a thread
+    # per connection keep one shard per live thread rather than one per thread ever seen
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = local()
+        self._shards = []
+        self._retired = {}
+        # reentrant: a finalizer may retire a shard in a thread that already holds the lock
+        self._lock = RLock()
+
+    def _shard(self):
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards.append(owner.shard)
+            weakref.finalize(owner, self._retire, owner.shard)
+            return owner.shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards = [live for live in self._shards if live is not shard]
+            self._merge(self._retired, shard.items())
+
+    def _snapshot(self):
+        # the retired totals are copied under the lock, so a shard retiring mid-scrape is counted exactly once
+        with self._lock:
+            shards = list(self._shards)
+            retired = list(self._retired.items())
+        return [retired] + [list(shard.items()) for shard in shards]
+
+    def shard_count(self):
+        with self._lock:
+            return len(self._shards)
+
+    def values(self):
+        totals = {}
+        for items in self._snapshot():
+            self._merge(totals, items)
+        return totals
+
+
+class Counter(_Sharded):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(totals, items):
+        for labels, value in items:
+            totals[labels] = totals.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in sorted(self.values().items()):
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Histogram(_Sharded):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # per label set: one slot per bucket plus +Inf, then sum and count
+        shard = self._shard()
+        slots = shard.get(labels)
+        if slots is None:
+            slots = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-2] += value
+        slots[-1] += 1
+
+    @staticmethod
+    def _merge(totals, items):
+        for labels, slots in items:
+            merged = totals.setdefault(labels, [0] * len(slots))
+            for i, value in enumerate(list(slots)):
+                merged[i] += value
+
+    def samples(self):
+        bounds = (*self.buckets, float('inf'))
+        for labels, slots in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, slots):
+                cumulative += count
+                yield f'{self.name}_bucket', _labels(self.labelnames, labels, [('le', _number(bound))]), cumulative
+            yield f'{self.name}_sum', _labels(self.labelnames, labels), slots[-2]
+            yield f'{self.name}_count', _labels(self.labelnames, labels), slots[-1]
+
+
+class Gauge:
+    # read at scrape time from `collect`, which returns (label values, value) pairs
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self.register(Gauge(name, help, labelnames, collect))
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+def _lot_rows():
+    from vehicle import db
+    from vehicle.models import ParkingLot
+    return db.session.execute(db.select(ParkingLot.lot_id, ParkingLot.primary_location, ParkingLot.occupied_count,
+                                        ParkingLot.available_count, ParkingLot.max_spots).order_by(ParkingLot.lot_id)).all()
+
+
+def _lot_spots():
+    for lot_id, location, occupied, available, _ in _lot_rows():
+        yield (lot_id, location, 'occupied'), occupied
+        yield (lot_id, location, 'available'), available
+
+
+def _lot_occupancy():
+    for lot_id, location, occupied, _, max_spots in _lot_rows():
+        yield (lot_id, location), occupied / max_spots if max_spots else 0.0
+
+
+def make_registry():
+    registry = MetricsRegistry()
+    registry.counter('parking_http_requests_total', "Requests handled, by endpoint and status code.", ('endpoint', 'status'))
+    registry.histogram('parking_http_request_duration_seconds', "Time from receiving the request to returning the response, by endpoint.", ('endpoint',))
+    registry.counter('parking_bookings_total', "Booking attempts, by outcome.", ('result',))
+    registry.counter('parking_advance_bookings_total', "Advance booking attempts, by outcome.", ('result',))
+    registry.counter('parking_releases_total', "Release attempts, by outcome.", ('result',))
+    registry.counter('parking_logins_total', "Login attempts, by outcome.", ('result',))
+    registry.histogram('parking_spot_claim_seconds', "Time to claim a free spot for a booking.")
+    registry.counter('parking_spot_claim_retries_total', "Spot claims retried, because another booking took the spot first (conflict) or the database stayed locked (busy).", ('reason',))
+    registry.gauge('parking_lot_spots', "Spots per lot, by status.", ('lot_id', 'location', 'status'), _lot_spots)
+    registry.gauge('parking_lot_occupancy_ratio', "Occupied share of each lot's spots.", ('lot_id', 'location'), _lot_occupancy)
+    return registry
+
+
+def count(name, *labels):
+    # _get_current_object() skips the proxy's attribute lookup, which alone costs more than the increment
+    registry = current_app._get_current_object().extensions.get('metrics')
+    if registry is not None:
+        registry[name].inc(*labels)
+
+
+def observe(name, value, *labels):
+    registry = current_app._get_current_object().extensions.get('metrics')
+    if registry is not None:
+        registry[name].observe(value, *labels)
+
+
+def init_metrics(app):
+    # the hot path avoids flask's context proxies (each costs microseconds): the WSGI wrapper stamps the
+    # start time into the environ, and the after_request hook dereferences `request` once
+    registry = app.extensions['metrics'] = make_registry()
+    durations = registry['parking_http_request_duration_seconds']
+    requests = registry['parking_http_requests_total']
+    wsgi_app = app.wsgi_app
+
+    def timed_wsgi_app(environ, start_response):
+        environ['vehicle.metrics_started'] = time.perf_counter()
+        return wsgi_app(environ, start_response)
+
+    def finish_request(response):
+        # streamed bodies (exports, SSE) are timed up to the first byte only
+        current = request._get_current_object()
+        started = current.environ.get('vehicle.metrics_started')
+        if started is not None:
+            endpoint = current.endpoint or 'unmatched'
+            durations.observe(time.perf_counter() - started, endpoint)
+            requests.inc(endpoint, response.status_code)
+        return response
+
+    app.wsgi_app = timed_wsgi_app
+    app.after_request(finish_request)
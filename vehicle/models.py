@@ -1,7 +1,11 @@
 from . import db
 from datetime import datetime, timedelta
 from vehicle import bcrypt
+from flask import current_app
 from flask_login import UserMixin
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from vehicle.metrics import count
 import math
 
 class User(db.Model, UserMixin):
@@ -23,10 +27,14 @@ class User(db.Model, UserMixin):
     
     @password.setter
     def password(self, plain_text_password):
-        self.password_hash = bcrypt.generate_password_hash(plain_text_password).decode('utf-8')
+        self.password_hash = current_app.extensions['password_pool'].run(bcrypt.generate_password_hash, plain_text_password).decode('utf-8')
 
     def check_password(self, password_to_check):
-        return bcrypt.check_password_hash(self.password_hash, password_to_check)
+        return current_app.extensions['password_pool'].run(bcrypt.check_password_hash, self.password_hash, password_to_check)
+
+    def needs_rehash(self):
+        # bcrypt hashes look like $2b$<rounds>$<salt+digest>
+        return int(self.password_hash.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
     
     @property
     def full_name(self):
@@ -40,11 +48,64 @@ class ParkingLot(db.Model):
     pincode = db.Column(db.String(6), nullable = False)
     max_spots = db.Column(db.Integer(), nullable = False)
     cost_per_unit = db.Column(db.Integer(), nullable = False)
+    # denormalized spot status counts, kept in step with parking_spot by the booking/lot routes
+    available_count = db.Column(db.Integer(), nullable = False, default = 0, server_default = '0')
+    occupied_count = db.Column(db.Integer(), nullable = False, default = 0, server_default = '0')
+    # bumped whenever the lot or one of its spots changes; cached lot cards are validated against it
+    version = db.Column(db.Integer(), nullable = False, default = 1, server_default = '1')
     parking_spots = db.relationship('ParkingSpot', backref = 'lot', lazy= True, cascade='all, delete-orphan',
     passive_deletes=True)
+    # AUTOINCREMENT: a deleted lot's id is never handed to a new lot, so (lot_id, version) names one
+    # state of one lot for good and the ETags and caches keyed on it cannot match a different lot
+    __table_args__ = {'sqlite_autoincrement': True}
 
     def available_spots(self):
-        return sum(1 for spot in self.parking_spots if spot.status == 'A')
+        return self.available_count
+
+    def has_occupied_spots(self):
+        return db.session.query(ParkingSpot.query.filter_by(lot_id=self.lot_id, status='O').exists()).scalar()
+
+    def held_spot_count(self, now):
+        # spots a shrink has to keep: occupied, or free but booked ahead for a window that has not ended
+        return ParkingSpot.query.filter(ParkingSpot.lot_id == self.lot_id,
+                                        db.or_(ParkingSpot.status == 'O', AdvanceBooking.overlapping(ParkingSpot.spot_id, now))).count()
+
+    def has_upcoming_bookings(self, now):
+        return db.session.query(AdvanceBooking.query.filter(AdvanceBooking.lot_id == self.lot_id, AdvanceBooking.status == 'B',
+                                                            AdvanceBooking.end_time > now).exists()).scalar()
+
+    def archive_history(self):
+        # copy the lot details onto every reservation of its spots with one UPDATE, so the history
+        # survives the ON DELETE CASCADE / SET NULL when the lot goes away
+        lot_spots = db.select(ParkingSpot.spot_id).where(ParkingSpot.lot_id == self.lot_id)
+        return Reservation.query.filter(Reservation.spot_id.in_(lot_spots)).update({
+            Reservation.archived_spot_id: Reservation.spot_id,
+            Reservation.archived_lot_id: self.lot_id,
+            Reservation.archived_primary_location: self.primary_location,
+        }, synchronize_session=False)
+
+    @classmethod
+    def adjust_counts(cls, lot_id, occupied_delta):
+        cls.query.filter_by(lot_id=lot_id).update({cls.available_count: cls.available_count - occupied_delta,
+                                                   cls.occupied_count: cls.occupied_count + occupied_delta,
+                                                   cls.version: cls.version + 1})
+
+    @classmethod
+    def touch(cls, lot_id):
+        # bump the version alone, for changes that do not move the counters (advance bookings)
+        cls.query.filter_by(lot_id=lot_id).update({cls.version: cls.version + 1})
+
+    @classmethod
+    def reconcile_counts(cls, lot_ids=None):
+        # recompute the counters from parking_spot in one UPDATE
+        def spots_with(status):
+            return db.select(db.func.count(ParkingSpot.spot_id))\
+                .where(ParkingSpot.lot_id == cls.lot_id, ParkingSpot.status == status).scalar_subquery()
+        query = cls.query
+        if lot_ids is not None:
+            query = query.filter(cls.lot_id.in_(lot_ids))
+        return query.update({cls.available_count: spots_with('A'), cls.occupied_count: spots_with('O'),
+                             cls.version: cls.version + 1}, synchronize_session='fetch')
 
 
 class ParkingSpot(db.Model):
@@ -56,8 +117,82 @@ class ParkingSpot(db.Model):
     reservations = db.relationship('Reservation', backref = 'spot', lazy = True, passive_deletes=True)
     __table_args__ = (
         db.UniqueConstraint('lot_id', 'spot_index', name='unique_lot_spot_index'),
+        db.Index('ix_parking_spot_lot_status_index', 'lot_id', 'status', 'spot_index'),
     )
 
+    @classmethod
+    def provision(cls, lot_id, spot_indexes):
+        # one executemany INSERT rather than an ORM add per spot
+        rows = [{'lot_id': lot_id, 'status': 'A', 'spot_index': index} for index in spot_indexes]
+        if rows:
+            db.session.execute(db.insert(cls), rows)
+        return len(rows)
+
+    @classmethod
+    def retire_free(cls, lot, count):
+        # drop the `count` highest free spots of the lot, archiving their history with a single UPDATE first;
+        # spots booked ahead are never retired, callers check held_spot_count() first
+        spot_ids = db.session.scalars(db.select(cls.spot_id).filter_by(lot_id=lot.lot_id, status='A')
+                                      .where(~AdvanceBooking.overlapping(cls.spot_id, datetime.now()))
+                                      .order_by(cls.spot_index.desc()).limit(count)).all()
+        if spot_ids:
+            Reservation.query.filter(Reservation.spot_id.in_(spot_ids)).update({
+                Reservation.archived_spot_id: Reservation.spot_id,
+                Reservation.archived_lot_id: lot.lot_id,
+                Reservation.archived_primary_location: lot.primary_location,
+            }, synchronize_session=False)
+            cls.query.filter(cls.spot_id.in_(spot_ids)).delete(synchronize_session=False)
+        return spot_ids
+
+    @classmethod
+    def first_free_by_lot(cls, lot_ids):
+        # lot_id -> lowest free spot_id, for all the given lots in one grouped query
+        return dict(db.session.query(cls.lot_id, db.func.min(cls.spot_id))
+                    .filter(cls.lot_id.in_(lot_ids), cls.status == 'A')
+                    .group_by(cls.lot_id).all())
+
+    @classmethod
+    def claim_many(cls, lot_id, count, until=None, now=None):
+        # claims up to `count` free spots of the lot in a single UPDATE ... RETURNING, so the pick and
+        # the status change cannot interleave with a concurrent booking; with `until`, spots booked
+        # ahead for a window starting before then are left alone
+        free_ids = db.select(cls.spot_id).filter_by(lot_id=lot_id, status='A').order_by(cls.spot_index).limit(count)
+        if until is not None:
+            free_ids = free_ids.where(~AdvanceBooking.overlapping(cls.spot_id, now or datetime.now(), until))
+        claimed = db.session.scalars(db.update(cls).where(cls.spot_id.in_(free_ids), cls.status == 'A')
+                                     .values(status='O').returning(cls.spot_id)
+                                     .execution_options(synchronize_session=False)).all()
+        return sorted(claimed)
+
+    @classmethod
+    def claim_available(cls, lot_id, attempts=5, until=None, now=None):
+        # conditional UPDATE ... WHERE status = 'A': if a concurrent booking took the spot first,
+        # rowcount is 0 and we move on to the next free spot instead of double-booking it
+        query = cls.query.filter_by(lot_id=lot_id, status='A')
+        if until is not None:
+            query = query.filter(~AdvanceBooking.overlapping(cls.spot_id, now or datetime.now(), until))
+        for _ in range(attempts):
+            # the whole attempt is retried: under write contention the SELECT can hit the busy timeout too
+            try:
+                spot = query.order_by(cls.spot_index).first()
+                if not spot:
+                    return None
+                claimed = cls.query.filter_by(spot_id=spot.spot_id, status='A').update({'status': 'O'})
+                if claimed:
+                    ParkingLot.adjust_counts(lot_id, 1)
+                    return spot
+            except OperationalError:
+                # database stayed locked past the busy timeout, start over with a fresh transaction
+                count('parking_spot_claim_retries_total', 'busy')
+                db.session.rollback()
+                continue
+            count('parking_spot_claim_retries_total', 'conflict')
+            db.session.expire(spot)
+        return None
+
+def _overage_due_default(context):
+    return context.get_current_parameters()['checkout_time']
+
 class Reservation(db.Model):
     r_id = db.Column(db.Integer(), primary_key = True)
     user_id = db.Column(db.Integer(), db.ForeignKey('user.id'))
@@ -73,6 +208,20 @@ class Reservation(db.Model):
     archived_primary_location = db.Column(db.String(100))
     archived_spot_id = db.Column(db.Integer())
     archived_lot_id = db.Column(db.Integer())
+    # set by the expiry scheduler once the booked end has passed; overage_due_at is when the accrued
+    # overage next changes (the booked end, then every further hour) and drives the scheduler's queue
+    overstayed_at = db.Column(db.DateTime)
+    overage_cost = db.Column(db.Float)
+    overage_due_at = db.Column(db.DateTime, default = _overage_due_default)
+    __table_args__ = (
+        db.Index('ix_reservation_spot_checkin', 'spot_id', 'checkin_time'),
+        # also serves plain user_id lookups, so user_id has no index of its own
+        db.Index('ix_reservation_user_checkin', 'user_id', 'checkin_time'),
+        # partial indexes: only reservations that are still open
+        db.Index('ix_reservation_active_nameplate', 'nameplate_num', sqlite_where=db.text('actual_checkout_time IS NULL')),
+        db.Index('ix_reservation_active_spot', 'spot_id', sqlite_where=db.text('actual_checkout_time IS NULL')),
+        db.Index('ix_reservation_active_overage_due', 'overage_due_at', sqlite_where=db.text('actual_checkout_time IS NULL')),
+    )
 
     @property
     def total_cost(self):
@@ -105,4 +254,170 @@ class Reservation(db.Model):
         hours = max(1, math.ceil(parking_duration.total_seconds() / 3600))
         return round(hours * self.cost_per_unit, 2)
 
+    def calculate_overage_at(self, end_time):
+        # every started hour past the booked end, at the booked rate
+        if end_time <= self.checkout_time:
+            return None
+        hours = math.ceil((end_time - self.checkout_time).total_seconds() / 3600)
+        return round(hours * self.cost_per_unit, 2)
+
+    @property
+    def is_released(self):
+        return self.actual_checkout_time is not None or self.spot is None or self.spot.status == 'A'
+
+    def check_out(self, end_time):
+        # callers adjust the lot counters, so a batch can do it once per lot
+        self.actual_checkout_time = end_time
+        self.final_cost = self.calculate_cost_at(end_time)
+        self.overage_cost = self.calculate_overage_at(end_time)
+        self.spot.status = 'A'
+
+    @classmethod
+    def active_nameplates(cls, nameplates):
+        return set(db.session.scalars(db.select(cls.nameplate_num)
+                                      .where(cls.actual_checkout_time.is_(None), cls.nameplate_num.in_(nameplates))))
+
+    @classmethod
+    def active_by_spot(cls, lot_ids=None):
+        # spot_id -> currently open reservation, fetched in a single query
+        query = cls.query.filter(cls.actual_checkout_time.is_(None), cls.spot_id.isnot(None))
+        if lot_ids is not None:
+            query = query.join(ParkingSpot).filter(ParkingSpot.lot_id.in_(lot_ids))
+        return {res.spot_id: res for res in query.order_by(cls.checkin_time)}
+
+
+class AdvanceBooking(db.Model):
+    # a spot held for a future [start_time, end_time) window. status: 'B' booked, 'I' checked in (r_id is
+    # the reservation it became), 'C' cancelled. Booked windows of one spot never overlap each other or the
+    # booked end of the car parked there, which reserve() checks in the same statement as the insert
+    __tablename__ = 'advance_booking'
+    booking_id = db.Column(db.Integer(), primary_key = True)
+    user_id = db.Column(db.Integer(), db.ForeignKey('user.id'), nullable = False)
+    lot_id = db.Column(db.Integer(), db.ForeignKey('parking_lot.lot_id', name='fk_advance_booking_lot', ondelete = 'CASCADE'), nullable = False)
+    spot_id = db.Column(db.Integer(), db.ForeignKey('parking_spot.spot_id', name='fk_advance_booking_spot', ondelete = 'SET NULL'))
+    r_id = db.Column(db.Integer(), db.ForeignKey('reservation.r_id'))
+    start_time = db.Column(db.DateTime, nullable = False)
+    end_time = db.Column(db.DateTime, nullable = False)
+    vehicle_model = db.Column(db.String(length=20), nullable = False)
+    nameplate_num = db.Column(db.String(15), nullable = False)
+    cost_per_unit = db.Column(db.Float, nullable = False)
+    estimated_cost = db.Column(db.Float, nullable = False)
+    status = db.Column(db.String(1), nullable = False, default = 'B', server_default = 'B')
+    lot = db.relationship('ParkingLot')
+    spot = db.relationship('ParkingSpot')
+    __table_args__ = (
+        db.Index('ix_advance_booking_user_start', 'user_id', 'start_time'),
+        # partial indexes: only windows that still hold a spot
+        db.Index('ix_advance_booking_spot_start', 'spot_id', 'start_time', sqlite_where=db.text("status = 'B'")),
+        db.Index('ix_advance_booking_lot_end', 'lot_id', 'end_time', sqlite_where=db.text("status = 'B'")),
+        db.Index('ix_advance_booking_nameplate', 'nameplate_num', sqlite_where=db.text("status = 'B'")),
+    )
+
+    @classmethod
+    def overlapping(cls, spot_id, start, end=None):
+        # EXISTS: a booked window of `spot_id` (a value or a correlated column) meets [start, end)
+        criteria = [cls.spot_id == spot_id, cls.status == 'B', cls.end_time > start]
+        if end is not None:
+            criteria.append(cls.start_time < end)
+        return db.exists().where(*criteria)
+
+    @classmethod
+    def nameplate_booked(cls, nameplate, start, end):
+        return db.session.query(cls.query.filter(cls.nameplate_num == nameplate, cls.status == 'B',
+                                                 cls.start_time < end, cls.end_time > start).exists()).scalar()
+
+    @classmethod
+    def reserve(cls, spot_id, **values):
+        # INSERT ... SELECT ... WHERE NOT EXISTS: the conflict check and the insert are one statement,
+        # so two bookings racing for the same spot cannot both land; returns the new booking_id or None
+        start, end = values['start_time'], values['end_time']
+        parked = db.exists().where(Reservation.spot_id == spot_id, Reservation.actual_checkout_time.is_(None), Reservation.checkout_time > start)
+        values = {'spot_id': spot_id, 'status': 'B', **values}
+        source = db.select(*[db.literal(value, cls.__table__.c[key].type).label(key) for key, value in values.items()])\
+            .where(~cls.overlapping(spot_id, start, end), ~parked)
+        return db.session.scalar(db.insert(cls).from_select(list(values), source).returning(cls.booking_id))
+
+    @classmethod
+    def upcoming_for(cls, user_id, now):
+        return cls.query.options(db.joinedload(cls.lot)).filter(cls.user_id == user_id, cls.status == 'B', cls.end_time > now)\
+            .order_by(cls.start_time).all()
+
+    def check_in(self, now):
+        # parks the car on the booked spot, or on another free spot of the lot when that one is still taken
+        # (an overstay) or was retired; returns the new reservation, or None when nothing is free
+        if self.spot_id is not None and ParkingSpot.query.filter_by(spot_id=self.spot_id, status='A').update({'status': 'O'}):
+            ParkingLot.adjust_counts(self.lot_id, 1)
+            spot_id = self.spot_id
+        else:
+            spot = ParkingSpot.claim_available(self.lot_id, until=self.end_time, now=now)
+            if spot is None:
+                return None
+            spot_id = spot.spot_id
+        reservation = Reservation(spot_id=spot_id, user_id=self.user_id, checkin_time=now, checkout_time=self.end_time,
+                                  vehicle_model=self.vehicle_model, nameplate_num=self.nameplate_num,
+                                  cost_per_unit=self.cost_per_unit, estimated_cost=self.estimated_cost)
+        db.session.add(reservation)
+        db.session.flush()
+        self.spot_id = spot_id
+        self.r_id = reservation.r_id
+        self.status = 'I'
+        return reservation
+
+
+class LotDailyRollup(db.Model):
+    # per lot and checkout day: revenue, finished reservations and hours parked. Rows are bumped
+    # when a reservation is finalized and can be rebuilt from reservation with rebuild();
+    # lot_id is not a foreign key so the history outlives deleted lots (-1 when the lot is unknown)
+    __tablename__ = 'lot_daily_rollup'
+    lot_id = db.Column(db.Integer(), primary_key = True, autoincrement = False)
+    day = db.Column(db.Date(), primary_key = True)
+    primary_location = db.Column(db.String(100))
+    revenue = db.Column(db.Float, nullable = False, default = 0, server_default = '0')
+    reservations = db.Column(db.Integer(), nullable = False, default = 0, server_default = '0')
+    occupied_hours = db.Column(db.Float, nullable = False, default = 0, server_default = '0')
+    __table_args__ = (
+        db.Index('ix_lot_daily_rollup_day', 'day'),
+    )
+
+    @classmethod
+    def add_checkouts(cls, reservations):
+        # fold freshly checked-out reservations into their (lot, day) rows with one upsert
+        totals = {}
+        for res in reservations:
+            key = (res.spot.lot_id, res.actual_checkout_time.date())
+            row = totals.setdefault(key, {'lot_id': key[0], 'day': key[1], 'primary_location': res.spot.lot.primary_location,
+                                          'revenue': 0, 'reservations': 0, 'occupied_hours': 0})
+            row['revenue'] += res.final_cost or 0
+            row['reservations'] += 1
+            row['occupied_hours'] += (res.actual_checkout_time - res.checkin_time).total_seconds() / 3600
+        if totals:
+            stmt = sqlite_insert(cls.__table__)
+            db.session.execute(stmt.on_conflict_do_update(index_elements=['lot_id', 'day'], set_={
+                'primary_location': stmt.excluded.primary_location,
+                'revenue': cls.__table__.c.revenue + stmt.excluded.revenue,
+                'reservations': cls.__table__.c.reservations + stmt.excluded.reservations,
+                'occupied_hours': cls.__table__.c.occupied_hours + stmt.excluded.occupied_hours,
+            }), list(totals.values()))
 
+    @classmethod
+    def rebuild(cls, start=None, end=None):
+        # recompute the rows of [start, end] (dates, inclusive) from reservation in one INSERT ... SELECT
+        day = db.func.date(Reservation.actual_checkout_time)
+        lot_id = db.func.coalesce(ParkingSpot.lot_id, Reservation.archived_lot_id, -1)
+        rollup = cls.query
+        source = db.select(lot_id, day, db.func.max(db.func.coalesce(ParkingLot.primary_location, Reservation.archived_primary_location)),
+                           db.func.coalesce(db.func.sum(Reservation.final_cost), 0), db.func.count(Reservation.r_id),
+                           db.func.sum((db.func.julianday(Reservation.actual_checkout_time) - db.func.julianday(Reservation.checkin_time)) * 24))\
+            .outerjoin(ParkingSpot, ParkingSpot.spot_id == Reservation.spot_id)\
+            .outerjoin(ParkingLot, ParkingLot.lot_id == ParkingSpot.lot_id)\
+            .where(Reservation.actual_checkout_time.isnot(None))\
+            .group_by(lot_id, day)
+        if start:
+            rollup = rollup.filter(cls.day >= start)
+            source = source.where(Reservation.actual_checkout_time >= start)
+        if end:
+            rollup = rollup.filter(cls.day <= end)
+            source = source.where(Reservation.actual_checkout_time < end + timedelta(days=1))
+        rollup.delete(synchronize_session=False)
+        return db.session.execute(db.insert(cls).from_select(
+            ['lot_id', 'day', 'primary_location', 'revenue', 'reservations', 'occupied_hours'], source)).rowcount
@@ -0,0 +1,12 @@
+from sqlalchemy import tuple_
+
+
+def keyset_page(query, key_columns, after=None, page_size=20, descending=False):
+    # seek past the sort key of the previous page's last row instead of using OFFSET,
+    # so every page costs the same no matter how deep into the history it is
+    key = tuple_(*key_columns)
+    if after is not None:
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    order = [column.desc() if descending else column for column in key_columns]
+    rows = query.order_by(*order).limit(page_size + 1).all()
+    return rows[:page_size], len(rows) > page_size
@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordPool:
+    # runs bcrypt work on a fixed set of threads; once `workers + max_pending` jobs are in flight,
+    # new ones are refused instead of queueing up behind a login storm
+
+    def __init__(self, workers=4, max_pending=32):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = BoundedSemaphore(workers + max_pending)
+
+    def run(self, fn, *args, timeout=None):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout=timeout)
@@ -0,0 +1,42 @@
+from sqlalchemy import event
+import sqlite3
+
+# Engine profiles selectable through app.config['SQLITE_PROFILE'].
+# "default" keeps SQLite's stock rollback journal; "production" switches to WAL so readers
+# no longer block on booking writes, waits on locks instead of failing with "database is locked",
+# and gives every pooled connection a larger page cache and memory-mapped reads.
+PROFILES = {
+    'default': {
+        'pragmas': {},
+        'engine_options': {},
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'busy_timeout': 5000,
+            'synchronous': 'NORMAL',
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+        },
+        'engine_options': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 30,
+            'pool_pre_ping': False,
+        },
+    },
+}
+
+
+def apply_pragmas(engine, pragmas):
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()